@@ -1,34 +1,186 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.html import format_html
 
-from .models import Post, Group, Comment, Follow
+from yatube.sqlite import immediate_atomic
 
+from . import jobs
+from .models import Post, Group, Comment, Follow, BulkJob, User
+from .paginators import EstimatedPaginator
+from .search import filter_posts
 
-class PostAdmin(admin.ModelAdmin):
+
+class BaseAdmin(admin.ModelAdmin):
+    # Список без полного COUNT по таблице: число записей оценивается,
+    # а «показать все (N)» не считается вовсе
+    paginator = EstimatedPaginator
+    show_full_result_count = False
+    empty_value_display = '-пусто-'
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans=orphans,
+                              allow_empty_first_page=allow_empty_first_page)
+
+
+class ConfirmForm(forms.Form):
+    def job_params(self):
+        return {}
+
+
+class MoveToGroupForm(ConfirmForm):
+    group = forms.ModelChoiceField(Group.objects.all(), label='Группа')
+
+    def job_params(self):
+        return {'group_id': self.cleaned_data['group'].pk}
+
+
+class ReassignAuthorForm(ConfirmForm):
+    username = forms.CharField(label='Новый автор')
+
+    def clean_username(self):
+        username = self.cleaned_data['username']
+        author = User.objects.filter(username=username).first()
+        if author is None:
+            raise forms.ValidationError('Пользователь не найден')
+        return author
+
+    def job_params(self):
+        return {'author_id': self.cleaned_data['username'].pk}
+
+
+class BulkJobActionsMixin:
+    """Массовые действия, которые выполняются в фоне (см. ``jobs``).
+
+    Стандартное удаление убрано: оно загружает выбранные объекты
+    со всеми связанными и удаляет их по одному прямо в запросе.
+    """
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def run_job(self, request, queryset, action, form_class=ConfirmForm):
+        form = form_class(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            # Промежуточная страница с параметрами и подтверждением
+            return render(request, 'admin/posts/bulk_job_form.html', {
+                **self.admin_site.each_context(request),
+                'title': dict(BulkJob.ACTIONS)[action],
+                'opts': self.model._meta,
+                'form': form,
+                'action': request.POST['action'],
+                'count': queryset.count(),
+                'select_across': request.POST.get('select_across', '0'),
+                'selected': request.POST.getlist(
+                    helpers.ACTION_CHECKBOX_NAME),
+                'checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            })
+        job = jobs.start(action, queryset, request.user, **form.job_params())
+        url = reverse('admin:posts_bulkjob_change', args=[job.pk])
+        self.message_user(request, format_html(
+            'Запущено <a href="{}">{}</a>, объектов: {}', url, job, job.total),
+            messages.SUCCESS)
+        return None
+
+
+class PostAdmin(BulkJobActionsMixin, BaseAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author')
+    list_select_related = ('author',)
     search_fields = ('text',)
+    # Фильтр и навигация по датам — диапазоны по индексу post_pub_date_idx
     list_filter = ('pub_date',)
-    empty_value_display = '-пусто-'
+    date_hierarchy = 'pub_date'
+    raw_id_fields = ('author', 'group')
+    actions = ('delete_posts', 'move_to_group', 'reassign_author')
+
+    def changeform_view(self, request, *args, **kwargs):
+        if request.method != 'POST':
+            return super().changeform_view(request, *args, **kwargs)
+        # Картинка сохраняется под той же блокировкой, что и в
+        # images.save_post: иначе images.release может удалить файл,
+        # на который пост вот-вот сошлется
+        with immediate_atomic():
+            return super().changeform_view(request, *args, **kwargs)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Ищем по полнотекстовому индексу, а не LIKE по всей таблице
+        if not search_term:
+            return queryset, False
+        return filter_posts(queryset, search_term), False
 
+    def delete_posts(self, request, queryset):
+        return self.run_job(request, queryset, 'delete_posts')
+    delete_posts.short_description = 'Удалить выбранные посты (в фоне)'
+    delete_posts.allowed_permissions = ('delete',)
 
-class GroupAdmin(admin.ModelAdmin):
+    def move_to_group(self, request, queryset):
+        return self.run_job(request, queryset, 'move_to_group',
+                            MoveToGroupForm)
+    move_to_group.short_description = 'Перенести в группу (в фоне)'
+    move_to_group.allowed_permissions = ('change',)
+
+    def reassign_author(self, request, queryset):
+        return self.run_job(request, queryset, 'reassign_author',
+                            ReassignAuthorForm)
+    reassign_author.short_description = 'Сменить автора (в фоне)'
+    reassign_author.allowed_permissions = ('change',)
+
+
+class GroupAdmin(BaseAdmin):
     list_display = ('pk', 'title', 'description')
-    search_fields = ('title',)
-    empty_value_display = '-пусто-'
+    search_fields = ('=slug', 'title')
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(BulkJobActionsMixin, BaseAdmin):
     list_display = ('post', 'author', 'text', 'created')
-    search_fields = ('author',)
-    empty_value_display = '-пусто-'
+    list_select_related = ('post', 'author')
+    # Точное совпадение по уникальному индексу username
+    search_fields = ('=author__username',)
+    date_hierarchy = 'created'
+    raw_id_fields = ('post', 'author')
+    actions = ('delete_comments',)
+
+    def delete_comments(self, request, queryset):
+        return self.run_job(request, queryset, 'delete_comments')
+    delete_comments.short_description = ('Удалить выбранные комментарии '
+                                         '(в фоне)')
+    delete_comments.allowed_permissions = ('delete',)
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(BaseAdmin):
     list_display = ('user', 'author')
-    search_fields = ('user',)
-    empty_value_display = '-пусто-'
+    list_select_related = ('user', 'author')
+    search_fields = ('=user__username', '=author__username')
+    raw_id_fields = ('user', 'author')
+
+
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'progress_display', 'created_by',
+                    'created', 'finished')
+    list_select_related = ('created_by',)
+    list_filter = ('status', 'action')
+    fields = ('action', 'status', 'progress_display', 'params', 'error',
+              'created_by', 'created', 'finished')
+    readonly_fields = fields
+
+    def progress_display(self, obj):
+        return f'{obj.processed} из {obj.total} ({obj.progress}%)'
+    progress_display.short_description = 'Выполнено'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(BulkJob, BulkJobAdmin)
@@ -0,0 +1,159 @@
+"""JSON API лент только для чтения.
+
+Отдает те же данные, что ``index``, ``group_post``, ``profile``
+и ``post_view``, но без шаблонов: строки берутся из ``.values()`` без
+создания моделей и сериализуются частями в ``StreamingHttpResponse``.
+Ленты разбиты курсорами (``after``/``before``, размер — ``limit``),
+ETag и Last-Modified те же, что у HTML-страниц.
+"""
+from urllib.parse import urlencode
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
+
+from .conditions import (conditional, group_state, index_state,
+                         post_state, profile_state)
+from .models import Comment, Group, Post, User
+from .paginators import PER_PAGE, CursorPaginator
+
+MAX_LIMIT = 100
+
+# Сколько объектов сериализуется в один кусок потока
+CHUNK_SIZE = 100
+
+POST_FIELDS = ('id', 'text', 'pub_date', 'updated', 'image',
+               'author__username', 'group__slug', 'comments_count')
+
+COMMENT_FIELDS = ('id', 'text', 'created', 'author__username')
+
+# Адреса картинок строит хранилище поля, а не default_storage
+IMAGE_STORAGE = Post._meta.get_field('image').storage
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def serialize_post(row):
+    return {
+        'id': row['id'],
+        'author': row['author__username'],
+        'group': row['group__slug'],
+        'text': row['text'],
+        'pub_date': row['pub_date'],
+        'updated': row['updated'],
+        'image': IMAGE_STORAGE.url(row['image']) if row['image'] else None,
+        'comments_count': row['comments_count'],
+    }
+
+
+def serialize_comment(row):
+    return {
+        'id': row['id'],
+        'author': row['author__username'],
+        'text': row['text'],
+        'created': row['created'],
+    }
+
+
+def stream_json(head, key, items):
+    """Куски JSON-объекта ``head`` со списком ``items`` в поле ``key``.
+
+    Список кодируется по ``CHUNK_SIZE`` элементов, так что в памяти
+    не бывает всего ответа целиком.
+    """
+    prefix = _encoder.encode(head)[:-1]
+    yield '{}{}{}:['.format(prefix, ',' if head else '', _encoder.encode(key))
+    chunk = []
+    separator = ''
+    for item in items:
+        chunk.append(_encoder.encode(item))
+        if len(chunk) == CHUNK_SIZE:
+            yield separator + ','.join(chunk)
+            chunk = []
+            separator = ','
+    if chunk:
+        yield separator + ','.join(chunk)
+    yield ']}'
+
+
+def not_found():
+    return JsonResponse({'detail': 'Не найдено'}, status=404)
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', PER_PAGE))
+    except ValueError:
+        limit = PER_PAGE
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def _link(request, cursor_name, cursor, limit):
+    if cursor is None:
+        return None
+    params = {cursor_name: cursor}
+    if limit != PER_PAGE:
+        params['limit'] = limit
+    return '{}?{}'.format(request.path, urlencode(params))
+
+
+def feed_response(request, posts):
+    limit = _limit(request)
+    paginator = CursorPaginator(posts.values(*POST_FIELDS), limit)
+    page = paginator.get_page(after=request.GET.get('after'),
+                              before=request.GET.get('before'))
+    head = {
+        'next': _link(request, 'after', page.next_cursor, limit),
+        'previous': _link(request, 'before', page.previous_cursor, limit),
+    }
+    items = map(serialize_post, page.object_list)
+    return StreamingHttpResponse(stream_json(head, 'results', items),
+                                 content_type='application/json')
+
+
+@require_safe
+@conditional(index_state, 'json')
+def index(request):
+    return feed_response(request, Post.objects.for_feed())
+
+
+@require_safe
+@conditional(group_state, 'json')
+def group_post(request, slug):
+    group_id = (Group.objects.filter(slug=slug)
+                .values_list('pk', flat=True).first())
+    if group_id is None:
+        return not_found()
+    return feed_response(request, Post.objects.for_feed()
+                         .filter(group_id=group_id))
+
+
+@require_safe
+@conditional(profile_state, 'json')
+def profile(request, username):
+    author_id = (User.objects.filter(username=username)
+                 .values_list('pk', flat=True).first())
+    if author_id is None:
+        return not_found()
+    return feed_response(request, Post.objects.for_feed()
+                         .filter(author_id=author_id))
+
+
+@require_safe
+@conditional(post_state, 'json')
+def post_view(request, username, post_id):
+    post = (Post.objects.for_feed()
+            .filter(pk=post_id, author__username=username)
+            .values(*POST_FIELDS).first())
+    if post is None:
+        return not_found()
+    # Комментариев может быть много: читаем их курсором базы по мере
+    # отправки ответа
+    comments = (Comment.objects.filter(post_id=post['id'])
+                .order_by('created', 'id').values(*COMMENT_FIELDS)
+                .iterator(chunk_size=CHUNK_SIZE))
+    head = {'post': serialize_post(post)}
+    items = map(serialize_comment, comments)
+    return StreamingHttpResponse(stream_json(head, 'comments', items),
+                                 content_type='application/json')
+
@@ -0,0 +1,192 @@
+"""Нагрузочный прогон представлений постов.
+
+Набор данных генерируется детерминированно по ``seed`` и загружается
+через ``bulk.Importer``, запросы идут тестовым клиентом Django. Для
+каждого сценария считаются перцентили задержки, запросы в секунду
+и число SQL-запросов на запрос; результаты можно сохранить как базовые
+и сравнивать с ними следующие прогоны.
+"""
+import io
+import json
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from PIL import Image
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import bulk
+from .models import User
+
+SCENARIOS = ('index', 'group_post', 'profile', 'post_view',
+             'follow_index', 'new_post', 'add_comment')
+
+# Метрики, рост которых считается регрессией
+REGRESSION_METRICS = ('p50', 'p95', 'p99', 'queries')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _jpeg(rng):
+    color = tuple(rng.randrange(256) for _ in range(3))
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 800), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class Dataset:
+    """Параметры и ссылки на объекты сгенерированного набора данных."""
+
+    def __init__(self, users=50, posts=2000, comments=5000, follows=20,
+                 groups=10, images=20, seed=0):
+        self.users = users
+        self.posts = posts
+        self.comments = comments
+        self.follows = follows
+        self.groups = groups
+        self.images = images
+        self.seed = seed
+        self.usernames = [f'user{i}' for i in range(users)]
+        self.slugs = [f'group-{i}' for i in range(groups)]
+        # (автор, id) каждого поста для адресов post_view
+        self.post_refs = []
+
+    def records(self, media_root):
+        rng = random.Random(self.seed)
+        now = timezone.now()
+        for slug in self.slugs:
+            yield 'group', {'title': slug, 'slug': slug,
+                            'description': slug}
+        image_dir = os.path.join(media_root, 'posts')
+        os.makedirs(image_dir, exist_ok=True)
+        for post_id in range(1, self.posts + 1):
+            author = rng.choice(self.usernames)
+            image = ''
+            if post_id <= self.images:
+                image = f'posts/bench-{post_id}.jpg'
+                with open(os.path.join(media_root, image), 'wb') as file:
+                    file.write(_jpeg(rng))
+            self.post_refs.append((author, post_id))
+            yield 'post', {
+                'id': post_id,
+                'author': author,
+                'group': rng.choice(self.slugs + [None]),
+                'text': f'Пост {post_id} ' + 'текст ' * rng.randrange(50),
+                'pub_date': now - timedelta(minutes=self.posts - post_id),
+                'image': image,
+            }
+        for comment_id in range(1, self.comments + 1):
+            yield 'comment', {
+                'id': comment_id,
+                'post': rng.randrange(1, self.posts + 1),
+                'author': rng.choice(self.usernames),
+                'text': f'Комментарий {comment_id}',
+            }
+        for user in self.usernames:
+            others = [name for name in self.usernames if name != user]
+            for author in rng.sample(others, min(self.follows, len(others))):
+                yield 'follow', {'user': user, 'author': author}
+
+    def load(self, media_root):
+        importer = bulk.Importer(batch_size=1000)
+        importer.load(self.records(media_root))
+        importer.finish()
+        return importer.counts
+
+
+def requests_for(name, dataset, rng):
+    """Бесконечный поток ``(method, url, data)`` для сценария ``name``."""
+    while True:
+        author, post_id = rng.choice(dataset.post_refs)
+        if name == 'index':
+            yield 'get', reverse('index'), {'page': rng.randint(1, 3)}
+        elif name == 'group_post':
+            yield 'get', reverse('group_post', kwargs={
+                'slug': rng.choice(dataset.slugs)}), {}
+        elif name == 'profile':
+            yield 'get', reverse('profile', kwargs={
+                'username': rng.choice(dataset.usernames)}), {}
+        elif name == 'post_view':
+            yield 'get', reverse('post_view', kwargs={
+                'username': author, 'post_id': post_id}), {}
+        elif name == 'follow_index':
+            yield 'get', reverse('follow_index'), {}
+        elif name == 'new_post':
+            yield 'post', reverse('new_post'), {'text': 'Новый пост'}
+        elif name == 'add_comment':
+            yield 'post', reverse('add_comment', kwargs={
+                'username': author, 'post_id': post_id}), {
+                'text': 'Новый комментарий'}
+
+
+def run_scenario(name, dataset, requests=200, warmup=20, seed=0):
+    """Прогоняет сценарий и возвращает словарь метрик."""
+    rng = random.Random(seed)
+    client = Client()
+    # Читатель с подписками нужен и для follow_index, и для записи
+    client.force_login(User.objects.get(username=dataset.usernames[0]))
+    stream = requests_for(name, dataset, rng)
+    for _ in range(warmup):
+        method, url, data = next(stream)
+        getattr(client, method)(url, data)
+
+    latencies, queries = [], []
+    for _ in range(requests):
+        method, url, data = next(stream)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError(
+                f'{name}: {method.upper()} {url} -> {response.status_code}')
+        queries.append(len(captured.captured_queries))
+
+    return {
+        'requests': requests,
+        'rps': requests / sum(latencies),
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'queries': statistics.mean(queries),
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Регрессии относительно базовых результатов.
+
+    Возвращает список ``(сценарий, метрика, было, стало)`` для метрик,
+    выросших больше чем на ``tolerance``; число запросов к базе
+    сравнивается без допуска.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            allowed = base[metric] * (
+                1 if metric == 'queries' else 1 + tolerance)
+            if metrics[metric] > allowed + 1e-9:
+                regressions.append((name, metric, base[metric],
+                                    metrics[metric]))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
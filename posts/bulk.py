@@ -0,0 +1,362 @@
+"""Массовая выгрузка и загрузка групп, постов, комментариев и подписок.
+
+Форматы — NDJSON (объект на строку, модель в поле ``model``) и CSV
+(одна модель на файл). Пользователи и группы указываются по username
+и slug, посты — по id, так что выгрузку можно загрузить в другую базу;
+недостающие пользователи создаются без пароля.
+
+Id постов и комментариев из выгрузки сохраняются, если свободны; если
+id занят другой записью, объект получает новый id, а комментарии из той
+же загрузки идут за постом по карте ``Importer.post_ids``. Запись,
+совпадающая с существующей по автору и дате (комментарий — еще и по
+посту), считается загруженной раньше и пропускается, поэтому повторная
+загрузка ничего не дублирует.
+
+Загрузка идет пачками ``bulk_create``, каждая пачка — своя транзакция.
+Сигналы при этом не срабатывают, поэтому счетчики ``UserStats``, ленты
+подписок и версии кэша лент обновляются один раз в ``Importer.finish()``.
+"""
+import csv
+import json
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from yatube.sqlite import immediate_atomic
+
+from . import feed_cache, timeline
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+# Порядок важен: каждая модель ссылается только на предыдущие
+MODELS = ('group', 'post', 'comment', 'follow')
+FORMATS = ('ndjson', 'csv')
+
+MODEL_CLASSES = {
+    'group': Group,
+    'post': Post,
+    'comment': Comment,
+    'follow': Follow,
+}
+
+# Поле выгрузки и соответствующий ему lookup
+EXPORT_FIELDS = {
+    'group': (('title', 'title'), ('slug', 'slug'),
+              ('description', 'description')),
+    'post': (('id', 'id'), ('author', 'author__username'),
+             ('group', 'group__slug'), ('text', 'text'),
+             ('pub_date', 'pub_date'), ('image', 'image')),
+    'comment': (('id', 'id'), ('post', 'post_id'),
+                ('author', 'author__username'), ('text', 'text'),
+                ('created', 'created')),
+    'follow': (('user', 'user__username'), ('author', 'author__username')),
+}
+
+
+class BulkDataError(ValueError):
+    """Ошибка во входных данных."""
+
+
+def fieldnames(model):
+    return [name for name, _ in EXPORT_FIELDS[model]]
+
+
+def export_rows(model, chunk_size=2000):
+    """Словари для выгрузки ``model``; в памяти — не больше пачки."""
+    lookups = [lookup for _, lookup in EXPORT_FIELDS[model]]
+    rows = (MODEL_CLASSES[model].objects.order_by('pk')
+            .values_list(*lookups))
+    names = fieldnames(model)
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(names, row))
+
+
+class NDJSONWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, model, row):
+        # Даты — isoformat с микросекундами: DjangoJSONEncoder
+        # округляет их до миллисекунд
+        row = {name: value.isoformat() if hasattr(value, 'isoformat')
+               else value for name, value in row.items()}
+        self.stream.write(json.dumps({'model': model, **row},
+                                     ensure_ascii=False))
+        self.stream.write('\n')
+
+
+class CSVWriter:
+    def __init__(self, stream, model):
+        self.writer = csv.DictWriter(stream, fieldnames(model))
+        self.writer.writeheader()
+
+    def write(self, model, row):
+        self.writer.writerow(row)
+
+
+def read_ndjson(stream):
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise BulkDataError(f'Строка {number}: {error}')
+        model = record.pop('model', None)
+        if model not in MODELS:
+            raise BulkDataError(
+                f'Строка {number}: неизвестная модель {model!r}')
+        yield model, record
+
+
+def read_csv(stream, model):
+    for record in csv.DictReader(stream):
+        yield model, record
+
+
+def _date(value):
+    if not value:
+        return timezone.now()
+    date = parse_datetime(value) if isinstance(value, str) else value
+    if date is None:
+        raise BulkDataError(f'Неверная дата {value!r}')
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def _id(value):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BulkDataError(f'Неверный id {value!r}')
+
+
+class Importer:
+    """Загружает записи ``(model, record)`` пачками по ``batch_size``.
+
+    Записи должны идти в порядке ``MODELS`` — так их пишет выгрузка.
+    После ``load()`` обязательно вызвать ``finish()``. В ``counts``
+    — число действительно вставленных строк каждой модели.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.counts = dict.fromkeys(MODELS, 0)
+        # id поста в выгрузке -> id в этой базе
+        self.post_ids = {}
+        self._users = {}
+        self._groups = {}
+        self._stats_users = set()
+        self._authors = set()
+        self._scopes = set()
+
+    def load(self, records):
+        model, batch = None, []
+        for record_model, record in records:
+            if record_model != model or len(batch) == self.batch_size:
+                self._flush(model, batch)
+                model, batch = record_model, []
+            batch.append(record)
+        self._flush(model, batch)
+
+    def _flush(self, model, batch):
+        if not batch:
+            return
+        with immediate_atomic():
+            getattr(self, '_load_' + model)(batch)
+
+    def _user_ids(self, usernames):
+        missing = set(usernames) - set(self._users)
+        if missing:
+            self._users.update(User.objects.filter(username__in=missing)
+                               .values_list('username', 'pk'))
+            new = missing - set(self._users)
+            if new:
+                password = make_password(None)
+                User.objects.bulk_create(
+                    [User(username=name, password=password) for name in new],
+                    ignore_conflicts=True)
+                self._users.update(User.objects.filter(username__in=new)
+                                   .values_list('username', 'pk'))
+        return self._users
+
+    def _group_ids(self, slugs):
+        missing = set(slugs) - set(self._groups)
+        if missing:
+            self._groups.update(Group.objects.filter(slug__in=missing)
+                                .values_list('slug', 'pk'))
+            unknown = missing - set(self._groups)
+            if unknown:
+                raise BulkDataError(
+                    'Неизвестные группы: ' + ', '.join(sorted(unknown)))
+        return self._groups
+
+    def _insert(self, model, items, identity, date_field):
+        """Вставляет ``items`` — пары ``(id из выгрузки, объект)``.
+
+        Запись, у которой значения полей ``identity`` совпадают с уже
+        существующей строкой, считается загруженной раньше и не
+        вставляется. Возвращает вставленные объекты и карту id из
+        выгрузки в id этой базы.
+        """
+        def key(obj):
+            return tuple(getattr(obj, field) for field in identity)
+
+        source_ids = {source_id for source_id, _ in items
+                      if source_id is not None}
+        existing = {row[0]: row[1:] for row in model.objects
+                    .filter(pk__in=source_ids)
+                    .values_list('pk', *identity)}
+        # Записи без id или с id, занятым другой строкой, ищем
+        # по значениям: в прошлый раз они могли получить новый id
+        homeless = [obj for source_id, obj in items
+                    if source_id is None
+                    or existing.get(source_id, key(obj)) != key(obj)]
+        loaded = {}
+        if homeless:
+            loaded = {row[:-1]: row[-1] for row in model.objects.filter(**{
+                field + '__in': {getattr(obj, field) for obj in homeless}
+                for field in identity}).values_list(*identity, 'pk')}
+        id_map, objs = {}, []
+        for source_id, obj in items:
+            row = existing.get(source_id)
+            if row == key(obj):
+                pk = source_id
+            else:
+                pk = loaded.get(key(obj))
+            if pk is not None:
+                # Та же запись загружена раньше
+                id_map[source_id] = pk
+                continue
+            obj.pk = source_id if row is None else None
+            objs.append((source_id, obj))
+        unassigned = [obj for _, obj in objs if obj.pk is None]
+        if unassigned:
+            # Новые id — после всех занятых и сохраняемых из выгрузки;
+            # параллельная вставка даст IntegrityError, а не потерю строк
+            last = max([model.objects.aggregate(last=Max('pk'))['last'] or 0]
+                       + [obj.pk for _, obj in objs if obj.pk is not None])
+            for offset, obj in enumerate(unassigned, 1):
+                obj.pk = last + offset
+        for source_id, obj in objs:
+            id_map[source_id] = obj.pk
+        id_map.pop(None, None)
+        objs = [obj for _, obj in objs]
+        # bulk_create ставит полю auto_now_add текущее время,
+        # даты из выгрузки записываем отдельным UPDATE на пачку
+        dates = [getattr(obj, date_field) for obj in objs]
+        model.objects.bulk_create(objs)
+        for obj, date in zip(objs, dates):
+            setattr(obj, date_field, date)
+        model.objects.bulk_update(objs, [date_field])
+        return objs, id_map
+
+    def _load_group(self, batch):
+        slugs = {record['slug'] for record in batch}
+        existing = set(Group.objects.filter(slug__in=slugs)
+                       .values_list('slug', flat=True))
+        groups = {}
+        for record in batch:
+            if record['slug'] not in existing:
+                groups[record['slug']] = Group(
+                    title=record['title'], slug=record['slug'],
+                    description=record.get('description') or '')
+        Group.objects.bulk_create(groups.values())
+        self.counts['group'] += len(groups)
+
+    def _load_post(self, batch):
+        users = self._user_ids(record['author'] for record in batch)
+        groups = self._group_ids(record['group'] for record in batch
+                                 if record.get('group'))
+        items = [(_id(record.get('id')),
+                  Post(author_id=users[record['author']],
+                       group_id=groups.get(record.get('group')),
+                       text=record['text'],
+                       pub_date=_date(record.get('pub_date')),
+                       image=record.get('image') or ''))
+                 for record in batch]
+        posts, id_map = self._insert(Post, items,
+                                     ('author_id', 'pub_date'), 'pub_date')
+        self.post_ids.update(id_map)
+        for post in posts:
+            self._stats_users.add(post.author_id)
+            self._authors.add(post.author_id)
+            self._scopes.update(feed_cache.post_scopes(post.author_id,
+                                                       post.group_id))
+        self.counts['post'] += len(posts)
+
+    def _load_comment(self, batch):
+        users = self._user_ids(record['author'] for record in batch)
+        # Посты не из этой загрузки ищем по id как есть
+        post_id = {source_id: self.post_ids.get(source_id, source_id)
+                   for source_id in {_id(record['post'])
+                                     for record in batch}}
+        posts = {pk: (author_id, group_id) for pk, author_id, group_id
+                 in Post.objects.filter(pk__in=post_id.values())
+                 .values_list('pk', 'author_id', 'group_id')}
+        unknown = set(post_id.values()) - set(posts)
+        if unknown:
+            raise BulkDataError('Неизвестные посты: ' + ', '.join(
+                str(pk) for pk in sorted(unknown)))
+        items = [(_id(record.get('id')),
+                  Comment(post_id=post_id[_id(record['post'])],
+                          author_id=users[record['author']],
+                          text=record['text'],
+                          created=_date(record.get('created'))))
+                 for record in batch]
+        comments, _ = self._insert(Comment, items,
+                                   ('post_id', 'author_id', 'created'),
+                                   'created')
+        for comment in comments:
+            self._stats_users.add(comment.author_id)
+            self._scopes.update(feed_cache.post_scopes(
+                *posts[comment.post_id]))
+        self.counts['comment'] += len(comments)
+
+    def _load_follow(self, batch):
+        users = self._user_ids(
+            [record['user'] for record in batch]
+            + [record['author'] for record in batch])
+        pairs = {(users[record['user']], users[record['author']])
+                 for record in batch}
+        pairs = {(user_id, author_id) for user_id, author_id in pairs
+                 if user_id != author_id}
+        existing = set(Follow.objects
+                       .filter(user_id__in={pair[0] for pair in pairs},
+                               author_id__in={pair[1] for pair in pairs})
+                       .values_list('user_id', 'author_id'))
+        follows = [Follow(user_id=user_id, author_id=author_id)
+                   for user_id, author_id in sorted(pairs - existing)]
+        for follow in follows:
+            self._stats_users.update((follow.user_id, follow.author_id))
+            self._authors.add(follow.author_id)
+        # Конфликт возможен только с подпиской, созданной параллельно
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        self.counts['follow'] += len(follows)
+
+    def finish(self):
+        """Отложенное обслуживание: последовательности первичных ключей,
+        счетчики, ленты подписок и версии кэша."""
+        sequences = connection.ops.sequence_reset_sql(
+            no_style(), [Post, Comment])
+        if sequences:
+            with connection.cursor() as cursor:
+                for sql in sequences:
+                    cursor.execute(sql)
+        # Счетчики — раньше лент: по ним определяются «звезды»
+        user_ids = sorted(self._stats_users)
+        for start in range(0, len(user_ids), self.batch_size):
+            UserStats.objects.rebuild(
+                user_ids[start:start + self.batch_size],
+                batch_size=self.batch_size)
+        for author_id in sorted(self._authors):
+            if not timeline.is_celebrity(author_id):
+                timeline.rehydrate(author_id)
+        feed_cache.bump(*self._scopes)
@@ -0,0 +1,80 @@
+"""Кэш отрисованных карточек постов.
+
+Карточка — общая для всех читателей часть ``post_item.html``: картинка,
+текст, группа, счетчик комментариев и дата. Ключ включает id поста
+и все, от чего зависит разметка, поэтому изменение поста просто
+приводит к новому ключу. Ссылка «Редактировать» видна только автору
+и в карточку не входит.
+"""
+import hashlib
+import logging
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import thumbnails
+
+logger = logging.getLogger(__name__)
+
+CARD_TEMPLATE = 'posts/post_card.html'
+CARD_TIMEOUT = 24 * 60 * 60
+# Меняется вместе с разметкой карточки
+CARD_VERSION = 2
+
+
+def card_key(post):
+    group = post.group
+    related = '|'.join((post.author.username,
+                        group.slug if group else '',
+                        group.title if group else ''))
+    digest = hashlib.md5(related.encode()).hexdigest()[:8]
+    return 'posts:card:{}:{}:{}:{}:{}'.format(
+        CARD_VERSION, post.pk, post.updated.timestamp(),
+        getattr(post, 'comments_count', ''), digest)
+
+
+def attach_cards(posts):
+    """Достает карточки одним ``get_many`` и рисует только промахи;
+    миниатюры для них тоже достаются одним пакетом.
+
+    Возвращает список постов с HTML карточки в ``post.card``.
+    """
+    posts = list(posts)
+    keys = {post.pk: card_key(post) for post in posts}
+    cached = cache.get_many(list(keys.values()))
+    attach_image_variants([post for post in posts
+                           if keys[post.pk] not in cached and post.image])
+    missing = {}
+    for post in posts:
+        html = cached.get(keys[post.pk])
+        if html is None:
+            html = render_to_string(CARD_TEMPLATE, {'post': post})
+            if _cacheable(post):
+                missing[keys[post.pk]] = html
+        post.card = mark_safe(html)
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+    return posts
+
+
+def _cacheable(post):
+    # Карточку с исходной картинкой вместо миниатюр не кэшируем:
+    # миниатюры скоро нарежет фоновая задача
+    variants = getattr(post, 'image_variants', None)
+    return not post.image or (variants is not None
+                              and not variants.get('pending'))
+
+
+def attach_image_variants(posts):
+    """Кладет в ``post.image_variants`` данные ``<picture>`` картинок."""
+    if not posts:
+        return
+    try:
+        variants = thumbnails.card_variants([post.image for post in posts])
+    except Exception:
+        # Тег card_image попробует еще раз для каждого поста отдельно
+        logger.exception('Не удалось получить миниатюры страницы')
+        return
+    for post, post_variants in zip(posts, variants):
+        post.image_variants = post_variants
@@ -0,0 +1,87 @@
+"""ETag и Last-Modified для лент и страницы поста.
+
+Состояние страницы берется без агрегатов по ее постам: для лент это
+версия кэша области и время ее последнего увеличения (см.
+``feed_cache``), для поста — его дата изменения, которую сдвигает
+и новый комментарий. ETag дополнительно учитывает представление
+(HTML или JSON), читателя и параметры запроса, поэтому 304 отдается
+только для действительно той же страницы.
+"""
+import hashlib
+
+from django.views.decorators.http import condition
+
+from . import feed_cache, write_buffer
+from .models import Follow, Group, Post, User, UserStats
+
+
+def conditional(state_func, representation='html'):
+    """Декоратор ``condition`` с одним вычислением состояния на запрос.
+
+    ``state_func(request, *args, **kwargs)`` возвращает пару
+    ``(etag, last_modified)``; ``representation`` различает ETag
+    страниц с одним состоянием, но разной разметкой.
+    """
+    def state(request, *args, **kwargs):
+        if not hasattr(request, '_condition_state'):
+            request._condition_state = state_func(request, *args, **kwargs)
+        return request._condition_state
+
+    def etag(request, *args, **kwargs):
+        value = state(request, *args, **kwargs)[0]
+        return value and f'{representation}-{value}'
+
+    def last_modified(request, *args, **kwargs):
+        return state(request, *args, **kwargs)[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _etag(request, *parts):
+    # Еще не сохраненные записи автора показываются из списка в кэше
+    parts += (request.user.pk, request.GET.urlencode(),
+              write_buffer.pending_tokens(request))
+    return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _scope_state(request, scope, *parts):
+    version = feed_cache.version(scope)
+    return (_etag(request, scope, version, *parts),
+            feed_cache.modified(scope))
+
+
+def _author_parts(request, author):
+    stats = UserStats.objects.for_user(author)
+    following = Follow.objects.filter(user=request.user.pk,
+                                      author=author).exists()
+    return [getattr(stats, field) for field in stats.COUNTERS] + [following]
+
+
+def index_state(request):
+    return _scope_state(request, feed_cache.index_scope())
+
+
+def group_state(request, slug):
+    group = Group.objects.filter(slug=slug).first()
+    if group is None:
+        return None, None
+    return _scope_state(request, feed_cache.group_scope(group.pk))
+
+
+def profile_state(request, username):
+    author = User.objects.filter(username=username).first()
+    if author is None:
+        return None, None
+    return _scope_state(request, feed_cache.profile_scope(author.pk),
+                        *_author_parts(request, author))
+
+
+def post_state(request, username, post_id):
+    post = (Post.objects.filter(pk=post_id, author__username=username)
+            .select_related('author').first())
+    if post is None:
+        return None, None
+    # Комментарии сдвигают post.updated, см. signals.comment_touch_post
+    return (_etag(request, 'post', post.pk, post.updated,
+                  *_author_parts(request, post.author)),
+            post.updated)
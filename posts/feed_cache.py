@@ -0,0 +1,92 @@
+"""Версии закэшированных фрагментов лент.
+
+Ключ фрагмента включает номер версии своей области: общая лента
+(``index``), группа (``group:<id>``) или профиль (``profile:<id>``).
+Сигналы увеличивают версию при изменении постов, комментариев и групп
+(см. ``bump_on_commit``), поэтому старые фрагменты просто перестают
+читаться и доживают свой срок в кэше, а TTL можно делать большим.
+Рядом хранится время последнего увеличения — Last-Modified области.
+"""
+import time
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+KEY = 'posts:feed-version:{}'
+MODIFIED_KEY = 'posts:feed-modified:{}'
+
+
+def _initial():
+    # Версия от времени: если ключ вытеснят из кэша, новая версия
+    # не совпадет ни с одной из уже использованных
+    return int(time.time() * 1000)
+
+
+def index_scope():
+    return 'index'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def profile_scope(author_id):
+    return f'profile:{author_id}'
+
+
+def version(scope):
+    key = KEY.format(scope)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _initial(), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+def modified(scope):
+    """Время последнего изменения области.
+
+    Если отметку вытеснили из кэша, считаем область измененной сейчас:
+    клиенты один раз получат страницу целиком.
+    """
+    key = MODIFIED_KEY.format(scope)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time(), timeout=None)
+        value = cache.get(key)
+    return datetime.fromtimestamp(value, timezone.utc)
+
+
+def bump(*scopes):
+    scopes = set(scopes)
+    for scope in scopes:
+        key = KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial(), timeout=None)
+    now = time.time()
+    cache.set_many({MODIFIED_KEY.format(scope): now for scope in scopes},
+                   timeout=None)
+
+
+def bump_on_commit(*scopes):
+    """Увеличивает версии сразу и еще раз после коммита транзакции.
+
+    Пока транзакция не закоммичена, другие соединения видят старые
+    данные и могут положить их в кэш под уже новой версией; повторное
+    увеличение после коммита оставляет такие фрагменты непрочитанными.
+    Первое нужно самой транзакции: ее чтения уже видят изменения.
+    """
+    bump(*scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump(*scopes))
+
+
+def post_scopes(author_id, group_id):
+    scopes = [index_scope(), profile_scope(author_id)]
+    if group_id is not None:
+        scopes.append(group_scope(group_id))
+    return scopes
@@ -1,5 +1,7 @@
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm, Textarea
 
+from . import images
 from .models import Post, Comment
 
 
@@ -8,6 +10,13 @@ class PostForm(ModelForm):
         model = Post
         fields = ('group', 'text', 'image')
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Уже сохраненную картинку при правке поста не трогаем
+        if isinstance(image, UploadedFile):
+            return images.process(image)
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
@@ -0,0 +1,152 @@
+"""Обработка загруженных картинок постов.
+
+Загрузка больше ``FILE_UPLOAD_MAX_MEMORY_SIZE`` уже лежит во временном
+файле, поэтому здесь картинка сначала проверяется по заголовку, без
+декодирования: формат, размер файла и число пикселей. Потом она
+декодируется с уменьшением: у JPEG ``draft()`` масштабирует прямо
+в декодере, остальные форматы декодируются целиком, и их память
+ограничивает ``POSTS_IMAGE_MAX_PIXELS``. Результат поворачивается по
+EXIF и сохраняется без метаданных не больше ``POSTS_IMAGE_MAX_SIZE``
+по большей стороне: прогрессивный JPEG или WebP.
+"""
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.template.defaultfilters import filesizeformat
+from sorl.thumbnail import default as thumbnail_default
+from sorl.thumbnail.images import ImageFile
+
+from yatube.sqlite import immediate_atomic
+
+from .models import Post
+from .storage import is_immutable, post_images
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+# Обработанная картинка больше этого размера пишется во временный файл
+SPOOL_SIZE = 1024 * 1024
+
+
+def max_bytes():
+    return getattr(settings, 'POSTS_IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+
+
+def max_pixels():
+    return getattr(settings, 'POSTS_IMAGE_MAX_PIXELS', 40 * 1000 * 1000)
+
+
+def max_size():
+    return getattr(settings, 'POSTS_IMAGE_MAX_SIZE', 2048)
+
+
+def output_format():
+    return getattr(settings, 'POSTS_IMAGE_FORMAT', 'JPEG')
+
+
+def quality():
+    return getattr(settings, 'POSTS_IMAGE_QUALITY', 85)
+
+
+def _open(upload):
+    upload.seek(0)
+    try:
+        return Image.open(upload)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Файл не является картинкой',
+                              code='invalid_image')
+
+
+def inspect(upload):
+    """Проверяет картинку по заголовку; возвращает открытый ``Image``
+    без декодированных пикселей."""
+    if upload.size > max_bytes():
+        raise ValidationError('Файл больше %(limit)s',
+                              code='file_too_large',
+                              params={'limit': filesizeformat(max_bytes())})
+    image = _open(upload)
+    if image.format not in ALLOWED_FORMATS:
+        raise ValidationError('Формат %(format)s не поддерживается',
+                              code='invalid_format',
+                              params={'format': image.format})
+    width, height = image.size
+    if width * height > max_pixels():
+        raise ValidationError(
+            'Картинка больше %(limit)d мегапикселей',
+            code='too_many_pixels',
+            params={'limit': max_pixels() // (1000 * 1000)})
+    return image
+
+
+def _flatten(image, image_format):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        if image_format == 'WEBP':
+            return image
+        # JPEG без прозрачности: кладем картинку на белый фон
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def process(upload):
+    """Уменьшенная картинка без EXIF в виде ``File`` для ImageField."""
+    image = inspect(upload)
+    limit = max_size()
+    image_format = output_format()
+    try:
+        # JPEG декодируется сразу в уменьшенном масштабе (1/2 … 1/8)
+        image.draft('RGB', (limit, limit))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((limit, limit), Image.LANCZOS)
+        image = _flatten(image, image_format)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ValidationError('Не удалось прочитать картинку',
+                              code='invalid_image')
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    options = {'quality': quality()}
+    if image_format == 'JPEG':
+        options.update(progressive=True, optimize=True)
+    else:
+        options.update(method=4)
+    image.save(output, image_format, **options)
+    output.seek(0)
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    return File(output, name=stem + EXTENSIONS[image_format])
+
+
+def save_post(post):
+    """Сохраняет пост под блокировкой записи базы.
+
+    Хранилище не пишет файл, который уже есть, поэтому между проверкой
+    «такой файл есть» и ссылкой на него из поста ``release`` не должен
+    успеть его удалить: оба идут под одной блокировкой.
+    """
+    with immediate_atomic():
+        post.save()
+    return post
+
+
+def release(name):
+    """Удаляет картинку и ее миниатюры, если на нее не ссылается
+    ни один пост; возвращает True, если файл удален.
+
+    Ссылки проверяются заново под блокировкой записи (см. ``save_post``),
+    уже после коммита транзакции, которая убрала ссылку. Файлы,
+    загруженные до хранения по хешу, не трогаем: их имена
+    не гарантируют, что файл принадлежит только этому посту.
+    """
+    if not name or not is_immutable(name):
+        return False
+    with immediate_atomic():
+        if Post.objects.filter(image=name).exists():
+            return False
+        thumbnail_default.kvstore.delete(ImageFile(name, post_images))
+        post_images.delete(name)
+    return True
@@ -0,0 +1,181 @@
+"""Массовые действия админки фоновыми задачами.
+
+Действие сохраняет ``BulkJob`` со списком id и отправляет его в пул
+``tasks``. Задание обрабатывает id пачками по ``POSTS_BULK_JOB_CHUNK``:
+каждая пачка — своя транзакция с ``update()`` или удалением без
+загрузки объектов, каскада ``Collector`` и сигналов, после нее в задании
+обновляется ``processed``. Счетчики ``UserStats``, ленты подписок
+и версии кэша лент пересчитываются один раз в конце по затронутым
+авторам и группам.
+
+Задание, прерванное перезапуском процесса, остается в статусе «в очереди»
+или «выполняется»; ``python manage.py resume_bulk_jobs`` продолжает такие
+задания с ``processed``.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from yatube.sqlite import immediate_atomic
+
+from . import feed_cache, images, tasks, timeline
+from .models import BulkJob, Comment, Post, TimelineEntry, UserStats
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_size():
+    return getattr(settings, 'POSTS_BULK_JOB_CHUNK', 500)
+
+
+class Touched:
+    """Авторы и группы, чьи счетчики и ленты устарели, и картинки
+    удаленных постов.
+
+    Хранится в ``BulkJob.touched`` вместе с ``processed``, поэтому
+    задание, продолженное после перезапуска, учитывает и пачки,
+    обработанные до него.
+    """
+    FIELDS = ('users', 'groups', 'rehydrate', 'images')
+
+    def __init__(self, data=None):
+        data = json.loads(data or '{}')
+        for field in self.FIELDS:
+            setattr(self, field, set(data.get(field, ())))
+
+    def dumps(self):
+        return json.dumps({field: sorted(getattr(self, field))
+                           for field in self.FIELDS})
+
+    def add_posts(self, rows):
+        for author_id, group_id in rows:
+            self.users.add(author_id)
+            if group_id is not None:
+                self.groups.add(group_id)
+
+
+def _raw_delete(queryset):
+    queryset._raw_delete(queryset.db)
+
+
+def delete_posts(ids, touched):
+    posts = Post.objects.filter(pk__in=ids)
+    touched.add_posts(posts.values_list('author_id', 'group_id'))
+    touched.images.update(posts.exclude(image='').exclude(image=None)
+                          .values_list('image', flat=True))
+    comments = Comment.objects.filter(post_id__in=ids)
+    touched.users.update(comments.values_list('author_id', flat=True))
+    # Все, что ссылается на пост, удаляем сами: каскад ORM загрузил бы
+    # каждый объект и отправил по сигналу на каждый
+    _raw_delete(comments)
+    _raw_delete(TimelineEntry.objects.filter(post_id__in=ids))
+    _raw_delete(posts)
+
+
+def delete_comments(ids, touched):
+    comments = Comment.objects.filter(pk__in=ids)
+    touched.users.update(comments.values_list('author_id', flat=True))
+    post_ids = list(Post.objects.filter(comments__in=ids).distinct()
+                    .values_list('pk', flat=True))
+    posts = Post.objects.filter(pk__in=post_ids)
+    touched.add_posts(posts.values_list('author_id', 'group_id'))
+    # Как и сигнал comment_touch_post: страницы постов изменились
+    posts.update(updated=timezone.now())
+    _raw_delete(comments)
+
+
+def move_to_group(ids, touched, group_id):
+    posts = Post.objects.filter(pk__in=ids)
+    touched.add_posts(posts.values_list('author_id', 'group_id'))
+    touched.groups.add(group_id)
+    posts.update(group_id=group_id, updated=timezone.now())
+
+
+def reassign_author(ids, touched, author_id):
+    posts = Post.objects.filter(pk__in=ids)
+    touched.add_posts(posts.values_list('author_id', 'group_id'))
+    touched.users.add(author_id)
+    touched.rehydrate.add(author_id)
+    # Посты уходят из лент подписчиков прежних авторов
+    _raw_delete(TimelineEntry.objects.filter(post_id__in=ids))
+    posts.update(author_id=author_id, updated=timezone.now())
+
+
+ACTIONS = {
+    'delete_posts': delete_posts,
+    'delete_comments': delete_comments,
+    'move_to_group': move_to_group,
+    'reassign_author': reassign_author,
+}
+
+
+def start(action, queryset, user=None, **params):
+    """Создает задание для объектов ``queryset`` и ставит его в очередь."""
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    job = BulkJob.objects.create(
+        action=action, object_ids=json.dumps(ids), params=json.dumps(params),
+        total=len(ids), created_by=user)
+    tasks.submit(run, job.pk)
+    return job
+
+
+def unfinished():
+    """Задания, которые не завершились, например из-за перезапуска."""
+    return BulkJob.objects.filter(
+        status__in=(BulkJob.PENDING, BulkJob.RUNNING)).order_by('pk')
+
+
+def _invalidate(touched):
+    if touched.users:
+        UserStats.objects.rebuild(touched.users)
+    for author_id in touched.rehydrate:
+        if not timeline.is_celebrity(author_id):
+            timeline.rehydrate(author_id)
+    scopes = [feed_cache.index_scope()]
+    scopes += [feed_cache.profile_scope(user_id) for user_id in touched.users]
+    scopes += [feed_cache.group_scope(group_id)
+               for group_id in touched.groups]
+    feed_cache.bump(*scopes)
+    for name in touched.images:
+        images.release(name)
+
+
+def run(job_id):
+    """Выполняет задание; продолжает с ``processed``, если его прервали."""
+    job = BulkJob.objects.get(pk=job_id)
+    if job.status == BulkJob.DONE:
+        return job
+    action = ACTIONS[job.action]
+    ids = json.loads(job.object_ids)
+    params = json.loads(job.params)
+    touched = Touched(job.touched)
+    BulkJob.objects.filter(pk=job.pk).update(status=BulkJob.RUNNING)
+    status, error = BulkJob.DONE, ''
+    try:
+        for start_index in range(job.processed, len(ids), chunk_size()):
+            chunk = ids[start_index:start_index + chunk_size()]
+            with immediate_atomic():
+                action(chunk, touched, **params)
+                BulkJob.objects.filter(pk=job.pk).update(
+                    processed=start_index + len(chunk),
+                    touched=touched.dumps())
+    except Exception as exc:
+        logger.exception('Массовое действие #%s прервано', job.pk)
+        status, error = BulkJob.FAILED, str(exc)
+    # Уже обработанные пачки учитываем и при ошибке
+    changes = {}
+    try:
+        _invalidate(touched)
+    except Exception as exc:
+        # touched остается в задании: его учтет повторный запуск
+        logger.exception('Кэши массового действия #%s не сброшены',
+                         job.pk)
+        status, error = BulkJob.FAILED, error or str(exc)
+    else:
+        changes['touched'] = '{}'
+    BulkJob.objects.filter(pk=job.pk).update(
+        status=status, error=error, finished=timezone.now(), **changes)
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from posts.benchmark import percentile
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'filebased': 'django.core.cache.backends.filebased.FileBasedCache',
+    'sqlite': 'yatube.cache.SQLiteCache',
+}
+
+
+def make_cache(name, workdir, max_entries):
+    location = {
+        'locmem': 'bench',
+        'filebased': os.path.join(workdir, 'files'),
+        'sqlite': os.path.join(workdir, 'cache.sqlite3'),
+    }[name]
+    params = {'TIMEOUT': 300, 'OPTIONS': {'MAX_ENTRIES': max_entries}}
+    return import_string(BACKENDS[name])(location, params)
+
+
+def worker(args):
+    """Имитация воркера: читает фрагмент, при промахе «рендерит»
+    и кладет его в кэш. Возвращает число попаданий и задержки."""
+    name, workdir, ops, keys, value_size, max_entries, seed = args
+    cache = make_cache(name, workdir, max_entries)
+    rnd = random.Random(seed)
+    value = 'x' * value_size
+    hits = 0
+    latencies = []
+    for _ in range(ops):
+        # Распределение ключей с «горячей» головой, как у страниц ленты
+        key = 'page:%d' % int(rnd.paretovariate(1.2) * 10 % keys)
+        started = time.perf_counter()
+        if cache.get(key) is None:
+            cache.set(key, value)
+        else:
+            hits += 1
+        latencies.append(time.perf_counter() - started)
+    return hits, latencies
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает бэкенды кэша (LocMemCache, FileBasedCache, '
+            'SQLiteCache) под нагрузкой нескольких процессов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--ops', type=int, default=5000,
+                            help='Операций на процесс')
+        parser.add_argument('--keys', type=int, default=500)
+        parser.add_argument('--value-size', type=int, default=4096)
+        parser.add_argument('--max-entries', type=int, default=10000)
+        parser.add_argument('--backend', action='append',
+                            choices=sorted(BACKENDS),
+                            help='Можно указать несколько раз')
+
+    def handle(self, *args, **options):
+        names = options['backend'] or list(BACKENDS)
+        context = multiprocessing.get_context('fork')
+        self.stdout.write('{:<10} {:>10} {:>8} {:>10} {:>10}'.format(
+            'backend', 'ops/s', 'hits', 'p50, мкс', 'p99, мкс'))
+        for name in names:
+            workdir = tempfile.mkdtemp(prefix='bench-cache-')
+            jobs = [(name, workdir, options['ops'], options['keys'],
+                     options['value_size'], options['max_entries'], seed)
+                    for seed in range(options['processes'])]
+            try:
+                started = time.perf_counter()
+                with context.Pool(options['processes']) as pool:
+                    results = pool.map(worker, jobs)
+                elapsed = time.perf_counter() - started
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            total = options['ops'] * options['processes']
+            hits = sum(result[0] for result in results)
+            latencies = [value for result in results for value in result[1]]
+            self.stdout.write('{:<10} {:>10.0f} {:>7.1%} {:>10.0f} '
+                              '{:>10.0f}'.format(
+                                  name, total / elapsed, hits / total,
+                                  percentile(latencies, 0.5) * 1e6,
+                                  percentile(latencies, 0.99) * 1e6))
@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from posts.benchmark import percentile
+from yatube.sqlite import immediate_atomic
+
+# Стандартные настройки Django и профиль из settings.DATABASES
+PROFILES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {},
+    },
+    'production': {
+        'ENGINE': 'yatube.sqlite',
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {'timeout': 5, 'RETRIES': 3},
+    },
+}
+
+SCHEMA = (
+    'CREATE TABLE bench_post (id INTEGER PRIMARY KEY, text TEXT)',
+    'CREATE TABLE bench_comment (id INTEGER PRIMARY KEY,'
+    ' post_id INTEGER NOT NULL REFERENCES bench_post (id),'
+    ' text TEXT, created REAL)',
+    'CREATE INDEX bench_comment_post ON bench_comment (post_id, created)',
+)
+
+
+def create_database(path, posts):
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.executemany('INSERT INTO bench_post (id, text) VALUES (?, ?)',
+                     [(i, 'Пост %d' % i) for i in range(1, posts + 1)])
+    conn.commit()
+    conn.close()
+
+
+def read(connection, post_id):
+    # Как post_view: пост и его последние комментарии
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT text FROM bench_post WHERE id = %s',
+                       [post_id])
+        cursor.fetchone()
+        cursor.execute('SELECT text FROM bench_comment WHERE post_id = %s'
+                       ' ORDER BY created DESC LIMIT 50', [post_id])
+        cursor.fetchall()
+
+
+def write(connection, post_id):
+    # Как add_comment: проверка поста и вставка в одной транзакции
+    with immediate_atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM bench_post WHERE id = %s',
+                           [post_id])
+            cursor.fetchone()
+            cursor.execute(
+                'INSERT INTO bench_comment (post_id, text, created)'
+                ' VALUES (%s, %s, %s)', [post_id, 'Комментарий', time.time()])
+
+
+def worker(args):
+    """Смешанная нагрузка одного процесса в течение ``seconds``.
+
+    Возвращает числа чтений, записей и ошибок и задержки операций.
+    """
+    profile, path, seconds, write_ratio, posts, seed = args
+    connections.databases['bench'] = dict(PROFILES[profile], NAME=path)
+    connection = connections['bench']
+    rnd = random.Random(seed)
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        operation = write if rnd.random() < write_ratio else read
+        started = time.perf_counter()
+        try:
+            operation(connection, rnd.randint(1, posts))
+        except DatabaseError:
+            counts['errors'] += 1
+        else:
+            counts[operation.__name__ + 's'] += 1
+        latencies.append(time.perf_counter() - started)
+        if profile == 'default':
+            # Без CONN_MAX_AGE каждый запрос открывает соединение заново
+            connection.close()
+    connection.close()
+    return counts, latencies
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает стандартные настройки SQLite с профилем '
+            'yatube.sqlite под смешанной нагрузкой нескольких процессов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=3)
+        parser.add_argument('--write-ratio', type=float, default=0.2,
+                            help='Доля операций записи')
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--profile', action='append',
+                            choices=sorted(PROFILES),
+                            help='Можно указать несколько раз')
+
+    def handle(self, *args, **options):
+        names = options['profile'] or list(PROFILES)
+        context = multiprocessing.get_context('fork')
+        self.stdout.write('{:<11} {:>9} {:>9} {:>7} {:>9} {:>9}'.format(
+            'profile', 'reads/s', 'writes/s', 'errors',
+            'p50, мс', 'p99, мс'))
+        for name in names:
+            workdir = tempfile.mkdtemp(prefix='bench-sqlite-')
+            path = os.path.join(workdir, 'db.sqlite3')
+            try:
+                create_database(path, options['posts'])
+                jobs = [(name, path, options['seconds'],
+                         options['write_ratio'], options['posts'], seed)
+                        for seed in range(options['processes'])]
+                with context.Pool(options['processes']) as pool:
+                    results = pool.map(worker, jobs)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            totals = {key: sum(result[0][key] for result in results)
+                      for key in ('reads', 'writes', 'errors')}
+            latencies = [value for result in results for value in result[1]]
+            self.stdout.write(
+                '{:<11} {:>9.0f} {:>9.0f} {:>7} {:>9.2f} {:>9.2f}'.format(
+                    name, totals['reads'] / options['seconds'],
+                    totals['writes'] / options['seconds'], totals['errors'],
+                    percentile(latencies, 0.5) * 1000,
+                    percentile(latencies, 0.99) * 1000))
@@ -0,0 +1,109 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный прогон представлений постов на сгенерированных '
+            'данных: перцентили задержки, RPS и запросы к базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append',
+                            choices=benchmark.SCENARIOS,
+                            help='Можно указать несколько раз, '
+                                 'по умолчанию — все')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Запросов прогрева, не входят в замеры')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок на пользователя')
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--images', type=int, default=20,
+                            help='Сколько постов с картинками')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline',
+                            help='JSON с базовыми результатами '
+                                 'для сравнения')
+        parser.add_argument('--save-baseline',
+                            help='Сохранить результаты как базовые')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимый рост задержки, доля')
+
+    def handle(self, *args, **options):
+        names = [name for name in benchmark.SCENARIOS
+                 if name in (options['scenario'] or benchmark.SCENARIOS)]
+        baseline = (benchmark.load_baseline(options['baseline'])
+                    if options['baseline'] else None)
+        dataset = benchmark.Dataset(
+            users=options['users'], posts=options['posts'],
+            comments=options['comments'], follows=options['follows'],
+            groups=options['groups'], images=options['images'],
+            seed=options['seed'])
+
+        # Прогон идет в отдельной тестовой базе, с временными каталогом
+        # медиа и файлом кэша, чтобы не трогать рабочие данные
+        workdir = tempfile.mkdtemp(prefix='bench-views-')
+        caches = {alias: dict(params) for alias, params
+                  in settings.CACHES.items()}
+        for params in caches.values():
+            backend = params.get('WRAPPED_BACKEND', params['BACKEND'])
+            if backend == 'yatube.cache.SQLiteCache':
+                params['LOCATION'] = f'{workdir}/cache.sqlite3'
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(MEDIA_ROOT=f'{workdir}/media',
+                                   CACHES=caches):
+                counts = dataset.load(settings.MEDIA_ROOT)
+                self.stdout.write('Данные: ' + ', '.join(
+                    f'{model} {count}' for model, count in counts.items()))
+                results = self.run(names, dataset, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if options['save_baseline']:
+            benchmark.save_baseline(options['save_baseline'], results)
+        if baseline is not None:
+            self.report_regressions(results, baseline, options['tolerance'])
+
+    def run(self, names, dataset, options):
+        self.stdout.write('{:<14} {:>8} {:>9} {:>9} {:>9} {:>8}'.format(
+            'view', 'rps', 'p50, мс', 'p95, мс', 'p99, мс', 'queries'))
+        results = {}
+        for name in names:
+            try:
+                metrics = benchmark.run_scenario(
+                    name, dataset, requests=options['requests'],
+                    warmup=options['warmup'], seed=options['seed'])
+            except RuntimeError as error:
+                raise CommandError(str(error))
+            results[name] = metrics
+            self.stdout.write(
+                '{:<14} {rps:>8.0f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} '
+                '{queries:>8.1f}'.format(name, **metrics))
+        return results
+
+    def report_regressions(self, results, baseline, tolerance):
+        regressions = benchmark.compare(results, baseline, tolerance)
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(
+                'Регрессий относительно базовых результатов нет'))
+            return
+        for name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(
+                f'{name}: {metric} {before:.1f} -> {after:.1f}'))
+        raise CommandError(f'Регрессий: {len(regressions)}')
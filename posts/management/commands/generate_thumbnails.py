@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import feed_cache, thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Создает миниатюры для картинок уже опубликованных постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Сколько постов читать из базы за раз')
+
+    def handle(self, *args, **options):
+        posts = (Post.objects.exclude(image='').exclude(image=None)
+                 .order_by('pk').only('image', 'author_id', 'group_id'))
+        started = time.monotonic()
+        done = failed = 0
+        scopes = set()
+        for post in posts.iterator(chunk_size=options['batch_size']):
+            try:
+                thumbnails.generate(post.image)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'Пост {post.pk}: {error}')
+                continue
+            done += 1
+            scopes.update(feed_cache.post_scopes(post.author_id,
+                                                 post.group_id))
+            if done % 100 == 0:
+                self.stdout.write(f'Обработано постов: {done}')
+        # Ленты, отрисованные с исходными картинками, рисуются заново
+        feed_cache.bump(*scopes)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {done} постов, ошибок: {failed}, {elapsed:.1f} с'))
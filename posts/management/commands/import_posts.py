@@ -0,0 +1,59 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from posts import bulk
+
+
+class Command(BaseCommand):
+    help = ('Загружает группы, посты, комментарии и подписки '
+            'из NDJSON или CSV пачками bulk_create')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help='Файл выгрузки или «-» для stdin')
+        parser.add_argument('--format', choices=bulk.FORMATS,
+                            help='По умолчанию — по расширению файла')
+        parser.add_argument('--model', choices=bulk.MODELS,
+                            help='Модель строк CSV')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько строк в одной транзакции')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or (
+            'csv' if path.lower().endswith('.csv') else 'ndjson')
+        if fmt == 'csv' and not options['model']:
+            raise CommandError('Для CSV укажите --model')
+
+        stream = (sys.stdin if path == '-'
+                  else open(path, encoding='utf-8', newline=''))
+        importer = bulk.Importer(batch_size=options['batch_size'])
+        started = time.monotonic()
+        try:
+            if fmt == 'csv':
+                records = bulk.read_csv(stream, options['model'])
+            else:
+                records = bulk.read_ndjson(stream)
+            importer.load(records)
+        except (bulk.BulkDataError, KeyError) as error:
+            raise CommandError(f'Ошибка в данных: {error}')
+        except IntegrityError as error:
+            raise CommandError(f'Конфликт с параллельной записью: {error}')
+        finally:
+            if path != '-':
+                stream.close()
+
+        loaded = time.monotonic() - started
+        importer.finish()
+        elapsed = max(time.monotonic() - started, 1e-6)
+        rows = sum(importer.counts.values())
+        for model, count in importer.counts.items():
+            if count:
+                self.stdout.write(f'{model}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено строк: {rows} за {elapsed:.1f} с '
+            f'({rows / elapsed:.0f} строк/с), из них пересчет '
+            f'счетчиков, лент и кэша — {elapsed - loaded:.1f} с'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import UserStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики подписчиков, подписок, постов и комментариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько пользователей пересчитывать за раз')
+
+    def handle(self, *args, **options):
+        changed = UserStats.objects.rebuild(
+            batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков: {changed}'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts import jobs
+from posts.models import BulkJob
+
+
+class Command(BaseCommand):
+    help = ('Продолжает массовые действия, прерванные перезапуском '
+            '(запускать после старта приложения)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true',
+                            help='Повторить и задания, упавшие с ошибкой')
+
+    def handle(self, *args, **options):
+        queryset = jobs.unfinished()
+        if options['failed']:
+            queryset = queryset | BulkJob.objects.filter(
+                status=BulkJob.FAILED)
+        for job_id in list(queryset.values_list('pk', flat=True)):
+            job = jobs.run(job_id)
+            style = (self.style.SUCCESS if job.status == BulkJob.DONE
+                     else self.style.ERROR)
+            self.stdout.write(style(
+                f'{job}: {job.get_status_display()}, '
+                f'{job.processed} из {job.total}'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube import replicas
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в реплики из DATABASE_REPLICAS '
+            '(для локальной проверки чтения с реплик)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд; '
+                                 '0 — скопировать один раз')
+
+    def handle(self, *args, **options):
+        if not replicas.replicas():
+            raise CommandError('DATABASE_REPLICAS пуст')
+        while True:
+            replicas.sync()
+            self.stdout.write(self.style.SUCCESS(
+                'Реплики обновлены: ' + ', '.join(replicas.replicas())))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
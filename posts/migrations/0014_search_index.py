@@ -0,0 +1,57 @@
+from django.db import migrations
+
+TABLES = (
+    # (таблица модели, индекс)
+    ('posts_post', 'posts_post_fts'),
+    ('posts_comment', 'posts_comment_fts'),
+)
+
+CREATE = (
+    """CREATE VIRTUAL TABLE {fts} USING fts5(
+        text, content='{table}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER {fts}_update AFTER UPDATE OF text ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+)
+
+DROP = (
+    'DROP TRIGGER IF EXISTS {fts}_insert',
+    'DROP TRIGGER IF EXISTS {fts}_delete',
+    'DROP TRIGGER IF EXISTS {fts}_update',
+    'DROP TABLE IF EXISTS {fts}',
+)
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # Полнотекстовый индекс есть только в SQLite, на других базах
+        # поиск работает через LIKE (см. posts/search.py)
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        with schema_editor.connection.cursor() as cursor:
+            for table, fts in TABLES:
+                for statement in statements:
+                    cursor.execute(statement.format(table=table, fts=fts))
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_updated_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
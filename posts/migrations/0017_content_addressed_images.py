@@ -0,0 +1,29 @@
+# Generated by Django 2.2.6 on 2026-10-17 05:09
+
+from django.db import migrations, models
+import posts.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_bulkjob'),
+    ]
+
+    operations = [
+        # Хранилище не меняет колонку; AlterField в SQLite пересоздал бы
+        # таблицу и вместе с ней удалил бы триггеры поискового индекса
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='post',
+                    name='image',
+                    field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['image'], name='post_image_idx'),
+        ),
+    ]
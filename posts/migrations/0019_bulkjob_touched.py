@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-17 05:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_feed_indexes_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkjob',
+            name='touched',
+            field=models.TextField(default='{}', verbose_name='Затронуто'),
+        ),
+    ]
@@ -1,5 +1,10 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from yatube import replicas
+
+from .storage import post_images
 
 User = get_user_model()
 
@@ -17,6 +22,21 @@ class Group(models.Model):
         verbose_name_plural = 'Группы'
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для ленты: автор и группа одним JOIN,
+        число комментариев — в поле ``comments_count``."""
+        comments = (Comment.objects
+                    .filter(post=OuterRef('pk'))
+                    .order_by()
+                    .values('post')
+                    .annotate(total=Count('pk'))
+                    .values('total'))
+        return (self.select_related('author', 'group')
+                .annotate(comments_count=Coalesce(
+                    Subquery(comments, output_field=IntegerField()), 0)))
+
+
 class Post(models.Model):
     text = models.TextField(verbose_name='Текст публикации')
     pub_date = models.DateTimeField(auto_now_add=True,
@@ -31,7 +51,13 @@ class Post(models.Model):
                               on_delete=models.SET_NULL,
                               related_name='group_posts',
                               verbose_name='Группа')
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # Одинаковые картинки хранятся одним файлом, см. posts/storage.py
+    image = models.ImageField(upload_to='posts/', storage=post_images,
+                              blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True,
+                                   verbose_name='Дата изменения')
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return self.text
@@ -40,6 +66,18 @@ class Post(models.Model):
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['updated'],
+                         name='post_updated_idx'),
+            models.Index(fields=['image'],
+                         name='post_image_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -62,6 +100,12 @@ class Comment(models.Model):
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
         ordering = ('created',)
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+            models.Index(fields=['created'],
+                         name='comment_created_idx'),
+        ]
 
 
 class Follow(models.Model):
@@ -80,3 +124,199 @@ class Follow(models.Model):
     class Meta:
         verbose_name = 'Подписчик'
         verbose_name_plural = 'Подписчики'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_follow'),
+        ]
+
+
+class UserStatsManager(models.Manager):
+    def for_user(self, user):
+        """Счетчики пользователя; строка создается при первом обращении."""
+        try:
+            return self.get(user=user)
+        except self.model.DoesNotExist:
+            # Реплика может отставать: считаем и читаем по основной базе
+            with replicas.primary():
+                self.rebuild([user.pk])
+                return self.get(user=user)
+
+    def increment(self, user_id, field, delta=1):
+        # Счетчик мог разойтись с данными и уже быть нулем: уменьшение
+        # не должно уводить его ниже нуля и ронять удаление
+        updated = self.filter(user_id=user_id).update(
+            **{field: Greatest(F(field) + delta, 0)})
+        if not updated and delta > 0:
+            # Строки еще нет: считаем все счетчики с нуля,
+            # новая запись уже попадет в подсчет
+            self.rebuild([user_id])
+
+    def rebuild(self, user_ids=None, batch_size=1000):
+        """Пересчитывает счетчики пачками и чинит расхождения.
+
+        Возвращает число созданных или исправленных строк.
+        """
+        users = User.objects.order_by('pk').values_list('pk', flat=True)
+        if user_ids is not None:
+            users = users.filter(pk__in=list(user_ids))
+        changed = 0
+        chunk = []
+        for user_id in users.iterator(chunk_size=batch_size):
+            chunk.append(user_id)
+            if len(chunk) == batch_size:
+                changed += self._rebuild_chunk(chunk)
+                chunk = []
+        if chunk:
+            changed += self._rebuild_chunk(chunk)
+        return changed
+
+    def _rebuild_chunk(self, user_ids):
+        totals = {user_id: dict.fromkeys(self.model.COUNTERS, 0)
+                  for user_id in user_ids}
+        sources = (
+            ('posts_count', Post.objects, 'author_id'),
+            ('comments_count', Comment.objects, 'author_id'),
+            ('followers_count', Follow.objects, 'author_id'),
+            ('following_count', Follow.objects, 'user_id'),
+        )
+        for field, queryset, column in sources:
+            rows = (queryset.filter(**{column + '__in': user_ids})
+                    .order_by()
+                    .values(column)
+                    .annotate(total=Count('pk'))
+                    .values_list(column, 'total'))
+            for user_id, total in rows:
+                totals[user_id][field] = total
+
+        existing = {stats.user_id: stats
+                    for stats in self.filter(user_id__in=user_ids)}
+        created, drifted = [], []
+        for user_id, counters in totals.items():
+            stats = existing.get(user_id)
+            if stats is None:
+                created.append(self.model(user_id=user_id, **counters))
+            elif any(getattr(stats, field) != value
+                     for field, value in counters.items()):
+                for field, value in counters.items():
+                    setattr(stats, field, value)
+                drifted.append(stats)
+        self.bulk_create(created, ignore_conflicts=True)
+        self.bulk_update(drifted, self.model.COUNTERS)
+        return len(created) + len(drifted)
+
+
+class UserStats(models.Model):
+    COUNTERS = ('followers_count', 'following_count',
+                'posts_count', 'comments_count')
+
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='stats',
+                                verbose_name='Пользователь')
+    followers_count = models.PositiveIntegerField(default=0,
+                                                  verbose_name='Подписчиков')
+    following_count = models.PositiveIntegerField(default=0,
+                                                  verbose_name='Подписок')
+    posts_count = models.PositiveIntegerField(default=0,
+                                              verbose_name='Записей')
+    comments_count = models.PositiveIntegerField(
+        default=0, verbose_name='Комментариев')
+
+    objects = UserStatsManager()
+
+    def __str__(self):
+        return str(self.user_id)
+
+    class Meta:
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='timeline',
+                             verbose_name='Читатель')
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='timeline_entries',
+                             verbose_name='Пост')
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name='+',
+                               verbose_name='Автор')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    def __str__(self):
+        return f'{self.user_id}: {self.post_id}'
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        ordering = ('-pub_date',)
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_feed_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+
+
+class BulkJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+    ACTIONS = (
+        ('delete_posts', 'Удаление постов'),
+        ('delete_comments', 'Удаление комментариев'),
+        ('move_to_group', 'Перенос постов в группу'),
+        ('reassign_author', 'Смена автора постов'),
+    )
+
+    action = models.CharField(max_length=32, choices=ACTIONS,
+                              verbose_name='Действие')
+    # id объектов и параметры действия в JSON
+    object_ids = models.TextField(verbose_name='Объекты')
+    params = models.TextField(default='{}', verbose_name='Параметры')
+    # Затронутые уже обработанными пачками авторы, группы и картинки
+    # (см. jobs.Touched): по ним сбрасываются кэши и после перезапуска
+    touched = models.TextField(default='{}', verbose_name='Затронуто')
+    status = models.CharField(max_length=16, choices=STATUSES,
+                              default=PENDING, verbose_name='Статус')
+    total = models.PositiveIntegerField(default=0, verbose_name='Всего')
+    processed = models.PositiveIntegerField(default=0,
+                                            verbose_name='Обработано')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_by = models.ForeignKey(User,
+                                   blank=True,
+                                   null=True,
+                                   on_delete=models.SET_NULL,
+                                   related_name='+',
+                                   verbose_name='Запустил')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Создано')
+    finished = models.DateTimeField(blank=True, null=True,
+                                    verbose_name='Завершено')
+
+    def __str__(self):
+        return f'{self.get_action_display()} #{self.pk}'
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 100
+        return self.processed * 100 // self.total
+
+    class Meta:
+        verbose_name = 'Массовое действие'
+        verbose_name_plural = 'Массовые действия'
+        ordering = ('-created',)
@@ -0,0 +1,314 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from . import feed_cache
+
+PER_PAGE = 10
+COMMENTS_PER_PAGE = 50
+COUNT_KEY = 'posts:feed-count:{}:{}'
+COUNT_TIMEOUT = 60 * 60
+
+
+class CursorPage:
+    """Страница курсорной пагинации.
+
+    Повторяет ту часть интерфейса ``django.core.paginator.Page``,
+    которой пользуются шаблоны, но без номера страницы и общего
+    количества записей.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous,
+                 after=None, before=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.after = after
+        self.before = before
+
+    def __repr__(self):
+        return '<CursorPage after={} before={}>'.format(self.after or '',
+                                                        self.before or '')
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(self.object_list[0])
+
+
+class CursorPaginator:
+    """Пагинация по ключу сортировки без COUNT и OFFSET.
+
+    По умолчанию ключ — ``(pub_date, id)``; ``ordering`` должен
+    однозначно упорядочивать записи, поэтому последним идет id.
+
+    Курсоры ``after``/``before`` непрозрачны для клиента: это значения
+    полей сортировки последней (первой) записи страницы в base64.
+    Подходит как для моделей, так и для строк из ``.values()``.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = tuple(name.lstrip('-') for name in self.ordering)
+
+    def _value(self, obj, field):
+        if isinstance(obj, dict):
+            return obj[field]
+        return getattr(obj, field)
+
+    def encode_cursor(self, obj):
+        values = []
+        for field in self.fields:
+            value = self._value(obj, field)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        raw = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Возвращает значения полей курсора или None, если он испорчен."""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (ValueError, TypeError, binascii.Error):
+            return None
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            return None
+        try:
+            return [self._field(field).to_python(value)
+                    for field, value in zip(self.fields, values)]
+        except Exception:
+            return None
+
+    def _field(self, name):
+        annotations = self.object_list.query.annotations
+        if name in annotations:
+            return annotations[name].output_field
+        return self.object_list.model._meta.get_field(name)
+
+    def _seek(self, values, forward):
+        """Условие «строго после курсора» для составного ключа.
+
+        Сверху стоит нестрогая граница по первому полю: без нее SQLite
+        не видит диапазона по индексу в ``a < X OR (a = X AND ...)``
+        и перебирает или сортирует все строки за курсором.
+        """
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            descending = name.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{'{}__{}'.format(self.fields[i], lookup): values[i]})
+            for field, value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{field: value})
+            condition |= step
+        if len(self.fields) > 1:
+            descending = self.ordering[0].startswith('-')
+            lookup = 'lte' if descending == forward else 'gte'
+            condition = Q(**{'{}__{}'.format(self.fields[0], lookup):
+                             values[0]}) & condition
+        return condition
+
+    def _reversed_ordering(self):
+        return tuple(name[1:] if name.startswith('-') else '-' + name
+                     for name in self.ordering)
+
+    def get_page(self, after=None, before=None):
+        after_values = self.decode_cursor(after)
+        before_values = None if after_values else self.decode_cursor(before)
+        queryset = self.object_list
+
+        if before_values is not None:
+            queryset = queryset.filter(self._seek(before_values, False))
+            rows = list(queryset.order_by(*self._reversed_ordering())
+                        [:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(rows, self, has_next=True,
+                              has_previous=has_previous, before=before)
+
+        if after_values is not None:
+            queryset = queryset.filter(self._seek(after_values, True))
+        rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, has_next=has_next,
+                          has_previous=after_values is not None,
+                          after=after if after_values else None)
+
+
+def count_limit():
+    return getattr(settings, 'POSTS_PAGINATION_COUNT_LIMIT', 10000)
+
+
+def table_estimate(queryset):
+    """Число строк таблицы по статистике SQLite (``ANALYZE``).
+
+    Только для querysets без условий; None, если оценки нет.
+    """
+    query = queryset.query
+    if query.where or query.distinct or query.low_mark or query.high_mark:
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'sqlite':
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    return int(row[0].split()[0]) if row else None
+
+
+class EstimatedPage(Page):
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class EstimatedPaginator(Paginator):
+    """Пагинатор без полного COUNT.
+
+    Для ленты без условий число записей берется из статистики SQLite,
+    иначе считается не дальше ``limit`` строк (по умолчанию
+    ``POSTS_PAGINATION_COUNT_LIMIT``). Если записей больше,
+    ``is_capped`` истинно и последняя страница неизвестна. Наличие
+    следующей страницы определяется лишней строкой в выборке, поэтому
+    неточная оценка не мешает листать дальше.
+    """
+
+    def __init__(self, object_list, per_page, limit=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.limit = count_limit() if limit is None else limit
+        self._capped = False
+
+    @property
+    def is_capped(self):
+        self.count
+        return self._capped
+
+    @cached_property
+    def count(self):
+        estimate = table_estimate(self.object_list)
+        if estimate is not None and estimate > self.limit:
+            return estimate
+        count = (self.object_list.order_by().values('pk')
+                 [:self.limit + 1].count())
+        if count > self.limit:
+            self._capped = True
+            return self.limit
+        return count
+
+    def validate_number(self, number):
+        # Проверяем только формат: существование страницы решает выборка
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return super().validate_number(number)
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return EstimatedPage(rows[:self.per_page], number, self,
+                             has_next=len(rows) > self.per_page)
+
+    def get_page(self, number):
+        try:
+            return super().get_page(number)
+        except EmptyPage:
+            # Оценка оказалась больше реального числа страниц
+            return self.page(1)
+
+
+def cache_count(paginator, scope):
+    """Берет ``paginator.count`` из кэша под текущей версией области
+    ``scope`` (см. ``feed_cache``): COUNT выполняется один раз после
+    каждого изменения ленты, а не на каждый просмотр."""
+    key = COUNT_KEY.format(scope, feed_cache.version(scope))
+    count = cache.get(key)
+    if count is None:
+        count = paginator.count
+        cache.set(key, count, COUNT_TIMEOUT)
+    else:
+        paginator.count = count
+
+
+def paginate(request, object_list, view_name, per_page=PER_PAGE,
+             ordering=('-pub_date', '-id'), count_scope=None):
+    """Возвращает пару ``(paginator, page)`` для ленты ``view_name``.
+
+    Режим выбирается в ``settings.POSTS_PAGINATION``: ``'offset'``
+    (по умолчанию, обычный ``Paginator``), ``'estimated'``
+    (``EstimatedPaginator`` без полного COUNT) или ``'cursor'``.
+    Для курсора ``ordering`` должен совпадать с сортировкой
+    ``object_list``. Если передана область кэша ``count_scope``,
+    обычный ``Paginator`` берет число записей из кэша.
+    """
+    modes = getattr(settings, 'POSTS_PAGINATION', {})
+    if modes.get(view_name, 'offset') == 'cursor':
+        paginator = CursorPaginator(object_list, per_page, ordering)
+        page = paginator.get_page(after=request.GET.get('after'),
+                                  before=request.GET.get('before'))
+        return paginator, page
+
+    if modes.get(view_name) == 'estimated':
+        paginator = EstimatedPaginator(object_list, per_page)
+    else:
+        paginator = Paginator(object_list, per_page)
+        if count_scope is not None:
+            cache_count(paginator, count_scope)
+    page = paginator.get_page(request.GET.get('page'))
+    return paginator, page
@@ -0,0 +1,109 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+В SQLite используется индекс FTS5 (таблицы ``posts_post_fts``
+и ``posts_comment_fts``), который триггеры обновляют при каждой
+вставке, правке и удалении. Пост находится и по своему тексту, и по
+тексту комментариев; совпадение в тексте поста весит вдвое больше.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+COMMENT_WEIGHT = 0.5
+
+MATCHES = """
+    SELECT rowid AS post_id, bm25(posts_post_fts) AS score
+    FROM posts_post_fts WHERE posts_post_fts MATCH %s
+    UNION ALL
+    SELECT c.post_id, bm25(posts_comment_fts) * {weight}
+    FROM posts_comment_fts
+    JOIN posts_comment c ON c.id = posts_comment_fts.rowid
+    WHERE posts_comment_fts MATCH %s
+""".format(weight=COMMENT_WEIGHT)
+
+RANKED = """
+    SELECT post_id FROM ({matches})
+    GROUP BY post_id ORDER BY MIN(score), post_id DESC
+    LIMIT %s OFFSET %s
+""".format(matches=MATCHES)
+
+COUNT = """
+    SELECT COUNT(DISTINCT post_id) FROM ({matches})
+""".format(matches=MATCHES)
+
+POST_IDS = 'SELECT rowid FROM posts_post_fts WHERE posts_post_fts MATCH %s'
+
+
+def build_query(text):
+    """Запрос FTS5 из пользовательского ввода: все слова обязательны,
+    последнее — как префикс. Спецсимволы FTS5 не пропускаются."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = ['"{}"'.format(word) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def is_indexed():
+    return connection.vendor == 'sqlite'
+
+
+class SearchResults:
+    """Ранжированные результаты поиска для ``Paginator``.
+
+    ``count()`` и каждый срез — по одному запросу к индексу, посты
+    страницы загружаются одним запросом ``for_feed()``.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            with connection.cursor() as cursor:
+                cursor.execute(COUNT, [self.query, self.query])
+                self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        limit = (index.stop - start) if index.stop is not None else -1
+        with connection.cursor() as cursor:
+            cursor.execute(RANKED, [self.query, self.query, limit, start])
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = Post.objects.for_feed().in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+def search_posts(text):
+    """Посты по запросу в порядке релевантности."""
+    if not is_indexed():
+        return (Post.objects.for_feed()
+                .filter(Q(text__icontains=text)
+                        | Q(comments__text__icontains=text))
+                .distinct())
+    query = build_query(text)
+    if query is None:
+        return Post.objects.none()
+    return SearchResults(query)
+
+
+def filter_posts(queryset, text):
+    """Сужает queryset постов до найденных по тексту поста."""
+    if not is_indexed():
+        return queryset.filter(text__icontains=text)
+    query = build_query(text)
+    if query is None:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(POST_IDS, [query]))
@@ -0,0 +1,149 @@
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import feed_cache, images, tasks, timeline, write_buffer
+from .models import Comment, Follow, Group, Post, TimelineEntry, UserStats
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.increment(instance.author_id, 'posts_count')
+        timeline.fan_out(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    UserStats.objects.increment(instance.author_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.increment(instance.author_id, 'comments_count')
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    UserStats.objects.increment(instance.author_id, 'comments_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.increment(instance.author_id, 'followers_count')
+        UserStats.objects.increment(instance.user_id, 'following_count')
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    UserStats.objects.increment(instance.author_id, 'followers_count', -1)
+    UserStats.objects.increment(instance.user_id, 'following_count', -1)
+    timeline.trim(instance.user_id, instance.author_id)
+    followers = (UserStats.objects.filter(user_id=instance.author_id)
+                 .values_list('followers_count', flat=True).first())
+    if followers == timeline.fanout_floor():
+        # До этого его старые посты подмешивались при чтении
+        timeline.schedule_rehydrate(instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def post_remember_previous(sender, instance, **kwargs):
+    # При переносе поста в другую группу или к другому автору
+    # сбрасываем и прежние ленты, при замене картинки освобождаем прежнюю
+    instance._previous_group_id = instance._previous_image = None
+    instance._previous_author_id = None
+    if instance.pk is not None:
+        previous = (Post.objects.filter(pk=instance.pk)
+                    .values_list('group_id', 'image', 'author_id').first())
+        if previous is not None:
+            (instance._previous_group_id,
+             instance._previous_image,
+             instance._previous_author_id) = previous
+
+
+@receiver(post_save, sender=Post)
+def post_author_changed(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_author_id', None)
+    if created or previous is None or previous == instance.author_id:
+        return
+    UserStats.objects.increment(previous, 'posts_count', -1)
+    UserStats.objects.increment(instance.author_id, 'posts_count')
+    # В записях ленты автор денормализован: пост уходит из лент
+    # подписчиков прежнего автора и раскладывается подписчикам нового
+    TimelineEntry.objects.filter(post_id=instance.pk).delete()
+    timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_release_previous_image(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_image', None)
+    if previous and previous != instance.image.name:
+        transaction.on_commit(lambda: images.release(previous))
+
+
+@receiver(post_delete, sender=Post)
+def post_release_image(sender, instance, **kwargs):
+    name = instance.image.name
+    if name:
+        transaction.on_commit(lambda: images.release(name))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_bump_feeds(sender, instance, **kwargs):
+    scopes = feed_cache.post_scopes(instance.author_id, instance.group_id)
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id is not None:
+        scopes.append(feed_cache.group_scope(previous_group_id))
+    previous_author_id = getattr(instance, '_previous_author_id', None)
+    if previous_author_id is not None:
+        scopes.append(feed_cache.profile_scope(previous_author_id))
+    feed_cache.bump_on_commit(*scopes)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_touch_post(sender, instance, **kwargs):
+    # Дата изменения поста — валидатор его страницы, см. conditions
+    Post.objects.filter(pk=instance.post_id).update(updated=timezone.now())
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_bump_feeds(sender, instance, **kwargs):
+    post = (Post.objects.filter(pk=instance.post_id)
+            .values('author_id', 'group_id').first())
+    if post is not None:
+        feed_cache.bump_on_commit(*feed_cache.post_scopes(
+            post['author_id'], post['group_id']))
+
+
+@receiver(pre_delete, sender=Group)
+def group_remember_authors(sender, instance, **kwargs):
+    # Удаление обнуляет Post.group запросом UPDATE без сигналов:
+    # авторов постов группы запоминаем до него
+    instance._author_ids = set(
+        Post.objects.filter(group_id=instance.pk)
+        .values_list('author_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_bump_feeds(sender, instance, **kwargs):
+    scopes = [feed_cache.index_scope(), feed_cache.group_scope(instance.pk)]
+    scopes += [feed_cache.profile_scope(author_id)
+               for author_id in getattr(instance, '_author_ids', ())]
+    feed_cache.bump_on_commit(*scopes)
+
+
+@receiver(request_finished)
+def flush_write_buffer(sender, **kwargs):
+    # Без фонового писателя (база в памяти) очередь разбирается сразу
+    if write_buffer.enabled() and tasks.run_inline():
+        write_buffer.flush()
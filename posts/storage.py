@@ -0,0 +1,47 @@
+"""Хранилище картинок постов с именами по хешу содержимого.
+
+Файл сохраняется как ``posts/<2 символа хеша>/<sha256>.<расширение>``;
+одинаковая картинка, загруженная повторно, не пишется второй раз,
+а получает то же имя. Поэтому файл удаляется, только когда на него
+не ссылается ни один пост (см. ``images.release``), и его содержимое
+по этому адресу никогда не меняется — такие адреса можно кэшировать
+навсегда (см. ``is_immutable``).
+"""
+import hashlib
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+
+
+def is_immutable(name):
+    return HASHED_NAME.search(name) is not None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), digest[:2],
+                              digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return self._save(name, content)
+
+
+post_images = ContentAddressedStorage()
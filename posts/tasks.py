@@ -0,0 +1,67 @@
+"""Фоновые задачи в локальном пуле потоков.
+
+Задача ставится в очередь пула только после коммита текущей транзакции,
+поэтому воркер видит сохраненные данные. Каждый воркер закрывает свое
+соединение с базой после задачи.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'POSTS_BACKGROUND_WORKERS', 2),
+                thread_name_prefix='posts-worker')
+        return _executor
+
+
+def _call(func, args, kwargs):
+    # Ошибка задачи не должна долетать до запроса: транзакция
+    # уже закоммичена, и ответ пользователю от задачи не зависит
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой',
+                         func.__name__)
+
+
+def _run(func, args, kwargs):
+    close_old_connections()
+    try:
+        return _call(func, args, kwargs)
+    finally:
+        connection.close()
+
+
+def run_inline():
+    """Выполнять ли задачи в текущем потоке вместо пула."""
+    if getattr(settings, 'POSTS_BACKGROUND_SYNC', False):
+        return True
+    # Базу SQLite в памяти потоки делят через shared cache, где
+    # блокировки таблиц не ждут busy timeout, а сразу дают ошибку
+    return connection.vendor == 'sqlite' and connection.is_in_memory_db()
+
+
+def submit(func, *args, **kwargs):
+    """Ставит ``func`` в очередь пула после коммита транзакции.
+
+    При ``POSTS_BACKGROUND_SYNC = True`` и для базы SQLite в памяти
+    задача выполняется сразу в текущем потоке.
+    """
+    if run_inline():
+        transaction.on_commit(lambda: _call(func, args, kwargs))
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(_run, func, args, kwargs))
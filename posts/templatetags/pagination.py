@@ -0,0 +1,37 @@
+from django import template
+
+register = template.Library()
+
+# Сколько страниц показывать по обе стороны от текущей
+WINDOW = 2
+
+
+@register.filter
+def page_window(page, size=WINDOW):
+    """Номера страниц вокруг текущей для виджета пагинации.
+
+    Первая и последняя страницы показываются всегда, пропуски
+    обозначены None. Если последняя страница неизвестна
+    (``paginator.is_capped``), список заканчивается пропуском.
+    """
+    number = page.number
+    capped = getattr(page.paginator, 'is_capped', False)
+    last = max(page.paginator.num_pages, number + page.has_next())
+    start = max(1, number - size)
+    end = min(last, number + size)
+
+    window = []
+    if start > 1:
+        window.append(1)
+    if start > 2:
+        window.append(None)
+    window.extend(range(start, end + 1))
+    if capped:
+        if end < last or page.has_next():
+            window.append(None)
+        return window
+    if end < last - 1:
+        window.append(None)
+    if end < last:
+        window.append(last)
+    return window
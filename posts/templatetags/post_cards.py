@@ -0,0 +1,30 @@
+import logging
+
+from django import template
+
+from posts import thumbnails
+from posts.cards import attach_cards
+
+logger = logging.getLogger(__name__)
+
+register = template.Library()
+
+
+@register.filter
+def with_cards(page):
+    return attach_cards(page)
+
+
+@register.inclusion_tag('posts/card_image.html')
+def card_image(post):
+    """``<picture>`` картинки поста; варианты для страницы обычно уже
+    достал ``attach_cards``."""
+    variants = getattr(post, 'image_variants', None)
+    if variants is None and post.image:
+        # Как и тег thumbnail, ошибка картинки не ломает страницу
+        try:
+            variants = thumbnails.card_variants([post.image])[0]
+        except Exception:
+            logger.exception('Не удалось получить миниатюры поста %s',
+                             post.pk)
+    return {'image': variants}
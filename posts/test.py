@@ -1,8 +1,40 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import Permission
 from django.core.cache import cache
-from django.test import TestCase
-from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.paginator import Paginator
+from django.core.signals import request_finished
+from django.db import (IntegrityError, OperationalError, connection,
+                       connections, transaction)
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve, reverse
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+from yatube import replicas
+from yatube.cache import SQLiteCache
+from yatube.sqlite import immediate_atomic
+from yatube.sqlite.base import DatabaseWrapper as SQLiteDatabaseWrapper
 
-from .models import Post, User, Group
+from . import (benchmark, bulk, feed_cache, images, jobs, thumbnails,
+               timeline, views, write_buffer)
+from .models import (BulkJob, Post, User, Group, Comment, Follow,
+                     TimelineEntry, UserStats)
+from .paginators import COMMENTS_PER_PAGE, CursorPaginator
+from .signals import flush_write_buffer
+from .templatetags.pagination import page_window
 
 
 class TestProfile(TestCase):
@@ -195,23 +227,90 @@ class TestImage(TestCase):
 
 class TestCache(TestCase):
     def setUp(self):
-        self.client.get(reverse('index'))
-        user = User.objects.create_user(
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
             username="vasya", email="vasya@vasya.com", password="12345")
-        self.client.login(username='vasya', password='12345')
-        self.client.post(reverse('new_post'), {'text': 'Тест кэша'})
+        self.group = Group.objects.create(
+            title='Group', slug='grp_test', description='desc')
+        self.post = Post.objects.create(
+            text='Тест кэша', author=self.user, group=self.group)
+        self.urls = [
+            reverse('index'),
+            reverse('group_post', kwargs={'slug': self.group.slug}),
+            reverse('profile', kwargs={'username': self.user.username}),
+        ]
+        # Прогреваем кэш
+        for url in self.urls:
+            self.client.get(url)
 
     def test_cache(self):
-        response = self.client.get(reverse('index'))
-        self.assertNotContains(
-            response, 'Тест кэша',
-            status_code=200, msg_prefix='Пост найден, а не должен', html=False)
+        """Пока посты не менялись, ленты отдаются из кэша"""
+        # Изменение в обход сигналов не сбрасывает версию кэша
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигнала')
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertContains(
+                response, 'Тест кэша',
+                status_code=200, count=1, msg_prefix=url, html=False)
         cache.clear()
         response = self.client.get(reverse('index'))
         self.assertContains(
-            response, 'Тест кэша',
+            response, 'Без сигнала',
             status_code=200, count=1, msg_prefix='Пост не найден', html=False)
 
+    def test_new_post_invalidates_cache(self):
+        """Новый пост сразу виден на закэшированных страницах"""
+        self.client.login(username='vasya', password='12345')
+        for url in self.urls:
+            self.client.get(url)
+        self.client.post(reverse('new_post'),
+                         {'text': 'Свежий пост', 'group': self.group.id})
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertContains(
+                response, 'Свежий пост',
+                status_code=200, count=1, msg_prefix=url, html=False)
+
+    def test_comment_invalidates_cache(self):
+        """Новый комментарий обновляет счетчик в ленте"""
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='Комментарий')
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertContains(response, '1 комментариев', msg_prefix=url)
+
+    def test_group_delete_invalidates_cache(self):
+        """После удаления группы ленты не ссылаются на нее"""
+        group_url = reverse('group_post', kwargs={'slug': self.group.slug})
+        for url in self.urls[0::2]:
+            self.assertContains(self.client.get(url), group_url,
+                                msg_prefix=url)
+        self.group.delete()
+        for url in self.urls[0::2]:
+            response = self.client.get(url)
+            self.assertContains(response, 'Тест кэша', msg_prefix=url)
+            self.assertNotContains(response, group_url, msg_prefix=url)
+
+
+class TestFeedVersionOnCommit(TransactionTestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='vasya', password='12345')
+
+    def test_version_bumped_after_commit(self):
+        """Версия, выданная до коммита, не остается текущей после него"""
+        scope = feed_cache.index_scope()
+        before = feed_cache.version(scope)
+        with transaction.atomic():
+            Post.objects.create(text='Пост', author=self.user)
+            # Под этой версией другое соединение еще видит старые данные
+            during = feed_cache.version(scope)
+            self.assertNotEqual(during, before)
+        self.assertNotIn(feed_cache.version(scope), (before, during))
+
 
 class TestFollow(TestCase):
     def setUp(self):
@@ -303,3 +402,1793 @@ class TestComment(TestCase):
                                            'post_id': self.post.pk}),
             {'text': self.comment_text}, follow=True)
         self.assertNotContains(response, self.comment_text)
+
+
+@override_settings(POSTS_PAGINATION={'index': 'cursor',
+                                     'profile': 'cursor'})
+class TestCursorPagination(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='vasya', password='12345')
+        # 25 постов — три страницы по 10
+        for i in range(25):
+            Post.objects.create(text=f'Пост номер {i}', author=self.user)
+
+    def test_pages_cover_feed_without_count(self):
+        """Курсоры проходят всю ленту вперед и назад
+        без COUNT-запроса"""
+        url = reverse('profile', kwargs={'username': self.user.username})
+        seen = []
+        response = self.client.get(url)
+        pages = [response.context['page']]
+        while pages[-1].has_next():
+            response = self.client.get(
+                url, {'after': pages[-1].next_cursor})
+            pages.append(response.context['page'])
+        for page in pages:
+            seen.extend(post.id for post in page)
+        expected = list(Post.objects.values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertFalse(pages[0].has_previous())
+        # Возвращаемся на предыдущую страницу
+        response = self.client.get(
+            url, {'before': pages[-1].previous_cursor})
+        self.assertEqual([post.id for post in response.context['page']],
+                         [post.id for post in pages[1]])
+        self.assertContains(response, '?after=')
+        self.assertContains(response, '?before=')
+
+    def test_no_count_query(self):
+        """Курсорная страница не выполняет COUNT"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        self.assertFalse(
+            any(query['sql'].startswith('SELECT COUNT(*)')
+                for query in queries.captured_queries))
+
+    def test_broken_cursor(self):
+        """Испорченный курсор открывает первую страницу"""
+        response = self.client.get(reverse('index'), {'after': '!!!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 10)
+        self.assertFalse(response.context['page'].has_previous())
+
+
+class TestFeedQueries(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='vasya', password='12345')
+        self.reader = User.objects.create_user(
+            username='ivan', password='12345')
+        self.group = Group.objects.create(
+            title='Group', slug='grp_test', description='desc')
+        Follow.objects.create(user=self.reader, author=self.user)
+        self.client.force_login(self.reader)
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(
+                text=f'Пост {i}', author=self.user, group=self.group)
+            Comment.objects.create(post=post, author=self.reader,
+                                   text='Комментарий')
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_budget_is_constant(self):
+        """Число запросов на страницу ленты не зависит
+        от количества постов на ней"""
+        urls = [
+            reverse('index'),
+            reverse('group_post', kwargs={'slug': self.group.slug}),
+            reverse('profile', kwargs={'username': self.user.username}),
+            reverse('follow_index'),
+        ]
+        self.add_posts(1)
+        single = [self.count_queries(url) for url in urls]
+        self.add_posts(9)
+        full = [self.count_queries(url) for url in urls]
+        self.assertEqual(single, full)
+
+    def test_comments_count_rendered(self):
+        """Число комментариев берется из аннотации"""
+        self.add_posts(1)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '1 комментариев')
+        self.assertEqual(response.context['page'][0].comments_count, 1)
+
+
+class TestUserStats(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.reader = User.objects.create_user(
+            username='ivan', password='12345')
+
+    def assertStats(self, user, **expected):
+        stats = UserStats.objects.for_user(user)
+        for field, value in expected.items():
+            self.assertEqual(getattr(stats, field), value, field)
+
+    def test_signals_keep_counters(self):
+        """Счетчики меняются при создании и удалении
+        постов, комментариев и подписок"""
+        self.assertStats(self.author, posts_count=0, followers_count=0)
+        post = Post.objects.create(text='Пост', author=self.author)
+        comment = Comment.objects.create(post=post, author=self.reader,
+                                         text='Комментарий')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertStats(self.author, posts_count=1, followers_count=1)
+        self.assertStats(self.reader, comments_count=1, following_count=1)
+        follow.delete()
+        comment.delete()
+        self.assertStats(self.author, followers_count=0)
+        self.assertStats(self.reader, comments_count=0, following_count=0)
+        # Удаление поста каскадно удаляет комментарии
+        Comment.objects.create(post=post, author=self.reader, text='Еще')
+        post.delete()
+        self.assertStats(self.author, posts_count=0)
+        self.assertStats(self.reader, comments_count=0)
+
+    def test_profile_reads_one_row(self):
+        """Счетчики на странице профиля берутся из таблицы статистики"""
+        Post.objects.create(text='Пост', author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.client.get(
+            reverse('profile', kwargs={'username': self.author.username}))
+        self.assertContains(response, 'Подписчиков: 1')
+        self.assertContains(response, 'Записей: 1')
+
+    def test_rebuild_command(self):
+        """Команда rebuild_user_stats чинит разъехавшиеся счетчики"""
+        Post.objects.create(text='Пост', author=self.author)
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        UserStats.objects.filter(user=self.reader).delete()
+        out = StringIO()
+        call_command('rebuild_user_stats', stdout=out)
+        self.assertIn('2', out.getvalue())
+        self.assertStats(self.author, posts_count=1)
+        self.assertTrue(UserStats.objects.filter(user=self.reader).exists())
+
+    def test_drifted_counter_stays_non_negative(self):
+        """Удаление при разъехавшемся до нуля счетчике не падает"""
+        post = Post.objects.create(text='Пост', author=self.author)
+        UserStats.objects.filter(user=self.author).update(posts_count=0)
+        post.delete()
+        self.assertFalse(Post.objects.filter(pk=post.pk).exists())
+        self.assertStats(self.author, posts_count=0)
+
+
+class TestTimeline(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.reader = User.objects.create_user(
+            username='ivan', password='12345')
+        self.client.force_login(self.reader)
+
+    def feed(self):
+        response = self.client.get(reverse('follow_index'))
+        return [post.text for post in response.context['page']]
+
+    def test_fan_out_on_write(self):
+        """Новый пост попадает в материализованную ленту подписчика"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='Новый пост', author=self.author)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=post).exists())
+        self.assertEqual(self.feed(), ['Новый пост'])
+
+    def test_backfill_and_trim(self):
+        """Подписка дополняет ленту старыми постами,
+        отписка убирает их"""
+        Post.objects.create(text='Старый пост', author=self.author)
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': self.author.username}))
+        self.assertEqual(self.feed(), ['Старый пост'])
+        self.client.get(reverse('profile_unfollow',
+                                kwargs={'username': self.author.username}))
+        self.assertEqual(self.feed(), [])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(POSTS_PAGINATION={'follow_index': 'cursor'})
+    def test_cursor_pages(self):
+        """Курсорная пагинация идет по ключу ленты читателя"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        for i in range(12):
+            Post.objects.create(text=f'Пост {i}', author=self.author)
+        response = self.client.get(reverse('follow_index'))
+        page = response.context['page']
+        response = self.client.get(reverse('follow_index'),
+                                   {'after': page.next_cursor})
+        texts = [post.text for post in response.context['page']]
+        self.assertEqual(texts, ['Пост 1', 'Пост 0'])
+
+    @override_settings(POSTS_FANOUT_LIMIT=0)
+    def test_celebrity_fan_out_on_read(self):
+        """Посты авторов с большим числом подписчиков
+        не раскладываются, а подмешиваются при чтении"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text='Пост звезды', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed(), ['Пост звезды'])
+
+    @override_settings(POSTS_FANOUT_LIMIT=2, POSTS_FANOUT_FLOOR=1)
+    def test_unfollow_below_limit(self):
+        """Отписка у порога не раскладывает посты в запросе: до
+        POSTS_FANOUT_FLOOR они подмешиваются при чтении, ниже —
+        раскладываются фоновой задачей"""
+        others = [User.objects.create_user(username=f'fan{i}')
+                  for i in range(2)]
+        for user in [self.reader] + others:
+            Follow.objects.create(user=user, author=self.author)
+        Post.objects.create(text='Пост звезды', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+
+        with mock.patch.object(timeline.tasks, 'submit') as submit:
+            Follow.objects.get(user=others[0]).delete()
+            submit.assert_not_called()
+            self.assertEqual(self.feed(), ['Пост звезды'])
+            Follow.objects.get(user=others[1]).delete()
+            Follow.objects.create(user=others[1], author=self.author)
+            Follow.objects.get(user=others[1]).delete()
+        # Повторная отписка у того же порога задачу не дублирует
+        submit.assert_called_once_with(timeline.rehydrate, self.author.pk)
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.reader).exists())
+        timeline.rehydrate(self.author.pk)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader).exists())
+        self.assertEqual(self.feed(), ['Пост звезды'])
+
+    def test_author_change_moves_timeline(self):
+        """Смена автора поста переносит его между лентами
+        и счетчиками"""
+        other = User.objects.create_user(username='petr')
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=fan, author=other)
+        post = Post.objects.create(text='Пост', author=self.author)
+        post.author = other
+        post.save()
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('user', 'author')),
+            [(fan.pk, other.pk)])
+        self.assertEqual(UserStats.objects.for_user(self.author).posts_count,
+                         0)
+        self.assertEqual(UserStats.objects.for_user(other).posts_count, 1)
+        self.assertEqual(self.feed(), [])
+
+
+def make_image(name='test.jpg', size=(1200, 800), image_format='JPEG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(),
+                              content_type='image/jpeg')
+
+
+@override_settings(POSTS_BACKGROUND_SYNC=True,
+                   MEDIA_ROOT=tempfile.mkdtemp())
+class TestThumbnails(TransactionTestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='vasya', password='12345')
+        self.client.force_login(self.user)
+
+    def test_thumbnails_generated_on_upload(self):
+        """Миниатюры создаются при сохранении формы,
+        а не при первой отрисовке ленты"""
+        self.client.post(reverse('new_post'),
+                         {'text': 'Пост с картинкой', 'image': make_image()})
+        self.assertTrue(Post.objects.get().image)
+        self.assertTrue(KVStore.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, '<img')
+        self.assertFalse(any('thumbnail_kvstore' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_generate_thumbnails_command(self):
+        """Команда generate_thumbnails нарезает миниатюры
+        для уже сохраненных картинок"""
+        Post.objects.create(text='Пост', author=self.user,
+                            image=make_image())
+        KVStore.objects.all().delete()
+        cache.clear()
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('1 постов', out.getvalue())
+        self.assertTrue(KVStore.objects.exists())
+
+    def test_inline_task_error_is_logged(self):
+        """Ошибка задачи в текущем потоке не ломает сохранение поста"""
+        def broken(post_id):
+            raise OSError('битая картинка')
+
+        with mock.patch.object(thumbnails, 'generate_for_post', broken), \
+                self.assertLogs('posts.tasks', 'ERROR'):
+            response = self.client.post(
+                reverse('new_post'),
+                {'text': 'Пост с картинкой', 'image': make_image()})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Post.objects.filter(text='Пост с картинкой').exists())
+
+
+class TestSQLiteCache(TestCase):
+    def setUp(self):
+        self.location = os.path.join(tempfile.mkdtemp(), 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {
+            'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_EVERY': 1}})
+
+    def test_shared_between_instances(self):
+        """Два экземпляра (как два процесса) видят одни данные"""
+        other = SQLiteCache(self.location, {})
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(other.get('key'), {'value': 1})
+        self.assertEqual(other.get_many(['key', 'missing']),
+                         {'key': {'value': 1}})
+        other.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_add_incr_and_expiry(self):
+        """add не перезаписывает живую запись, incr атомарен,
+        просроченные записи не возвращаются"""
+        self.assertTrue(self.cache.add('counter', 1))
+        self.assertFalse(self.cache.add('counter', 5))
+        self.assertEqual(self.cache.incr('counter'), 2)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set('old', 'value', timeout=0)
+        self.assertIsNone(self.cache.get('old'))
+        self.assertFalse(self.cache.has_key('old'))
+
+    def test_lru_eviction(self):
+        """При переполнении вытесняются давно не читавшиеся записи"""
+        for i in range(10):
+            self.cache.set(f'key{i}', i)
+        # Отмечаем первую запись как свежепрочитанную
+        self.cache._connection().execute(
+            "UPDATE cache SET accessed = accessed + 100 WHERE key LIKE '%key0'")
+        for i in range(10, 15):
+            self.cache.set(f'key{i}', i)
+        self.assertEqual(self.cache.get('key0'), 0)
+        self.assertIsNone(self.cache.get('key1'))
+        count = self.cache._connection().execute(
+            'SELECT COUNT(*) FROM cache').fetchone()[0]
+        self.assertLessEqual(count, 10)
+
+
+class TestPostCards(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.reader = User.objects.create_user(
+            username='ivan', password='12345')
+        self.group = Group.objects.create(
+            title='Group', slug='grp_test', description='desc')
+        self.post = Post.objects.create(
+            text='Карточка', author=self.author, group=self.group)
+
+    def test_card_reused_between_feeds(self):
+        """Карточка, отрисованная в одной ленте,
+        берется из кэша в другой"""
+        self.client.get(reverse('index'))
+        # Меняем текст в обход updated: ключ карточки прежний
+        Post.objects.filter(pk=self.post.pk).update(text='Не отрисовано')
+        response = self.client.get(
+            reverse('group_post', kwargs={'slug': self.group.slug}))
+        self.assertContains(response, 'Карточка')
+        self.assertNotContains(response, 'Не отрисовано')
+
+    def test_edited_post_gets_new_card(self):
+        """После редактирования карточка рисуется заново"""
+        self.client.get(reverse('index'))
+        self.client.force_login(self.author)
+        self.client.post(
+            reverse('post_edit', kwargs={'username': self.author.username,
+                                         'post_id': self.post.id}),
+            {'text': 'Новая карточка', 'group': self.group.id})
+        response = self.client.get(
+            reverse('group_post', kwargs={'slug': self.group.slug}))
+        self.assertContains(response, 'Новая карточка')
+
+    def test_edit_link_outside_card(self):
+        """Ссылка «Редактировать» видна только автору,
+        хотя карточка у всех общая"""
+        url = reverse('profile', kwargs={'username': self.author.username})
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(url), 'Редактировать')
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get(url), 'Редактировать')
+        self.assertContains(self.client.get(url), 'Карточка')
+
+
+class TestQueryPlans(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.reader = User.objects.create_user(
+            username='ivan', password='12345')
+        self.group = Group.objects.create(
+            title='Group', slug='grp_test', description='desc')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.post = Post.objects.create(
+            text='Пост', author=self.author, group=self.group)
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queryset, index):
+        plan = self.explain(queryset)
+        message = '\n'.join(plan)
+        self.assertTrue(any(index in step for step in plan), message)
+        self.assertFalse(any('TEMP B-TREE' in step for step in plan),
+                         message)
+        self.assertFalse(
+            any(step.startswith('SCAN') and 'INDEX' not in step
+                for step in plan), message)
+
+    def test_feeds_use_indexes(self):
+        """Ленты читаются по индексу, без полного прохода
+        по таблице и без сортировки во временном B-дереве"""
+        self.assertIndexed(Post.objects.for_feed()[:10],
+                           'post_pub_date_idx')
+        self.assertIndexed(self.group.group_posts.for_feed()[:10],
+                           'post_group_pub_date_idx')
+        self.assertIndexed(self.author.author_posts.for_feed()[:10],
+                           'post_author_pub_date_idx')
+        self.assertIndexed(timeline.feed_for(self.reader).for_feed()[:10],
+                           'timeline_user_feed_idx')
+        self.assertIndexed(Comment.objects.filter(post=self.post),
+                           'comment_post_created_idx')
+
+    def seek(self, queryset, ordering=('-pub_date', '-id'), forward=True):
+        # Запрос страницы ?after= (или ?before=) за первой записью
+        paginator = CursorPaginator(queryset, 10, ordering)
+        values = paginator.decode_cursor(
+            paginator.encode_cursor(queryset.order_by(*ordering).first()))
+        if not forward:
+            ordering = paginator._reversed_ordering()
+        return (queryset.filter(paginator._seek(values, forward))
+                .order_by(*ordering)[:11])
+
+    def test_cursor_pages_use_indexes(self):
+        """Страницы после курсора — диапазон по индексу, а не перебор
+        или сортировка всех строк за курсором"""
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        for forward in (True, False):
+            self.assertIndexed(self.seek(Post.objects.for_feed(),
+                                         forward=forward),
+                               'post_pub_date_idx')
+            self.assertIndexed(
+                self.seek(self.group.group_posts.for_feed(),
+                          forward=forward),
+                'post_group_pub_date_idx')
+            self.assertIndexed(
+                self.seek(self.author.author_posts.for_feed(),
+                          forward=forward),
+                'post_author_pub_date_idx')
+            self.assertIndexed(
+                self.seek(timeline.feed_for(self.reader).for_feed(),
+                          timeline.FEED_ORDERING, forward),
+                'timeline_user_feed_idx')
+            self.assertIndexed(
+                self.seek(Comment.objects.filter(post=self.post),
+                          ('created', 'id'), forward),
+                'comment_post_created_idx')
+        plan = '\n'.join(self.explain(self.seek(Post.objects.for_feed())))
+        self.assertNotIn('MULTI-INDEX OR', plan)
+        self.assertIn('pub_date<?', plan)
+
+    def test_follow_is_unique(self):
+        """Повторная подписка не создает дубликат"""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.reader, author=self.author)
+        self.client.force_login(self.reader)
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': self.author.username}))
+        self.assertEqual(Follow.objects.count(), 1)
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.reader = User.objects.create_user(
+            username='ivan', password='12345')
+        self.group = Group.objects.create(
+            title='Group', slug='grp_test', description='desc')
+        self.post = Post.objects.create(
+            text='Пост', author=self.author, group=self.group)
+        self.urls = [
+            reverse('index'),
+            reverse('group_post', kwargs={'slug': self.group.slug}),
+            reverse('profile', kwargs={'username': self.author.username}),
+            reverse('post_view', kwargs={'username': self.author.username,
+                                         'post_id': self.post.id}),
+        ]
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_not_modified(self):
+        """Неизменившаяся страница отдается как 304"""
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertTrue(response.has_header('Last-Modified'), url)
+            self.assertEqual(self.revalidate(url, response).status_code,
+                             304, url)
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_changes_invalidate_etag(self):
+        """Новый комментарий, правка поста и смена читателя
+        дают новую страницу"""
+        responses = {url: self.client.get(url) for url in self.urls}
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        for url, response in responses.items():
+            self.assertEqual(self.revalidate(url, response).status_code,
+                             200, url)
+        responses = {url: self.client.get(url) for url in self.urls}
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        for url, response in responses.items():
+            self.assertEqual(self.revalidate(url, response).status_code,
+                             200, url)
+        responses = {url: self.client.get(url) for url in self.urls}
+        self.client.force_login(self.reader)
+        for url, response in responses.items():
+            self.assertEqual(self.revalidate(url, response).status_code,
+                             200, url)
+
+    def test_follow_changes_profile(self):
+        """Подписка меняет ETag профиля"""
+        self.client.force_login(self.reader)
+        url = reverse('profile', kwargs={'username': self.author.username})
+        response = self.client.get(url)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_representation_in_etag(self):
+        """HTML и JSON одной ленты не делят ETag"""
+        html = self.client.get(reverse('index'))
+        api = self.client.get(reverse('api_index'))
+        self.assertNotEqual(html['ETag'], api['ETag'])
+        response = self.client.get(reverse('api_index'),
+                                   HTTP_IF_NONE_MATCH=html['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_skip_comment_aggregates(self):
+        """Состояние страницы не считается агрегатом по комментариям"""
+        for url in self.urls:
+            response = self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.revalidate(url, response).status_code,
+                                 304, url)
+            self.assertFalse(
+                any('MAX(' in query['sql'].upper()
+                    or 'posts_comment' in query['sql']
+                    for query in queries.captured_queries), url)
+
+    def test_missing_objects(self):
+        """Для несуществующих страниц по-прежнему 404"""
+        response = self.client.get(
+            reverse('group_post', kwargs={'slug': 'missing'}),
+            HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.first = Post.objects.create(
+            text='Ежики в тумане', author=self.author)
+        self.second = Post.objects.create(
+            text='Про котиков', author=self.author)
+        Comment.objects.create(post=self.second, author=self.author,
+                               text='Ежики тоже бывают')
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('search'),
+                                   {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [post.id for post in response.context['page']]
+
+    def test_ranked_posts_and_comments(self):
+        """Находятся посты по тексту и по комментариям,
+        совпадение в посте выше"""
+        self.assertEqual(self.search('ежики'),
+                         [self.first.id, self.second.id])
+        self.assertEqual(self.search('кот'), [self.second.id])
+        self.assertEqual(self.search('"OR*'), [])
+
+    def test_incremental_index(self):
+        """Индекс обновляется при правке и удалении"""
+        self.first.text = 'Туман над рекой'
+        self.first.save()
+        self.assertEqual(self.search('ежики'), [self.second.id])
+        self.assertEqual(self.search('река'), [])
+        self.assertEqual(self.search('реко'), [self.first.id])
+        self.second.comments.all().delete()
+        self.assertEqual(self.search('ежики'), [])
+
+    def test_pagination(self):
+        """Результаты разбиты на страницы, запрос сохраняется в ссылках"""
+        for i in range(12):
+            Post.objects.create(text=f'Туман {i}', author=self.author)
+        self.assertEqual(len(self.search('туман')), 10)
+        self.assertEqual(len(self.search('туман', page=2)), 3)
+        response = self.client.get(reverse('search'), {'q': 'туман'})
+        self.assertContains(response, '&amp;q=%D1%82%D1%83%D0%BC%D0%B0%D0%BD')
+
+    def test_admin_uses_index(self):
+        """Поиск в админке идет через тот же индекс"""
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@admin.com', password='12345')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/posts/post/', {'q': 'котиков'})
+        self.assertContains(response, 'Про котиков')
+        self.assertNotContains(response, 'Ежики в тумане')
+        self.assertTrue(any('posts_post_fts' in query['sql']
+                            for query in queries.captured_queries))
+
+
+class TestApi(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.group = Group.objects.create(
+            title='Group', slug='grp_test', description='desc')
+        self.posts = [Post.objects.create(text=f'Пост {i}',
+                                          author=self.author,
+                                          group=self.group)
+                      for i in range(15)]
+        self.post = self.posts[-1]
+        for i in range(3):
+            Comment.objects.create(post=self.post, author=self.author,
+                                   text=f'Комментарий {i}')
+
+    def get_json(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_feeds(self):
+        """Ленты отдаются в JSON страницами по курсору"""
+        for url in (reverse('api_index'),
+                    reverse('api_group_post',
+                            kwargs={'slug': self.group.slug}),
+                    reverse('api_profile',
+                            kwargs={'username': self.author.username})):
+            data = self.get_json(url)
+            self.assertEqual(len(data['results']), 10, url)
+            self.assertIsNone(data['previous'])
+            first = data['results'][0]
+            self.assertEqual(first['id'], self.post.id)
+            self.assertEqual(first['author'], 'vasya')
+            self.assertEqual(first['group'], 'grp_test')
+            self.assertEqual(first['comments_count'], 3)
+            data = self.client.get(data['next'])
+            data = json.loads(b''.join(data.streaming_content))
+            self.assertEqual([post['id'] for post in data['results']],
+                             [post.id for post in self.posts[4::-1]])
+            self.assertIsNone(data['next'])
+            self.assertIsNotNone(data['previous'])
+
+    def test_limit(self):
+        """Размер страницы задается параметром limit в разумных пределах"""
+        url = reverse('api_index')
+        self.assertEqual(len(self.get_json(url, limit=3)['results']), 3)
+        self.assertIn('limit=3', self.get_json(url, limit=3)['next'])
+        self.assertEqual(len(self.get_json(url, limit=1000)['results']), 15)
+        self.assertEqual(len(self.get_json(url, limit='x')['results']), 10)
+
+    def test_post_with_comments(self):
+        """Пост отдается вместе с комментариями по порядку"""
+        data = self.get_json(reverse('api_post_view', kwargs={
+            'username': self.author.username, 'post_id': self.post.id}))
+        self.assertEqual(data['post']['text'], self.post.text)
+        self.assertEqual([comment['text'] for comment in data['comments']],
+                         ['Комментарий 0', 'Комментарий 1', 'Комментарий 2'])
+
+    def test_queries(self):
+        """Лента — фиксированное число запросов без создания моделей"""
+        url = reverse('api_index')
+        self.client.get(url)
+        # Состояние для ETag берется из кэша, запрос — только страница
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+            b''.join(response.streaming_content)
+
+    def test_etag_and_missing(self):
+        """ETag как у HTML-страниц, отсутствующее — JSON 404"""
+        url = reverse('api_index')
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('api_profile',
+                                           kwargs={'username': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'Не найдено'})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 405)
+
+    def test_user_named_api(self):
+        """API не перекрывает страницы пользователя с именем api"""
+        user = User.objects.create_user(username='api', password='12345')
+        post = Post.objects.create(text='Пост api', author=user)
+        self.client.force_login(self.author)
+        response = self.client.get(
+            reverse('post_view', kwargs={'username': 'api',
+                                         'post_id': post.id}))
+        self.assertContains(response, 'Пост api')
+        self.assertNotEqual(response['Content-Type'], 'application/json')
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': 'api'}))
+        self.assertTrue(Follow.objects.filter(user=self.author,
+                                              author=user).exists())
+
+    def test_reserved_usernames(self):
+        """Имена, совпадающие с разделами сайта, не регистрируются"""
+        response = self.client.post(reverse('signup'), {
+            'username': 'Search', 'password1': 'Sup3r-secret!',
+            'password2': 'Sup3r-secret!'})
+        self.assertFormError(response, 'form', 'username',
+                             'Это имя пользователя занято')
+        self.assertFalse(User.objects.filter(username='Search').exists())
+
+    def test_image_url_from_field_storage(self):
+        """Адрес картинки строит хранилище поля image"""
+        Post.objects.filter(pk=self.post.pk).update(
+            image='posts/ab/' + 'ab' * 32 + '.jpg')
+        data = self.get_json(reverse('api_index'))
+        self.assertEqual(
+            data['results'][0]['image'],
+            self.post.image.storage.url('posts/ab/' + 'ab' * 32 + '.jpg'))
+
+
+class TestBulkImportExport(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.reader = User.objects.create_user(
+            username='ivan', password='12345')
+        self.group = Group.objects.create(
+            title='Group', slug='grp_test', description='desc')
+        self.post = Post.objects.create(text='Пост', author=self.author,
+                                        group=self.group)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def export(self, *args):
+        path = os.path.join(self.tmp, 'dump')
+        call_command('export_posts', '-o', path, *args, stderr=StringIO())
+        return path
+
+    def import_(self, path, *args):
+        out = StringIO()
+        call_command('import_posts', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_roundtrip(self):
+        """Выгрузка загружается в пустую базу с датами, счетчиками,
+        лентами и инвалидацией кэша"""
+        with tempfile.TemporaryDirectory() as self.tmp:
+            path = self.export()
+            pub_date = self.post.pub_date
+            Group.objects.all().delete()
+            User.objects.all().delete()
+            self.assertFalse(Post.objects.exists())
+            version = feed_cache.version(feed_cache.index_scope())
+            report = self.import_(path, '--batch-size', '1')
+
+        self.assertIn('строк/с', report)
+        post = Post.objects.get()
+        self.assertEqual(post.pub_date, pub_date)
+        self.assertEqual(post.group.slug, 'grp_test')
+        self.assertEqual(post.comments.get().author.username, 'ivan')
+        reader = User.objects.get(username='ivan')
+        self.assertFalse(reader.has_usable_password())
+        self.assertEqual(UserStats.objects.get(user=post.author).posts_count,
+                         1)
+        self.assertEqual(reader.stats.following_count, 1)
+        self.assertEqual(reader.stats.comments_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(user=reader,
+                                                     post=post).exists())
+        self.assertGreater(feed_cache.version(feed_cache.index_scope()),
+                           version)
+
+    def test_csv_and_repeat(self):
+        """CSV по одной модели; повторная загрузка не дублирует строки"""
+        with tempfile.TemporaryDirectory() as self.tmp:
+            path = self.export('--format', 'csv', '--model', 'post')
+            with open(path, encoding='utf-8') as dump:
+                self.assertEqual(dump.readline().strip(),
+                                 'id,author,group,text,pub_date,image')
+            report = self.import_(path, '--format', 'csv', '--model', 'post')
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertIn('Загружено строк: 0', report)
+
+    def test_bulk_queries(self):
+        """Пачка постов — фиксированное число запросов"""
+        records = [('post', {'id': 100 + i, 'author': 'vasya',
+                             'group': 'grp_test', 'text': f'Пост {i}'})
+                   for i in range(50)]
+        importer = bulk.Importer(batch_size=50)
+        # Пользователь, группа, занятые id, вставка, даты
+        # и точки сохранения транзакции
+        with self.assertNumQueries(7):
+            importer.load(records)
+        importer.finish()
+        self.assertEqual(self.author.stats.posts_count, 51)
+        self.assertEqual(importer.counts['post'], 50)
+
+    def test_id_collision(self):
+        """Занятый другим постом id не теряет пост и его комментарии"""
+        local = Post.objects.create(text='Местный пост', author=self.reader)
+        records = [
+            ('post', {'id': local.id, 'author': 'remote', 'text': 'Чужой',
+                      'pub_date': '2020-01-01T00:00:00+00:00'}),
+            ('comment', {'id': 1, 'post': local.id, 'author': 'remote',
+                         'text': 'Чужой комментарий',
+                         'created': '2020-01-02T00:00:00+00:00'}),
+        ]
+        importer = bulk.Importer()
+        importer.load(records)
+        importer.finish()
+        self.assertEqual(importer.counts, {'group': 0, 'post': 1,
+                                           'comment': 1, 'follow': 0})
+        remote = Post.objects.get(text='Чужой')
+        self.assertNotEqual(remote.id, local.id)
+        self.assertEqual(remote.pub_date.year, 2020)
+        comment = Comment.objects.get(text='Чужой комментарий')
+        self.assertEqual(comment.post, remote)
+        self.assertEqual(comment.created.day, 2)
+        self.assertFalse(local.comments.exists())
+        # Повторная загрузка узнает уже загруженные записи
+        importer = bulk.Importer()
+        importer.load([records[0]])
+        self.assertEqual(importer.counts['post'], 0)
+
+    def test_bad_data(self):
+        """Ошибки в данных не оставляют частично загруженную пачку"""
+        with tempfile.TemporaryDirectory() as self.tmp:
+            path = os.path.join(self.tmp, 'bad.ndjson')
+            with open(path, 'w', encoding='utf-8') as dump:
+                dump.write('{"model": "post", "author": "vasya", '
+                           '"group": "missing", "text": "x"}\n')
+            with self.assertRaises(CommandError):
+                self.import_(path)
+        self.assertEqual(Post.objects.count(), 1)
+
+
+class TestBenchmark(TestCase):
+    def test_scenarios(self):
+        """Все сценарии проходят на маленьком наборе данных"""
+        dataset = benchmark.Dataset(users=5, posts=30, comments=20,
+                                    follows=2, groups=2, images=0)
+        with tempfile.TemporaryDirectory() as media_root:
+            counts = dataset.load(media_root)
+        self.assertEqual(counts['follow'], 10)
+        for name in benchmark.SCENARIOS:
+            metrics = benchmark.run_scenario(name, dataset,
+                                             requests=5, warmup=1)
+            self.assertEqual(metrics['requests'], 5)
+            self.assertGreater(metrics['queries'], 0)
+            self.assertLessEqual(metrics['p50'], metrics['p99'])
+
+    def test_compare(self):
+        """Регрессия — рост задержки сверх допуска или рост числа
+        запросов"""
+        base = {'index': {'p50': 10, 'p95': 20, 'p99': 30, 'queries': 5,
+                          'rps': 100, 'requests': 10}}
+        same = {'index': dict(base['index'], p95=23)}
+        self.assertEqual(benchmark.compare(same, base, 0.2), [])
+        worse = {'index': dict(base['index'], p99=40, queries=6)}
+        self.assertEqual(benchmark.compare(worse, base, 0.2),
+                         [('index', 'p99', 30, 40),
+                          ('index', 'queries', 5, 6)])
+
+
+class TestRequestTiming(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+
+    def test_server_timing_and_log(self):
+        """Заголовок Server-Timing и JSON-строка в логе на каждый запрос"""
+        with self.assertLogs('yatube.requests', 'INFO') as logs:
+            response = self.client.get(reverse('index'))
+        # Анонимным клиентам замеры не показываются
+        self.assertFalse(response.has_header('Server-Timing'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'index')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertGreater(record['cache_misses'], 0)
+        with self.assertLogs('yatube.requests', 'INFO') as logs:
+            self.client.get(reverse('index'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertGreater(record['cache_hits'], 0)
+
+    def test_header_for_staff(self):
+        """Server-Timing видят сотрудники или все по настройке"""
+        self.author.is_staff = True
+        self.author.save()
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('index'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.client.logout()
+        with self.settings(REQUEST_TIMING_HEADER=True):
+            response = self.client.get(reverse('index'))
+        self.assertIn('cache;desc=', response['Server-Timing'])
+
+    @override_settings(REQUEST_TIMING_SLOW_MS=0,
+                       REQUEST_TIMING_SLOW_SAMPLE=1)
+    def test_slow_queries(self):
+        """Медленные запросы к базе попадают в отдельный лог"""
+        with self.assertLogs('yatube.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('index'))
+        self.assertIn('posts_post', logs.output[-1])
+
+    @override_settings(REQUEST_TIMING=False)
+    def test_disabled(self):
+        """Выключенное middleware не участвует в обработке запросов"""
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+@override_settings(POSTS_PAGINATION={'index': 'estimated',
+                                     'profile': 'estimated'},
+                   POSTS_PAGINATION_COUNT_LIMIT=30)
+class TestEstimatedPagination(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='vasya', password='12345')
+        Post.objects.bulk_create([Post(text=f'Пост {i}', author=self.user)
+                                  for i in range(45)])
+
+    def get_page(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        counts = [query['sql'] for query in queries.captured_queries
+                  if query['sql'].startswith('SELECT COUNT(*)')]
+        return response, counts
+
+    def test_capped_count(self):
+        """Записи считаются не дальше предела, листать можно дальше"""
+        url = reverse('profile', kwargs={'username': self.user.username})
+        response, counts = self.get_page(url)
+        self.assertEqual(len(counts), 1)
+        self.assertIn('LIMIT 31', counts[0])
+        self.assertNotIn('posts_comment', counts[0])
+        paginator = response.context['paginator']
+        self.assertTrue(paginator.is_capped)
+        self.assertContains(response, '&hellip;')
+        response, _ = self.get_page(url, page=5)
+        page = response.context['page']
+        self.assertEqual(page.number, 5)
+        self.assertEqual(len(page), 5)
+        self.assertFalse(page.has_next())
+
+    def test_table_estimate(self):
+        """Для общей ленты число записей берется из статистики SQLite"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        response, counts = self.get_page(reverse('index'))
+        self.assertEqual(counts, [])
+        self.assertEqual(response.context['paginator'].count, 45)
+        self.assertFalse(response.context['paginator'].is_capped)
+        response, _ = self.get_page(reverse('index'), page=99)
+        self.assertEqual(response.context['page'].number, 1)
+
+    def test_page_window(self):
+        """Виджет показывает окно страниц вокруг текущей"""
+        paginator = Paginator(range(1000), 10)
+        self.assertEqual(page_window(paginator.page(1)),
+                         [1, 2, 3, None, 100])
+        self.assertEqual(page_window(paginator.page(50)),
+                         [1, None, 48, 49, 50, 51, 52, None, 100])
+        self.assertEqual(page_window(paginator.page(99)),
+                         [1, None, 97, 98, 99, 100])
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, '?page=4"')
+
+    @override_settings(POSTS_PAGINATION={})
+    def test_offset_count_cached(self):
+        """Обычный Paginator считает записи один раз на версию ленты"""
+        url = reverse('index')
+        response, counts = self.get_page(url)
+        self.assertEqual(len(counts), 1)
+        self.assertIs(type(response.context['paginator']), Paginator)
+        response, counts = self.get_page(url, page=2)
+        self.assertEqual(counts, [])
+        self.assertEqual(response.context['paginator'].count, 45)
+        Post.objects.create(text='Новый пост', author=self.user)
+        response, counts = self.get_page(url)
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(response.context['paginator'].count, 46)
+
+
+class TestPostComments(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+        self.url = reverse('post_view', kwargs={
+            'username': self.author.username, 'post_id': self.post.id})
+
+    def add_comments(self, count):
+        users = [User.objects.create_user(username=f'user{i}')
+                 for i in range(User.objects.count(),
+                                User.objects.count() + 5)]
+        Comment.objects.bulk_create(
+            [Comment(post=self.post, author=users[i % 5],
+                     text=f'Комментарий {i}') for i in range(count)])
+
+    def count_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        return len(queries.captured_queries)
+
+    def test_constant_queries(self):
+        """Число запросов не зависит от количества комментариев"""
+        self.add_comments(3)
+        few = self.count_queries()
+        self.add_comments(120)
+        self.assertEqual(self.count_queries(), few)
+
+    def test_more_comments_fragment(self):
+        """Следующие страницы комментариев отдаются фрагментом"""
+        self.add_comments(COMMENTS_PER_PAGE + 5)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['comments']),
+                         COMMENTS_PER_PAGE)
+        self.assertContains(response, 'js-more-comments')
+        more = reverse('post_comments', kwargs={
+            'username': self.author.username, 'post_id': self.post.id})
+        response = self.client.get(
+            more, {'after': response.context['comments_after']})
+        self.assertTemplateUsed(response, 'posts/comment_list.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertEqual([comment.text for comment
+                          in response.context['comments']],
+                         [f'Комментарий {i}' for i in
+                          range(COMMENTS_PER_PAGE, COMMENTS_PER_PAGE + 5)])
+        self.assertNotContains(response, 'js-more-comments')
+
+
+@override_settings(POSTS_WRITE_BUFFER=True)
+class TestWriteBuffer(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='vasya', password='12345')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+        self.client.force_login(self.author)
+        self.post_url = reverse('post_view', kwargs={
+            'username': self.author.username, 'post_id': self.post.id})
+        # Очередь разбираем вручную, чтобы увидеть записи в ожидании
+        request_finished.disconnect(flush_write_buffer)
+        self.addCleanup(request_finished.connect, flush_write_buffer)
+
+    def test_pending_comment_visible_to_author(self):
+        """Комментарий в очереди виден автору до сохранения"""
+        self.client.post(reverse('add_comment', kwargs={
+            'username': self.author.username, 'post_id': self.post.id}),
+            {'text': 'Отложенный комментарий'})
+        self.assertFalse(Comment.objects.exists())
+        response = self.client.get(self.post_url)
+        self.assertContains(response, 'Отложенный комментарий')
+        self.assertContains(response, 'публикуется')
+        self.assertEqual(write_buffer.flush(), 1)
+        response = self.client.get(self.post_url)
+        self.assertContains(response, 'Отложенный комментарий')
+        self.assertNotContains(response, 'публикуется')
+        self.assertEqual(
+            cache.get(write_buffer.PENDING_KEY.format(self.author.pk)), [])
+        self.assertEqual(self.author.stats.comments_count, 1)
+
+    def test_submit_does_not_write_database(self):
+        """Запрос с отложенной записью не пишет в базу, даже в сессию"""
+        url = reverse('add_comment', kwargs={
+            'username': self.author.username, 'post_id': self.post.id})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, {'text': 'Отложенный комментарий'})
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if not query['sql'].startswith('SELECT')])
+
+    def test_batch_side_effects(self):
+        """Пачка обновляет счетчики, ленты подписок и версии кэша"""
+        reader = User.objects.create_user(username='ivan', password='12345')
+        Follow.objects.create(user=reader, author=self.author)
+        version = feed_cache.version(feed_cache.index_scope())
+        updated = self.post.updated
+        for i in range(3):
+            self.client.post(reverse('new_post'), {'text': f'Новый {i}'})
+        self.client.post(reverse('add_comment', kwargs={
+            'username': self.author.username, 'post_id': self.post.id}),
+            {'text': 'Комментарий'})
+        self.assertEqual(write_buffer.flush(), 4)
+        self.assertEqual(UserStats.objects.for_user(self.author).posts_count,
+                         4)
+        self.assertEqual(self.author.stats.comments_count, 1)
+        self.assertEqual(TimelineEntry.objects.filter(user=reader).count(),
+                         4)
+        self.assertGreater(feed_cache.version(feed_cache.index_scope()),
+                           version)
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.updated, updated)
+
+    def test_posts_written_in_batches(self):
+        """Посты из очереди сохраняются пачками в одной транзакции"""
+        for i in range(5):
+            self.client.post(reverse('new_post'), {'text': f'Новый {i}'})
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Новый 4')
+        self.assertContains(response, 'публикуется')
+        with override_settings(POSTS_WRITE_BUFFER_BATCH=2):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(write_buffer.flush(), 5)
+        savepoints = [query for query in queries.captured_queries
+                      if query['sql'].startswith('SAVEPOINT')]
+        self.assertEqual(len(savepoints), 3)
+        self.assertEqual(Post.objects.filter(text__startswith='Новый')
+                         .count(), 5)
+
+    def test_failed_write_is_dropped(self):
+        """Запись к удаленному посту отбрасывается, остальные сохраняются"""
+        self.client.post(reverse('add_comment', kwargs={
+            'username': self.author.username, 'post_id': self.post.id}),
+            {'text': 'Потерянный'})
+        self.client.post(reverse('new_post'), {'text': 'Уцелевший'})
+        Post.objects.filter(pk=self.post.pk).delete()
+        with self.assertLogs('posts.write_buffer', 'WARNING'):
+            self.assertEqual(write_buffer.flush(), 2)
+        self.assertTrue(Post.objects.filter(text='Уцелевший').exists())
+        self.assertFalse(Comment.objects.exists())
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'публикуется')
+
+
+class TestSQLiteBackend(TestCase):
+    def make_connection(self, path, **options):
+        settings_dict = dict(connection.settings_dict, NAME=path,
+                             OPTIONS=options)
+        wrapper = SQLiteDatabaseWrapper(settings_dict, alias='sqlite_test')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_pragmas(self):
+        """Соединение открывается с настройками из профиля"""
+        with tempfile.TemporaryDirectory() as tmp:
+            wrapper = self.make_connection(
+                os.path.join(tmp, 'db.sqlite3'),
+                PRAGMAS={'cache_size': -1000})
+            with wrapper.cursor() as cursor:
+                values = {}
+                for name in ('journal_mode', 'synchronous', 'temp_store',
+                             'cache_size', 'busy_timeout'):
+                    cursor.execute(f'PRAGMA {name}')
+                    values[name] = cursor.fetchone()[0]
+            wrapper.close()
+        self.assertEqual(values, {'journal_mode': 'wal', 'synchronous': 1,
+                                  'temp_store': 2, 'cache_size': -1000,
+                                  'busy_timeout': 5000})
+
+    def test_retry_when_locked(self):
+        """Запрос повторяется, пока другой процесс держит блокировку"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'db.sqlite3')
+            holder = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+            holder.execute('PRAGMA journal_mode = WAL')
+            holder.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+            holder.execute('BEGIN IMMEDIATE')
+            threading.Timer(0.2, holder.execute, ['COMMIT']).start()
+
+            wrapper = self.make_connection(path, timeout=0, RETRIES=5)
+            with wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO item DEFAULT VALUES')
+                cursor.execute('SELECT COUNT(*) FROM item')
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+            holder.execute('BEGIN IMMEDIATE')
+            wrapper = self.make_connection(path, timeout=0, RETRIES=0)
+            with self.assertRaisesMessage(OperationalError, 'locked'):
+                with wrapper.cursor() as cursor:
+                    cursor.execute('INSERT INTO item DEFAULT VALUES')
+            holder.execute('COMMIT')
+            holder.close()
+            wrapper.close()
+
+    def test_begin_immediate_only_for_writes(self):
+        """BEGIN IMMEDIATE берется только в immediate_atomic()"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'db.sqlite3')
+            holder = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+            holder.execute('PRAGMA journal_mode = WAL')
+            holder.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+            wrapper = self.make_connection(path, timeout=0, RETRIES=0)
+            connections['sqlite_test'] = wrapper
+            self.addCleanup(delattr, connections._connections,
+                            'sqlite_test')
+
+            holder.execute('BEGIN IMMEDIATE')
+            # Обычный atomic() читает, пока другой процесс пишет
+            with transaction.atomic(using='sqlite_test'):
+                with wrapper.cursor() as cursor:
+                    cursor.execute('SELECT COUNT(*) FROM item')
+                    self.assertEqual(cursor.fetchone()[0], 0)
+            with self.assertRaisesMessage(OperationalError, 'locked'):
+                with immediate_atomic(using='sqlite_test'):
+                    pass
+            self.assertFalse(wrapper.begin_immediate)
+            holder.execute('COMMIT')
+
+            with immediate_atomic(using='sqlite_test'):
+                with wrapper.cursor() as cursor:
+                    cursor.execute('INSERT INTO item DEFAULT VALUES')
+            self.assertFalse(wrapper.begin_immediate)
+            holder.close()
+            wrapper.close()
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class TestReplicas(TransactionTestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        connections.databases['replica'] = dict(
+            connection.settings_dict,
+            NAME=os.path.join(tmp.name, 'replica.sqlite3'))
+        self.addCleanup(self.drop_replica)
+        self.user = User.objects.create_user(username='vasya',
+                                             password='12345')
+        Post.objects.create(text='Пост на реплике', author=self.user)
+        replicas.sync()
+        Post.objects.create(text='Пост только в основной базе',
+                            author=self.user)
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections.databases['replica']
+        del connections._connections.replica
+
+    def test_feeds_read_from_replica(self):
+        """Ленты читаются с реплики, остальное — из основной базы"""
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Пост на реплике')
+        self.assertNotContains(response, 'Пост только в основной базе')
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+
+        response = self.client.get(reverse('profile', args=['vasya']))
+        self.assertNotContains(response, 'Пост только в основной базе')
+
+    def test_sticky_primary_after_write(self):
+        """После записи клиент читает из основной базы"""
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('new_post'),
+                                    {'text': 'Новый пост'})
+        self.assertEqual(
+            response.cookies[replicas.STICKY_COOKIE]['max-age'],
+            replicas.sticky_seconds())
+        self.assertFalse(
+            Post.objects.using('replica').filter(text='Новый пост').exists())
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Новый пост')
+        self.assertContains(response, 'Пост только в основной базе')
+
+    def test_login_does_not_pin_primary(self):
+        """Вход пишет сессию и last_login, но не закрепляет клиента"""
+        response = self.client.post(
+            reverse('login'), {'username': 'vasya', 'password': '12345'})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'Пост только в основной базе')
+
+    @override_settings(DATABASE_REPLICAS=['replica', 'replica'])
+    def test_replica_chosen_once_per_request(self):
+        """Реплика выбирается один раз на запрос, а не на каждый SQL"""
+        with mock.patch.object(replicas.random, 'choice',
+                               wraps=replicas.random.choice) as choice:
+            self.client.get(reverse('profile', args=['vasya']))
+        self.assertEqual(choice.call_count, 1)
+
+
+class TestAdmin(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@admin.com', password='12345')
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count, start=0):
+        for i in range(start, start + count):
+            author = User.objects.create_user(username=f'author{i}')
+            post = Post.objects.create(text=f'Пост {i}', author=author)
+            Comment.objects.create(post=post, author=author,
+                                   text=f'Комментарий {i}')
+            Follow.objects.create(user=self.admin, author=author)
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:posts_{model}_changelist')
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(captured.captured_queries)
+
+    def test_queries_do_not_grow_with_rows(self):
+        """Число запросов списка не зависит от числа строк"""
+        self.add_rows(2)
+        before = {model: self.changelist_queries(model)
+                  for model in ('post', 'comment', 'follow')}
+        self.add_rows(4, start=2)
+        after = {model: self.changelist_queries(model)
+                 for model in ('post', 'comment', 'follow')}
+        self.assertEqual(before, after)
+
+    def test_search_by_username(self):
+        """Комментарии и подписки ищутся по имени пользователя"""
+        self.add_rows(2)
+        response = self.client.get(
+            reverse('admin:posts_comment_changelist'), {'q': 'author1'})
+        self.assertContains(response, 'Комментарий 1')
+        self.assertNotContains(response, 'Комментарий 0')
+        response = self.client.get(
+            reverse('admin:posts_follow_changelist'), {'q': 'author0'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_date_hierarchy(self):
+        """Список постов можно сузить по дате публикации"""
+        self.add_rows(1)
+        post = Post.objects.get()
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'),
+            {'pub_date__year': post.pub_date.year})
+        self.assertContains(response, 'Пост 0')
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'),
+            {'pub_date__year': post.pub_date.year - 1})
+        self.assertNotContains(response, 'Пост 0')
+
+
+@override_settings(POSTS_BULK_JOB_CHUNK=2)
+class TestBulkJobs(TransactionTestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@admin.com', password='12345')
+        self.spammer = User.objects.create_user(username='spammer')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(title='Группа', slug='group',
+                                          description='Группа')
+        Follow.objects.create(user=self.reader, author=self.spammer)
+        self.posts = [Post.objects.create(text=f'Спам {i}',
+                                          author=self.spammer)
+                      for i in range(5)]
+        for post in self.posts:
+            Comment.objects.create(post=post, author=self.reader,
+                                   text='Комментарий')
+        self.client.force_login(self.admin)
+
+    def action(self, action, posts, **data):
+        return self.client.post(reverse('admin:posts_post_changelist'), {
+            'action': action, 'index': 0,
+            '_selected_action': [post.pk for post in posts], **data})
+
+    def test_delete_posts(self):
+        """Удаление идет пачками в фоне, счетчики и ленты пересчитаны"""
+        response = self.action('delete_posts', self.posts[:4])
+        self.assertContains(response, 'Выбрано объектов: 4')
+        self.assertEqual(BulkJob.objects.count(), 0)
+
+        self.action('delete_posts', self.posts[:4], apply='1')
+        job = BulkJob.objects.get()
+        self.assertEqual((job.status, job.processed, job.total),
+                         (BulkJob.DONE, 4, 4))
+        response = self.client.get(
+            reverse('admin:posts_bulkjob_change', args=[job.pk]))
+        self.assertContains(response, '4 из 4 (100%)')
+        self.assertEqual(list(Post.objects.all()), self.posts[4:])
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+        self.assertEqual(self.spammer.stats.posts_count, 1)
+        self.reader.stats.refresh_from_db()
+        self.assertEqual(self.reader.stats.comments_count, 1)
+
+    def test_move_and_reassign(self):
+        """Перенос в группу и смена автора без загрузки постов"""
+        version = feed_cache.version(feed_cache.group_scope(self.group.pk))
+        self.action('move_to_group', self.posts[:3], group=self.group.pk,
+                    apply='1')
+        self.assertEqual(self.group.group_posts.count(), 3)
+        self.assertNotEqual(
+            feed_cache.version(feed_cache.group_scope(self.group.pk)),
+            version)
+
+        response = self.action('reassign_author', self.posts[:3],
+                               username='nobody', apply='1')
+        self.assertContains(response, 'Пользователь не найден')
+        self.action('reassign_author', self.posts[:3], username='admin',
+                    apply='1')
+        self.assertEqual(self.admin.author_posts.count(), 3)
+        self.spammer.stats.refresh_from_db()
+        self.assertEqual(self.spammer.stats.posts_count, 2)
+        # Читатель подписан только на прежнего автора
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader).count(), 2)
+
+    def test_failed_job_resumes(self):
+        """Упавшее задание помечается ошибкой и продолжается с места"""
+        calls = []
+
+        def flaky(ids, touched):
+            calls.append(ids)
+            if len(calls) == 2:
+                raise RuntimeError('сбой')
+            jobs.delete_posts(ids, touched)
+
+        original = jobs.ACTIONS['delete_posts']
+        jobs.ACTIONS['delete_posts'] = flaky
+        try:
+            job = jobs.start('delete_posts', Post.objects.all())
+        finally:
+            jobs.ACTIONS['delete_posts'] = original
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.error),
+                         (BulkJob.FAILED, 2, 'сбой'))
+        self.spammer.stats.refresh_from_db()
+        self.assertEqual(self.spammer.stats.posts_count, 3)
+
+        job = jobs.run(job.pk)
+        self.assertEqual((job.status, job.processed), (BulkJob.DONE, 5))
+        self.assertFalse(Post.objects.exists())
+
+    def test_resume_after_restart(self):
+        """Задание, прерванное перезапуском, продолжает команда
+        и сбрасывает кэши и для пачек, обработанных до перезапуска"""
+        name = 'posts/ab/' + 'ab' * 32 + '.jpg'
+        Post.objects.filter(pk=self.posts[0].pk).update(image=name)
+        calls = []
+
+        def crash(ids, touched):
+            calls.append(ids)
+            if len(calls) == 2:
+                # Процесс убит: ни except, ни сброса кэшей
+                raise KeyboardInterrupt
+            jobs.delete_posts(ids, touched)
+
+        original = jobs.ACTIONS['delete_posts']
+        jobs.ACTIONS['delete_posts'] = crash
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                jobs.start('delete_posts', Post.objects.all())
+        finally:
+            jobs.ACTIONS['delete_posts'] = original
+        job = BulkJob.objects.get()
+        self.assertEqual((job.status, job.processed),
+                         (BulkJob.RUNNING, 2))
+        self.assertEqual(json.loads(job.touched)['images'], [name])
+
+        out = StringIO()
+        with mock.patch.object(jobs.images, 'release') as release:
+            call_command('resume_bulk_jobs', stdout=out)
+        release.assert_called_once_with(name)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.touched),
+                         (BulkJob.DONE, 5, '{}'))
+        self.assertIn('5 из 5', out.getvalue())
+        self.assertFalse(Post.objects.exists())
+        self.reader.stats.refresh_from_db()
+        self.assertEqual(self.reader.stats.comments_count, 0)
+
+    def test_failed_invalidate_finishes_job(self):
+        """Ошибка сброса кэшей не оставляет задание «выполняющимся»"""
+        with mock.patch.object(jobs, '_invalidate',
+                               side_effect=RuntimeError('кэш')):
+            job = jobs.start('delete_posts', Post.objects.filter(
+                pk__in=[post.pk for post in self.posts[:2]]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.error),
+                         (BulkJob.FAILED, 2, 'кэш'))
+        self.assertIn(self.spammer.pk, json.loads(job.touched)['users'])
+
+    def test_actions_need_permissions(self):
+        """Действия доступны только с правами на удаление и изменение"""
+        moderator = User.objects.create_user(username='moderator',
+                                             password='12345', is_staff=True)
+        moderator.user_permissions.set(Permission.objects.filter(
+            codename__in=['view_post', 'change_post']))
+        self.client.force_login(moderator)
+        response = self.client.get(reverse('admin:posts_post_changelist'))
+        actions = dict(response.context['action_form']
+                       .fields['action'].choices)
+        self.assertNotIn('delete_posts', actions)
+        self.assertIn('move_to_group', actions)
+        self.assertIn('reassign_author', actions)
+
+        self.action('delete_posts', self.posts, apply='1')
+        self.assertEqual(BulkJob.objects.count(), 0)
+        self.assertEqual(Post.objects.count(), 5)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), POSTS_IMAGE_MAX_SIZE=400)
+class TestImageProcessing(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='vasya', password='12345')
+        self.client.force_login(self.user)
+
+    def upload(self, upload):
+        return self.client.post(reverse('new_post'),
+                                {'text': 'Пост с картинкой', 'image': upload})
+
+    def stored(self):
+        post = Post.objects.get()
+        return post.image.name, Image.open(post.image.path)
+
+    def test_downscaled_without_exif(self):
+        """Картинка уменьшается, поворачивается по EXIF и хранится
+        прогрессивным JPEG без метаданных"""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90°
+        exif[0x010F] = 'Телефон'
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), (200, 30, 30)).save(
+            buffer, 'JPEG', exif=exif.tobytes())
+        self.upload(SimpleUploadedFile('photo.jpeg', buffer.getvalue()))
+        name, image = self.stored()
+        self.assertTrue(name.endswith('.jpg'))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (267, 400))
+        self.assertTrue(image.info.get('progressive'))
+        self.assertNotIn('exif', image.info)
+
+    def test_transparent_png_to_webp(self):
+        """PNG с прозрачностью в формате WebP сохраняет альфа-канал"""
+        buffer = BytesIO()
+        Image.new('RGBA', (50, 50), (0, 0, 255, 128)).save(buffer, 'PNG')
+        with self.settings(POSTS_IMAGE_FORMAT='WEBP'):
+            self.upload(SimpleUploadedFile('logo.png', buffer.getvalue()))
+        name, image = self.stored()
+        self.assertTrue(name.endswith('.webp'))
+        self.assertEqual((image.format, image.mode), ('WEBP', 'RGBA'))
+
+    def test_limits(self):
+        """Слишком большие файлы и картинки отклоняются до декодирования"""
+        with self.settings(POSTS_IMAGE_MAX_PIXELS=1000 * 1000):
+            response = self.upload(make_image(size=(1200, 1000)))
+        self.assertFormError(response, 'form', 'image',
+                             'Картинка больше 1 мегапикселей')
+        with self.settings(POSTS_IMAGE_MAX_BYTES=1024):
+            response = self.upload(make_image())
+        self.assertFormError(response, 'form', 'image',
+                             'Файл больше 1,0\xa0КБ')
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'BMP')
+        response = self.upload(SimpleUploadedFile('a.bmp',
+                                                   buffer.getvalue()))
+        self.assertFormError(response, 'form', 'image',
+                             'Формат BMP не поддерживается')
+        self.assertFalse(Post.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestContentAddressedImages(TransactionTestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='vasya', password='12345')
+        self.client.force_login(self.user)
+
+    def new_post(self, text, image):
+        self.client.post(reverse('new_post'), {'text': text, 'image': image})
+        return Post.objects.get(text=text)
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(settings.MEDIA_ROOT, name))
+
+    def test_same_image_stored_once(self):
+        """Одинаковые картинки — один файл, он живет, пока есть ссылки"""
+        first = self.new_post('Первый', make_image('a.jpg'))
+        second = self.new_post('Второй', make_image('b.jpg'))
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertRegex(name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+
+        first.delete()
+        self.assertTrue(self.exists(name))
+        second.delete()
+        self.assertFalse(self.exists(name))
+
+    def test_replaced_image_released(self):
+        """Замененная при правке картинка удаляется"""
+        post = self.new_post('Пост', make_image(size=(300, 200)))
+        old_name = post.image.name
+        self.client.post(
+            reverse('post_edit', args=[self.user.username, post.pk]),
+            {'text': 'Пост', 'image': make_image(size=(200, 300))})
+        post.refresh_from_db()
+        self.assertNotEqual(post.image.name, old_name)
+        self.assertTrue(self.exists(post.image.name))
+        self.assertFalse(self.exists(old_name))
+
+    def test_bulk_delete_releases_images(self):
+        """Фоновое удаление постов удаляет и их картинки"""
+        post = self.new_post('Пост', make_image())
+        jobs.start('delete_posts', Post.objects.all())
+        self.assertFalse(self.exists(post.image.name))
+
+    def test_immutable_cache_headers(self):
+        """Файлы по хешу кэшируются навсегда, остальные — нет"""
+        post = self.new_post('Пост', make_image())
+        # Вне DEBUG /media/ отдает веб-сервер, а не Django
+        with self.assertRaises(Resolver404):
+            resolve(settings.MEDIA_URL + post.image.name)
+        factory = RequestFactory()
+        response = views.media(factory.get('/'), post.image.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'posts'),
+                    exist_ok=True)
+        with open(os.path.join(settings.MEDIA_ROOT, 'posts/old.jpg'),
+                  'wb') as file:
+            file.write(b'old')
+        response = views.media(factory.get('/'), 'posts/old.jpg')
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_release_and_upload_share_lock(self):
+        """Проверка ссылок в release и сохранение поста — под
+        блокировкой записи, иначе загрузка той же картинки могла бы
+        сослаться на удаляемый файл"""
+        first = self.new_post('Первый', make_image())
+        name = first.image.name
+        Post.objects.filter(pk=first.pk).delete()
+        with CaptureQueriesContext(connection) as queries:
+            second = self.new_post('Второй', make_image())
+        sql = [query['sql'] for query in queries.captured_queries]
+        begin = sql.index('BEGIN IMMEDIATE')
+        self.assertTrue(sql[begin + 1].startswith('INSERT INTO "posts_post"'))
+        self.assertEqual(second.image.name, name)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(images.release(name))
+        self.assertEqual(queries.captured_queries[0]['sql'],
+                         'BEGIN IMMEDIATE')
+        self.assertTrue(self.exists(name))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestResponsiveImages(TransactionTestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='vasya', password='12345')
+        self.client.force_login(self.user)
+        for i, color in enumerate(((200, 0, 0), (0, 200, 0), (0, 0, 200))):
+            buffer = BytesIO()
+            Image.new('RGB', (1200, 800), color).save(buffer, 'JPEG')
+            self.client.post(reverse('new_post'), {
+                'text': f'Пост {i}',
+                'image': SimpleUploadedFile(f'{i}.jpg', buffer.getvalue())})
+
+    def test_srcset(self):
+        """Карточка отдает WebP и JPEG нескольких ширин"""
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '<img', count=3)
+        self.assertContains(response, '<source type="image/webp"', count=3)
+        html = response.content.decode()
+        for width in thumbnails.CARD_WIDTHS:
+            self.assertRegex(html, rf'\.webp {width}w')
+            self.assertRegex(html, rf'\.jpg {width}w')
+
+    def test_one_kvstore_query_per_page(self):
+        """Адреса всех миниатюр страницы — одним запросом к KV-хранилищу"""
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, '<picture>', count=3)
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'thumbnail_kvstore' in query['sql']]), 1)
+
+    def test_keys_match_get_thumbnail(self):
+        """Вычисленные ключи совпадают с теми, что пишет get_thumbnail"""
+        image = Post.objects.first().image
+        KVStore.objects.all().delete()
+        cache.clear()
+        thumbnails.generate(image)
+        written = set(KVStore.objects.values_list('key', flat=True))
+        source = ImageFile(image)
+        for geometry, options in thumbnails.THUMBNAIL_SPECS:
+            thumbnail = thumbnails._thumbnail_file(source, geometry, options)
+            self.assertIn(add_prefix(thumbnail.key), written)
+
+    def test_missing_thumbnails_not_generated_on_render(self):
+        """Без миниатюр карточка показывает исходную картинку, а нарезка
+        остается фоновой задаче"""
+        KVStore.objects.all().delete()
+        cache.clear()
+        with mock.patch.object(thumbnails, 'get_thumbnail') as generate:
+            response = self.client.get(reverse('index'))
+        generate.assert_not_called()
+        self.assertContains(response, '<picture>', count=3)
+        self.assertNotContains(response, '<source')
+        for post in Post.objects.all():
+            self.assertContains(response, f'src="{post.image.url}"')
+
+        # Нарезка сменила версию ленты, а карточка без миниатюр
+        # и не кэшировалась
+        for post in Post.objects.all():
+            thumbnails.generate_for_post(post.pk)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '<source type="image/webp"', count=3)
+
+    def test_other_kvstore(self):
+        """С другим KV-хранилищем миниатюры достаются его API"""
+        with mock.patch.object(thumbnails, 'CachedDBKVStore',
+                               type('OtherKVStore', (), {})):
+            variants = thumbnails.card_variants(
+                [post.image for post in Post.objects.all()])
+        for card in variants:
+            self.assertNotIn('pending', card)
+            self.assertRegex(card['webp_srcset'], r'\.webp 960w$')
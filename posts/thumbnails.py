@@ -0,0 +1,170 @@
+"""Заранее нарезанные миниатюры картинок постов.
+
+Карточка поста показывает картинку через ``<picture>`` со ``srcset``:
+ширины ``CARD_WIDTHS`` в WebP и те же ширины в JPEG для браузеров без
+WebP. Все варианты перечислены в ``THUMBNAIL_SPECS``: они нарезаются
+в фоне после загрузки (``schedule``), а при отрисовке их адреса для
+всей страницы достаются из KV-хранилища sorl-thumbnail одним пакетом
+(``resolve``). При отрисовке миниатюры не создаются: пока их нет,
+карточка показывает исходную картинку.
+"""
+import logging
+
+from django.utils import timezone
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE, KVStore as CachedDBKVStore)
+from sorl.thumbnail.models import KVStore
+
+from . import feed_cache, tasks
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+CARD_WIDTHS = (320, 640, 960)
+CARD_RATIO = 339 / 960
+# Последний формат — запасной, его отдает сам <img>
+CARD_FORMATS = ('WEBP', 'JPEG')
+CARD_SIZES = '(max-width: 960px) 100vw, 960px'
+CARD_OPTIONS = {'crop': 'center', 'upscale': True}
+
+
+def card_geometry(width):
+    return '{}x{}'.format(width, round(width * CARD_RATIO))
+
+
+THUMBNAIL_SPECS = tuple(
+    (card_geometry(width), dict(CARD_OPTIONS, format=image_format))
+    for image_format in CARD_FORMATS
+    for width in CARD_WIDTHS
+)
+
+
+def generate(image):
+    """Создает все миниатюры для картинки; возвращает их число."""
+    for geometry, options in THUMBNAIL_SPECS:
+        get_thumbnail(image, geometry, **options)
+    return len(THUMBNAIL_SPECS)
+
+
+def generate_for_post(post_id):
+    post = (Post.objects.filter(pk=post_id)
+            .only('image', 'author_id', 'group_id').first())
+    if post is None or not post.image:
+        return 0
+    count = generate(post.image)
+    # Страницы, отрисованные до нарезки, показывают исходную картинку:
+    # новые версии лент и дата поста заменяют их карточками с миниатюрами
+    Post.objects.filter(pk=post_id).update(updated=timezone.now())
+    feed_cache.bump(*feed_cache.post_scopes(post.author_id, post.group_id))
+    return count
+
+
+def schedule(post):
+    """Отправляет нарезку миниатюр поста в фоновый пул."""
+    if post.image:
+        tasks.submit(generate_for_post, post.pk)
+
+
+def _full_options(source, options):
+    # Опции дополняются так же, как в ThumbnailBackend.get_thumbnail:
+    # от них зависят имя миниатюры и ее ключ в KV-хранилище
+    backend = default.backend
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def _thumbnail_file(source, geometry, options):
+    """Файл миниатюры, под которым ее записал бы ``get_thumbnail``;
+    сама миниатюра не создается."""
+    name = default.backend._get_thumbnail_filename(
+        source, geometry, _full_options(source, options))
+    return ImageFile(name, default.storage)
+
+
+def _get_many(files):
+    """Записанные в KV-хранилище миниатюры: ``{key: ImageFile}``.
+
+    У ``cached_db`` — ``get_many`` из кэша и один запрос к таблице
+    за промахами, у остальных хранилищ — их ``get`` по одной.
+    """
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDBKVStore):
+        found = {file.key: kvstore.get(file) for file in files}
+        return {key: value for key, value in found.items() if value}
+    keys = {add_prefix(file.key): file.key for file in files}
+    if not keys:
+        return {}
+    found = kvstore.cache.get_many(list(keys))
+    missing = [key for key in keys if key not in found]
+    if missing:
+        rows = dict(KVStore.objects.filter(key__in=missing)
+                    .values_list('key', 'value'))
+        if rows:
+            kvstore.cache.set_many(rows,
+                                   sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(rows)
+    return {keys[key]: deserialize_image_file(value)
+            for key, value in found.items() if value is not EMPTY_VALUE}
+
+
+def resolve(images, specs=THUMBNAIL_SPECS):
+    """Миниатюры ``specs`` для всех ``images`` одним пакетом.
+
+    Возвращает по словарю ``{(geometry, format): ImageFile}`` на каждую
+    картинку; миниатюры, которых еще нет в хранилище, — ``None``.
+    """
+    wanted = []
+    for image in images:
+        source = ImageFile(image)
+        wanted.append([(geometry, options,
+                        _thumbnail_file(source, geometry, options))
+                       for geometry, options in specs])
+    found = _get_many([file for variants in wanted
+                       for _, _, file in variants])
+    return [{(geometry, options.get('format')): found.get(file.key)
+             for geometry, options, file in variants}
+            for variants in wanted]
+
+
+def card_variants(images):
+    """Данные ``<picture>`` карточки для каждой картинки: ``srcset``
+    по форматам и запасной JPEG наибольшей ширины.
+
+    Если каких-то миниатюр еще нет, карточка получает исходную
+    картинку с ``pending``.
+    """
+    result = []
+    for image, thumbnails in zip(images, resolve(images)):
+        if None in thumbnails.values():
+            result.append({'src': image.url, 'pending': True})
+            continue
+        srcset = {
+            image_format: ', '.join(
+                '{} {}w'.format(
+                    thumbnails[card_geometry(width), image_format].url,
+                    width)
+                for width in CARD_WIDTHS)
+            for image_format in CARD_FORMATS
+        }
+        fallback = thumbnails[card_geometry(CARD_WIDTHS[-1]),
+                              CARD_FORMATS[-1]]
+        result.append({'webp_srcset': srcset['WEBP'],
+                       'jpeg_srcset': srcset['JPEG'],
+                       'src': fallback.url,
+                       'width': CARD_WIDTHS[-1],
+                       'height': round(CARD_WIDTHS[-1] * CARD_RATIO),
+                       'sizes': CARD_SIZES})
+    return result
@@ -0,0 +1,133 @@
+"""Материализованная лента подписок (fan-out on write).
+
+При публикации пост раскладывается по лентам подписчиков автора,
+при подписке лента дополняется последними постами автора, при отписке —
+очищается от них. Авторы, у которых подписчиков больше
+``POSTS_FANOUT_LIMIT``, не раскладываются: их посты подмешиваются
+в ленту при чтении (fan-out on read).
+
+При чтении подмешиваются посты всех авторов, у которых подписчиков
+больше ``POSTS_FANOUT_FLOOR`` (он ниже порога): автор, опустившийся
+до порога, не теряет в лентах постов, которые не раскладывались.
+Только когда подписчиков становится не больше ``POSTS_FANOUT_FLOOR``,
+его посты раскладываются заново фоновой задачей (``rehydrate``).
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q
+
+from . import tasks
+from .models import Follow, Post, TimelineEntry, UserStats
+
+BATCH_SIZE = 1000
+FEED_ORDERING = ('-feed_date', '-feed_id')
+REHYDRATE_KEY = 'posts:rehydrate:{}'
+# Повторная раскладка одного автора — не чаще раза за это время
+REHYDRATE_TIMEOUT = 60 * 60
+
+
+def fanout_limit():
+    return getattr(settings, 'POSTS_FANOUT_LIMIT', 10000)
+
+
+def fanout_floor():
+    return getattr(settings, 'POSTS_FANOUT_FLOOR',
+                   fanout_limit() * 9 // 10)
+
+
+def backfill_size():
+    return getattr(settings, 'POSTS_TIMELINE_BACKFILL', 1000)
+
+
+def is_celebrity(author_id):
+    return UserStats.objects.filter(
+        user_id=author_id, followers_count__gt=fanout_limit()).exists()
+
+
+def _entry(user_id, post):
+    return TimelineEntry(user_id=user_id, post_id=post.pk,
+                         author_id=post.author_id, pub_date=post.pub_date)
+
+
+def fan_out(post):
+    """Кладет новый пост в ленты всех подписчиков автора."""
+    fan_out_many([post])
+
+
+def fan_out_many(posts):
+    """Раскладывает пачку новых постов: подписчики всех авторов
+    читаются одним запросом."""
+    by_author = defaultdict(list)
+    for post in posts:
+        by_author[post.author_id].append(post)
+    celebrities = set(UserStats.objects.filter(
+        user_id__in=list(by_author), followers_count__gt=fanout_limit())
+        .values_list('user_id', flat=True))
+    follows = (Follow.objects
+               .filter(author_id__in=set(by_author) - celebrities)
+               .values_list('user_id', 'author_id'))
+    batch = []
+    for user_id, author_id in follows.iterator(chunk_size=BATCH_SIZE):
+        batch.extend(_entry(user_id, post) for post in by_author[author_id])
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту читателя последние посты автора."""
+    if is_celebrity(author_id):
+        return
+    posts = (Post.objects.filter(author_id=author_id)
+             .only('pk', 'author_id', 'pub_date')[:backfill_size()])
+    TimelineEntry.objects.bulk_create(
+        [_entry(user_id, post) for post in posts],
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def trim(user_id, author_id):
+    """Убирает из ленты читателя посты автора после отписки."""
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 author_id=author_id).delete()
+
+
+def schedule_rehydrate(author_id):
+    """Отправляет ``rehydrate`` в фоновый пул после коммита."""
+    if cache.add(REHYDRATE_KEY.format(author_id), 1, REHYDRATE_TIMEOUT):
+        tasks.submit(rehydrate, author_id)
+
+
+def rehydrate(author_id):
+    """Автор перестал быть «звездой»: раскладываем его посты заново."""
+    followers = (Follow.objects.filter(author_id=author_id)
+                 .values_list('user_id', flat=True))
+    for user_id in followers.iterator(chunk_size=BATCH_SIZE):
+        backfill(user_id, author_id)
+
+
+def feed_for(user):
+    """Посты ленты подписок в порядке ``('-feed_date', '-feed_id')``.
+
+    Обычно это проход по индексу ленты читателя. Если читатель подписан
+    на «звезд», их посты подмешиваются условием по автору.
+    """
+    celebrities = list(
+        Follow.objects.filter(
+            user=user,
+            author__stats__followers_count__gt=fanout_floor())
+        .values_list('author_id', flat=True))
+    if not celebrities:
+        return (Post.objects
+                .annotate(feed_user=F('timeline_entries__user_id'),
+                          feed_date=F('timeline_entries__pub_date'),
+                          feed_id=F('timeline_entries__post_id'))
+                .filter(feed_user=user.pk)
+                .order_by('-feed_date', '-feed_id'))
+    entries = TimelineEntry.objects.filter(user=user).values('post_id')
+    return (Post.objects
+            .filter(Q(pk__in=entries) | Q(author_id__in=celebrities))
+            .annotate(feed_date=F('pub_date'), feed_id=F('pk'))
+            .order_by('-feed_date', '-feed_id'))
@@ -1,12 +1,24 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('new/', views.new_post,
          name='new_post'),
     path('follow/', views.follow_index,
          name='follow_index'),
+    path('search/', views.search,
+         name='search'),
+    # Второй сегмент «v1» не число, поэтому API не перекрывает
+    # страницы пользователя с именем api
+    path('api/v1/posts/', api.index,
+         name='api_index'),
+    path('api/v1/group/<slug:slug>/', api.group_post,
+         name='api_group_post'),
+    path('api/v1/users/<str:username>/', api.profile,
+         name='api_profile'),
+    path('api/v1/users/<str:username>/<int:post_id>/', api.post_view,
+         name='api_post_view'),
     path('<str:username>/follow/', views.profile_follow,
          name='profile_follow'),
     path('<str:username>/unfollow/', views.profile_unfollow,
@@ -19,6 +31,8 @@ urlpatterns = [
          name='post_edit'),
     path('<str:username>/<int:post_id>/comment/', views.add_comment,
          name='add_comment'),
+    path('<str:username>/<int:post_id>/comments/', views.post_comments,
+         name='post_comments'),
     path('group/<slug:slug>/', views.group_post,
          name='group_post'),
     path('', views.index,
@@ -1,30 +1,62 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+from yatube.replicas import use_replica
 
+from . import feed_cache, images, thumbnails, timeline, write_buffer
+from .conditions import (conditional, group_state, index_state,
+                         post_state, profile_state)
 from .forms import PostForm, CommentForm
-from .models import Post, Group, User, Comment, Follow
+from .models import Post, Group, User, Comment, Follow, UserStats
+from .paginators import (COMMENTS_PER_PAGE, PER_PAGE, CursorPaginator,
+                         paginate)
+from .search import search_posts
+from .storage import is_immutable
 
+# Год: файл с именем по хешу содержимого никогда не меняется
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
+
+@use_replica
+@conditional(index_state)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    scope = feed_cache.index_scope()
+    paginator, page = paginate(request, post_list, 'index',
+                               count_scope=scope)
+    cache_version = feed_cache.version(scope)
     return render(request, 'index.html',
-                  {'page': page, 'paginator': paginator})
+                  {'page': page, 'paginator': paginator,
+                   'pending_posts': write_buffer.pending(request, 'post'),
+                   'cache_version': cache_version})
 
 
+@use_replica
+@conditional(group_state)
 def group_post(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.group_posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = group.group_posts.for_feed()
+    scope = feed_cache.group_scope(group.pk)
+    paginator, page = paginate(request, posts, 'group_post',
+                               count_scope=scope)
+    cache_version = feed_cache.version(scope)
     return render(request, 'posts/group.html',
                   {'group': group,
                    'page': page,
-                   'paginator': paginator})
+                   'paginator': paginator,
+                   'cache_version': cache_version})
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    posts = search_posts(query) if query else Post.objects.none()
+    paginator = Paginator(posts, PER_PAGE)
+    page = paginator.get_page(request.GET.get('page'))
+    return render(request, 'posts/search.html',
+                  {'query': query, 'page': page, 'paginator': paginator})
 
 
 @login_required
@@ -34,9 +66,14 @@ def new_post(request):
                         files=request.FILES or None)
 
         if form.is_valid():
+            if (write_buffer.enabled()
+                    and not form.cleaned_data.get('image')):
+                write_buffer.submit_post(request, form)
+                return redirect('index')
             post_new = form.save(commit=False)
             post_new.author = request.user
-            post_new.save()
+            images.save_post(post_new)
+            thumbnails.schedule(post_new)
             return redirect('index')
 
         return render(request, 'posts/new-post.html', {'form': form})
@@ -45,33 +82,70 @@ def new_post(request):
     return render(request, 'posts/new-post.html', {'form': form})
 
 
+@use_replica
+@conditional(profile_state)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    posts = author.author_posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = author.author_posts.for_feed()
+    scope = feed_cache.profile_scope(author.pk)
+    paginator, page = paginate(request, posts, 'profile', count_scope=scope)
     is_following = author.following.filter(user=request.user.id).exists()
+    stats = UserStats.objects.for_user(author)
+    cache_version = feed_cache.version(scope)
 
     return render(request, 'posts/profile.html',
                   {'author': author, 'page': page,
                    'paginator': paginator,
-                   'following': is_following})
+                   'stats': stats,
+                   'following': is_following,
+                   'cache_version': cache_version})
 
 
+@use_replica
+@conditional(post_state)
 def post_view(request, username, post_id):
     author = get_object_or_404(User, username=username)
-    post = get_object_or_404(Post, author=author, id=post_id)
+    post = get_object_or_404(Post.objects.for_feed(),
+                             author=author, id=post_id)
     form = CommentForm()
-    comments = post.comments.filter(post=post)
+    # Первая страница — обычный QuerySet одним запросом с авторами;
+    # есть ли следующие, видно по comments_count из for_feed()
+    paginator = comments_paginator(post)
+    comments = (paginator.object_list.order_by(*paginator.ordering)
+                [:COMMENTS_PER_PAGE])
+    comments_after = None
+    if post.comments_count > len(comments):
+        comments_after = paginator.encode_cursor(comments[len(comments) - 1])
     is_following = author.following.filter(user=request.user.id).exists()
+    stats = UserStats.objects.for_user(author)
     return render(request,
                   'posts/post.html',
                   {'post': post, 'author': author,
                    'form': form, 'comments': comments,
+                   'comments_after': comments_after,
+                   'pending_comments': write_buffer.pending(
+                       request, 'comment', post_id=post.pk),
+                   'stats': stats,
                    'following': is_following})
 
 
+def comments_paginator(post):
+    """Комментарии поста вместе с авторами, от старых к новым."""
+    return CursorPaginator(post.comments.select_related('author'),
+                           COMMENTS_PER_PAGE, ordering=('created', 'id'))
+
+
+@use_replica
+@conditional(post_state)
+def post_comments(request, username, post_id):
+    post = get_object_or_404(Post.objects.select_related('author'),
+                             author__username=username, id=post_id)
+    page = comments_paginator(post).get_page(after=request.GET.get('after'))
+    return render(request, 'posts/comment_list.html',
+                  {'post': post, 'comments': page,
+                   'comments_after': page.next_cursor})
+
+
 @login_required
 def post_edit(request, username, post_id):
     author = get_object_or_404(User, username=username)
@@ -87,7 +161,9 @@ def post_edit(request, username, post_id):
 
     if request.method == 'POST':
         if form.is_valid():
-            form.save()
+            post = images.save_post(form.save(commit=False))
+            if 'image' in form.changed_data:
+                thumbnails.schedule(post)
             return redirect('post_view',
                             username=request.user.username,
                             post_id=post_id)
@@ -105,19 +181,22 @@ def add_comment(request, username, post_id):
         form = CommentForm(request.POST)
 
         if form.is_valid():
-            new_comment = form.save(commit=False)
-            new_comment.author = request.user
-            new_comment.post = post
-            new_comment.save()
+            if write_buffer.enabled():
+                write_buffer.submit_comment(request, post, form)
+            else:
+                new_comment = form.save(commit=False)
+                new_comment.author = request.user
+                new_comment.post = post
+                new_comment.save()
     return redirect('post_view', username=username, post_id=post_id)
 
 
+@use_replica
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = timeline.feed_for(request.user).for_feed()
+    paginator, page = paginate(request, posts, 'follow_index',
+                               ordering=timeline.FEED_ORDERING)
     return render(request,
                   'posts/follow.html',
                   {'page': page,
@@ -142,6 +221,16 @@ def profile_unfollow(request, username):
     return redirect('profile', username)
 
 
+def media(request, path):
+    """Раздает загруженные файлы; картинки с именем по хешу —
+    с заголовками для вечного кэширования."""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_immutable(path):
+        patch_cache_control(response, public=True,
+                            max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
+
+
 def page_not_found(request, exception):
     return render(request,
                   'misc/404.html',
@@ -0,0 +1,273 @@
+"""Отложенная запись комментариев и постов (write-behind).
+
+При ``POSTS_WRITE_BUFFER = True`` проверенные ``CommentForm`` и
+``PostForm`` без картинки не сохраняются в запросе, а ставятся в очередь
+процесса. Фоновый писатель собирает из нее до ``POSTS_WRITE_BUFFER_BATCH``
+записей за ``POSTS_WRITE_BUFFER_INTERVAL`` секунд и сохраняет их одной
+транзакцией, так что при всплеске запросы не ждут блокировку записи
+SQLite по одному.
+
+Пока запись не сохранена, автор видит ее из списка ожидающих записей
+в кэше (не в сессии: сохранение сессии в базе снова ждало бы ту же
+блокировку). Писатель отмечает сохраненные записи в кэше по токену,
+и при следующем чтении они убираются из списка.
+
+Пачка пишется через ``bulk_create`` без сигналов: счетчики, ленты
+подписок и даты изменения постов обновляются по пачке в той же
+транзакции, а версии кэша лент — один раз после коммита.
+
+Для базы SQLite в памяти (тесты) поток не запускается: очередь
+разбирается в конце каждого запроса, см. ``signals``.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from yatube.sqlite import immediate_atomic
+
+from . import feed_cache, tasks, timeline
+from .models import Comment, Post, UserStats
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'posts:pending:{}'
+WRITTEN_KEY = 'posts:written:{}'
+WRITTEN_TIMEOUT = 60 * 60
+
+MODELS = {'post': Post, 'comment': Comment}
+
+_queue = queue.Queue()
+_writer = None
+_lock = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, 'POSTS_WRITE_BUFFER', False)
+
+
+def batch_size():
+    return getattr(settings, 'POSTS_WRITE_BUFFER_BATCH', 100)
+
+
+def interval():
+    return getattr(settings, 'POSTS_WRITE_BUFFER_INTERVAL', 0.2)
+
+
+def _pending_key(request):
+    return PENDING_KEY.format(request.user.pk)
+
+
+def _submit(request, kind, fields):
+    token = uuid.uuid4().hex
+    _queue.put((token, kind, fields))
+    entry = dict(fields, token=token, kind=kind,
+                 created=timezone.now().isoformat())
+    key = _pending_key(request)
+    cache.set(key, cache.get(key, []) + [entry], WRITTEN_TIMEOUT)
+    _start_writer()
+    return token
+
+
+def submit_post(request, form):
+    group = form.cleaned_data.get('group')
+    return _submit(request, 'post', {
+        'author_id': request.user.pk,
+        'group_id': group.pk if group else None,
+        'text': form.cleaned_data['text'],
+    })
+
+
+def submit_comment(request, post, form):
+    return _submit(request, 'comment', {
+        'author_id': request.user.pk,
+        'post_id': post.pk,
+        'text': form.cleaned_data['text'],
+    })
+
+
+def pending(request, kind, **filters):
+    """Еще не сохраненные записи пользователя вида ``kind``.
+
+    Заодно убирает из списка записи, которые писатель уже сохранил.
+    """
+    if not request.user.is_authenticated:
+        return []
+    key = _pending_key(request)
+    entries = cache.get(key)
+    if not entries:
+        return []
+    written = cache.get_many([WRITTEN_KEY.format(entry['token'])
+                              for entry in entries])
+    remaining = [entry for entry in entries
+                 if WRITTEN_KEY.format(entry['token']) not in written]
+    if len(remaining) != len(entries):
+        cache.set(key, remaining, WRITTEN_TIMEOUT)
+    return [entry for entry in remaining
+            if entry['kind'] == kind
+            and all(entry.get(name) == value
+                    for name, value in filters.items())]
+
+
+def pending_tokens(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return ''
+    return ','.join(entry['token']
+                    for entry in cache.get(_pending_key(request), ()))
+
+
+def _save_posts(posts, scopes):
+    Post.objects.bulk_create(posts)
+    # SQLite не возвращает id из bulk_create: находим строки по автору
+    # и дате публикации, которую bulk_create проставил объектам
+    ids = {(author_id, pub_date): pk for pk, author_id, pub_date
+           in Post.objects.filter(
+               author_id__in={post.author_id for post in posts},
+               pub_date__in={post.pub_date for post in posts})
+           .values_list('pk', 'author_id', 'pub_date')}
+    for post in posts:
+        post.pk = ids[post.author_id, post.pub_date]
+        scopes.update(feed_cache.post_scopes(post.author_id, post.group_id))
+    timeline.fan_out_many(posts)
+    return Counter(post.author_id for post in posts)
+
+
+def _save_comments(comments, scopes):
+    Comment.objects.bulk_create(comments)
+    posts = Post.objects.filter(
+        pk__in={comment.post_id for comment in comments})
+    for author_id, group_id in posts.values_list('author_id', 'group_id'):
+        scopes.update(feed_cache.post_scopes(author_id, group_id))
+    # Как сигнал comment_touch_post: страницы постов изменились
+    posts.update(updated=timezone.now())
+    return Counter(comment.author_id for comment in comments)
+
+
+def _save(items):
+    objs = {kind: [] for kind in MODELS}
+    written = {}
+    for token, kind, fields in items:
+        objs[kind].append(MODELS[kind](**fields))
+        written[WRITTEN_KEY.format(token)] = 1
+    scopes = set()
+    with immediate_atomic():
+        counters = {}
+        if objs['post']:
+            counters['posts_count'] = _save_posts(objs['post'], scopes)
+        if objs['comment']:
+            counters['comments_count'] = _save_comments(objs['comment'],
+                                                        scopes)
+        for field, counts in counters.items():
+            for author_id, delta in counts.items():
+                UserStats.objects.increment(author_id, field, delta)
+    # Версии лент — после коммита: иначе читатель успел бы положить
+    # в кэш старые данные под новой версией
+    feed_cache.bump(*scopes)
+    return written
+
+
+def _drop_orphans(items):
+    """Отбрасывает комментарии к постам, удаленным, пока они ждали."""
+    post_ids = {fields['post_id'] for _, kind, fields in items
+                if kind == 'comment'}
+    if not post_ids:
+        return items, {}
+    existing = set(Post.objects.filter(pk__in=post_ids)
+                   .values_list('pk', flat=True))
+    kept, dropped = [], {}
+    for item in items:
+        token, kind, fields = item
+        if kind == 'comment' and fields['post_id'] not in existing:
+            logger.warning('Пост %s удален, комментарий отброшен',
+                           fields['post_id'])
+            # Ноль снимает запись с ожидания у автора
+            dropped[WRITTEN_KEY.format(token)] = 0
+        else:
+            kept.append(item)
+    return kept, dropped
+
+
+def write(items):
+    """Сохраняет пачку одной транзакцией.
+
+    Если пачка не сохранилась, записи сохраняются по одной,
+    а не сохранившиеся отбрасываются.
+    """
+    items, dropped = _drop_orphans(items)
+    try:
+        written = _save(items)
+    except Exception:
+        written = {}
+        for item in items:
+            try:
+                written.update(_save([item]))
+            except Exception:
+                logger.exception('Не удалось сохранить %s', item[1])
+                written[WRITTEN_KEY.format(item[0])] = 0
+    written.update(dropped)
+    cache.set_many(written, timeout=WRITTEN_TIMEOUT)
+    return len(written)
+
+
+def flush():
+    """Разбирает очередь в текущем потоке; возвращает число записей."""
+    total = 0
+    while True:
+        items = []
+        while len(items) < batch_size():
+            try:
+                items.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not items:
+            return total
+        total += write(items)
+
+
+def _collect(first):
+    items = [first]
+    deadline = time.monotonic() + interval()
+    while len(items) < batch_size():
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            items.append(_queue.get(timeout=timeout))
+        except queue.Empty:
+            break
+    return items
+
+
+def _run():
+    while True:
+        items = _collect(_queue.get())
+        close_old_connections()
+        try:
+            write(items)
+        except Exception:
+            logger.exception('Буфер записи: пачка из %d записей потеряна',
+                             len(items))
+        finally:
+            connection.close()
+
+
+def _start_writer():
+    global _writer
+    if tasks.run_inline():
+        return
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_run, name='posts-writer',
+                                       daemon=True)
+            _writer.start()
+            # При штатной остановке процесса дописываем остаток очереди
+            atexit.register(flush)
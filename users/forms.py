@@ -1,10 +1,25 @@
+from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
 
 User = get_user_model()
 
+# Первые сегменты адресов сайта: профиль с таким именем
+# был бы перекрыт этими страницами
+RESERVED_USERNAMES = frozenset((
+    '__debug__', 'about', 'about-author', 'about-spec', 'about-us',
+    'admin', 'auth', 'follow', 'group', 'media', 'new', 'search', 'static',
+    'terms',
+))
+
 
 class CreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
         model = User
         fields = ('first_name', 'last_name', 'username', 'email')
+
+    def clean_username(self):
+        username = self.cleaned_data['username']
+        if username.lower() in RESERVED_USERNAMES:
+            raise forms.ValidationError('Это имя пользователя занято')
+        return username
@@ -0,0 +1,247 @@
+"""Кэш в файле SQLite, общий для всех процессов сервера.
+
+В отличие от LocMemCache данные видят все воркеры, а в отличие от
+FileBasedCache очистка и вытеснение не обходят каталог с файлами.
+Вытесняются сначала просроченные, затем давно не читавшиеся записи
+(LRU), когда превышен ``MAX_ENTRIES`` или ``MAX_SIZE`` в байтах.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.cache.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 10000, 'MAX_SIZE': 64 * 2 ** 20},
+        }
+    }
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' expires REAL,'
+    ' accessed REAL NOT NULL,'
+    ' size INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+)
+
+# Время последнего чтения обновляется не чаще раза в секунду,
+# чтобы чтение почти никогда не брало блокировку на запись
+ACCESS_RESOLUTION = 1.0
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_size = int(options.get('MAX_SIZE') or 0)
+        self._busy_timeout = float(options.get('BUSY_TIMEOUT', 5))
+        self._cull_every = int(options.get('CULL_EVERY', 50))
+        self._writes = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self._path, timeout=self._busy_timeout,
+                               isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _expires(self, timeout):
+        if timeout == 0:
+            # Ноль — «сразу устарело», как в остальных бэкендах Django
+            return 0.0
+        return self.get_backend_timeout(timeout)
+
+    def _store(self, conn, key, value, expires, now):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires, accessed, size)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (key, blob, expires, now, len(blob)))
+
+    def _after_write(self, conn):
+        self._writes += 1
+        if self._writes % self._cull_every == 0:
+            self._cull(conn)
+
+    def _cull(self, conn):
+        now = time.time()
+        conn.execute('DELETE FROM cache WHERE expires IS NOT NULL'
+                     ' AND expires <= ?', (now,))
+        entries, size = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+        if entries > self._max_entries:
+            if not self._cull_frequency:
+                # CULL_FREQUENCY = 0 означает «очистить все», как в Django
+                conn.execute('DELETE FROM cache')
+                return
+            excess = max(entries - self._max_entries,
+                         entries // self._cull_frequency)
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                ' SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (excess,))
+        if self._max_size and size > self._max_size:
+            # Оставляем самые свежие записи суммарным размером не больше
+            # target, остальные удаляем
+            target = self._max_size - self._max_size // (
+                self._cull_frequency or 1)
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                ' SELECT key FROM ('
+                '  SELECT key, SUM(size) OVER (ORDER BY accessed DESC)'
+                '   AS total FROM cache)'
+                ' WHERE total > ?)',
+                (target,))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT expires FROM cache WHERE key = ?',
+                               (key,)).fetchone()
+            if row is not None and (row[0] is None or row[0] > now):
+                conn.execute('COMMIT')
+                return False
+            self._store(conn, key, value, self._expires(timeout), now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._after_write(conn)
+        return True
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._get_many_raw([key]).get(key, default)
+
+    def _get_many_raw(self, keys):
+        conn = self._connection()
+        now = time.time()
+        found = {}
+        touched = []
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = conn.execute(
+                'SELECT key, value, expires, accessed FROM cache'
+                ' WHERE key IN ({})'.format(','.join('?' * len(chunk))),
+                chunk).fetchall()
+            for key, blob, expires, accessed in rows:
+                if expires is not None and expires <= now:
+                    continue
+                found[key] = pickle.loads(blob)
+                if accessed < now - ACCESS_RESOLUTION:
+                    touched.append((now, key))
+        if touched:
+            conn.executemany('UPDATE cache SET accessed = ? WHERE key = ?',
+                             touched)
+        return found
+
+    def get_many(self, keys, version=None):
+        mapping = {self._key(key, version): key for key in keys}
+        found = self._get_many_raw(list(mapping))
+        return {mapping[key]: value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        conn = self._connection()
+        self._store(conn, key, value, self._expires(timeout), time.time())
+        self._after_write(conn)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        conn = self._connection()
+        now = time.time()
+        expires = self._expires(timeout)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key, value in data.items():
+                self._store(conn, self._key(key, version), value,
+                            expires, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._after_write(conn)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ?'
+            ' AND (expires IS NULL OR expires > ?)',
+            (self._expires(timeout), key, time.time()))
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        self._connection().executemany('DELETE FROM cache WHERE key = ?',
+                                       [(key,) for key in keys])
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        row = self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ?'
+            ' AND (expires IS NULL OR expires > ?)',
+            (key, time.time())).fetchone()
+        return row is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT value, expires FROM cache WHERE key = ?',
+                (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            conn.execute(
+                'UPDATE cache SET value = ?, size = ?, accessed = ?'
+                ' WHERE key = ?', (blob, len(blob), now, key))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединение живет весь поток: Django вызывает close()
+        # после каждого запроса, а открывать файл заново дорого
+        pass
@@ -0,0 +1,203 @@
+"""Легкие замеры каждого запроса для продакшена.
+
+``RequestTimingMiddleware`` записывает имя представления, общее время,
+время и число запросов к базе, попадания и промахи кэша и время
+рендеринга шаблонов. Результат уходит одной JSON-строкой в лог
+``yatube.requests``, а для сотрудников (или всем при
+``REQUEST_TIMING_HEADER = True``) — в заголовок ``Server-Timing``.
+Медленные запросы к базе попадают в лог ``yatube.slow_queries``
+с вероятностью ``REQUEST_TIMING_SLOW_SAMPLE``.
+
+Время шаблонов считает бэкенд ``DjangoTemplates`` из этого модуля,
+обращения к кэшу — обертка ``InstrumentedCache`` над любым бэкендом
+кэша. Тело потоковых ответов формируется после выхода из middleware
+и в замеры не входит.
+
+При ``REQUEST_TIMING = False`` middleware отключается через
+``MiddlewareNotUsed``, а остальные хуки сводятся к одной проверке
+thread-local.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('yatube.requests')
+slow_logger = logging.getLogger('yatube.slow_queries')
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    __slots__ = ('db_time', 'queries', 'cache_hits', 'cache_misses',
+                 'template_time', 'template_depth')
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+
+def current():
+    """Замеры текущего запроса или None вне запроса."""
+    return getattr(_local, 'metrics', None)
+
+
+def record_cache(hits, misses):
+    metrics = current()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+class InstrumentedCache:
+    """Бэкенд кэша, который считает попадания и промахи чтений
+    и передает все остальное бэкенду ``WRAPPED_BACKEND``.
+
+        CACHES = {
+            'default': {
+                'BACKEND': 'yatube.instrumentation.InstrumentedCache',
+                'WRAPPED_BACKEND': 'yatube.cache.SQLiteCache',
+                'LOCATION': ...,
+            }
+        }
+    """
+
+    def __init__(self, location, params):
+        params = dict(params)
+        backend = import_string(params.pop('WRAPPED_BACKEND'))
+        self.wrapped = backend(location, params)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __contains__(self, key):
+        return key in self.wrapped
+
+    def get(self, key, default=None, version=None):
+        missing = object()
+        value = self.wrapped.get(key, missing, version=version)
+        if value is missing:
+            record_cache(0, 1)
+            return default
+        record_cache(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = self.wrapped.get_many(keys, version=version)
+        record_cache(len(found), len(keys) - len(found))
+        return found
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        metrics = current()
+        if metrics is None:
+            return super().render(context, request)
+        # Шаблоны, отрисованные внутри другого шаблона (карточки
+        # постов), уже входят во время внешнего
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Стандартный бэкенд шаблонов с замером времени рендеринга."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as error:
+            django_backend.reraise(error, self)
+
+
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_TIMING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow = getattr(settings, 'REQUEST_TIMING_SLOW_MS', 100) / 1000
+        self.sample = getattr(settings, 'REQUEST_TIMING_SLOW_SAMPLE', 0.1)
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        self._query_wrapper(request, metrics)))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        total = time.perf_counter() - started
+
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'queries': metrics.queries,
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+            'template_ms': round(metrics.template_time * 1000, 2),
+        }
+        logger.info(json.dumps(record, ensure_ascii=False),
+                    extra={'metrics': record})
+        if self._show_header(request):
+            response['Server-Timing'] = ', '.join((
+                'db;dur={db_ms};desc="{queries} queries"',
+                'cache;desc="{cache_hits} hits, {cache_misses} misses"',
+                'tpl;dur={template_ms}',
+                'total;dur={total_ms}',
+            )).format(**record)
+        return response
+
+    @staticmethod
+    def _show_header(request):
+        if getattr(settings, 'REQUEST_TIMING_HEADER', False):
+            return True
+        # Число запросов и тайминги — не для анонимных клиентов
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def _query_wrapper(self, request, metrics):
+        def wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration = time.perf_counter() - started
+                metrics.db_time += duration
+                metrics.queries += 1
+                if duration >= self.slow and random.random() < self.sample:
+                    slow_logger.warning(json.dumps({
+                        'path': request.path,
+                        'ms': round(duration * 1000, 2),
+                        'sql': sql,
+                    }, ensure_ascii=False))
+        return wrapper
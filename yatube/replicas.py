@@ -0,0 +1,145 @@
+"""Чтение лент с реплик базы.
+
+Представления, помеченные ``use_replica``, читают с одной из реплик из
+``DATABASE_REPLICAS``, выбранной на весь запрос; все остальное, включая
+любую запись, идет в основную базу. Сессии всегда читаются из основной
+базы.
+
+Реплика отстает от основной базы, поэтому после запроса, который что-то
+записал, ``ReplicaMiddleware`` ставит cookie, и следующие
+``REPLICA_STICKY_SECONDS`` секунд запросы этого клиента читают из
+основной базы: автор сразу видит свой пост или комментарий. Запись
+сессии и ``last_login`` при входе в ленты не попадает и клиента
+не закрепляет.
+
+Локально реплики — копии файла SQLite, их обновляет ``sync()``
+(``python manage.py sync_replicas``)::
+
+    DATABASES['replica'] = dict(DATABASES['default'],
+                                NAME=os.path.join(BASE_DIR, 'replica.sqlite3'))
+    DATABASE_REPLICAS = ['replica']
+"""
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+STICKY_COOKIE = 'use_primary'
+
+# Приложения, которые всегда читаются из основной базы
+PRIMARY_APPS = {'sessions'}
+
+_local = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+@contextmanager
+def primary():
+    """Читает из основной базы внутри блока, например перед записью,
+    которая зависит от прочитанного."""
+    previous = getattr(_local, 'replica', None)
+    _local.replica = None
+    try:
+        yield
+    finally:
+        _local.replica = previous
+
+
+def use_replica(view):
+    """Представление только читает и может читать с реплики."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        previous = getattr(_local, 'replica', None)
+        aliases = replicas()
+        # Реплика выбирается один раз: запросы одной страницы видят
+        # один и тот же снимок базы
+        _local.replica = (random.choice(aliases) if aliases
+                          and not getattr(_local, 'pinned', False) else None)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _local.replica = previous
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return None
+        return getattr(_local, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        wrote = getattr(_local, 'wrote', None)
+        if wrote is not None and model._meta.app_label not in PRIMARY_APPS:
+            wrote.add(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Объекты с реплики и из основной базы — одни и те же строки
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.pinned = STICKY_COOKIE in request.COOKIES
+        _local.wrote = set()
+        _local.logged_in = False
+        try:
+            response = self.get_response(request)
+            wrote = set(_local.wrote)
+            if _local.logged_in:
+                # Вход записывает только last_login
+                wrote.discard(settings.AUTH_USER_MODEL)
+        finally:
+            _local.pinned = _local.logged_in = False
+            _local.wrote = None
+        if wrote and replicas():
+            response.set_cookie(STICKY_COOKIE, '1', max_age=sticky_seconds(),
+                                httponly=True, samesite='Lax')
+        return response
+
+
+@receiver(user_logged_in)
+def mark_login(**kwargs):
+    _local.logged_in = True
+
+
+def sync(source=DEFAULT_DB_ALIAS, targets=None):
+    """Копирует базу SQLite ``source`` в реплики через backup API.
+
+    Открытые соединения с репликами закрываются: копирование требует,
+    чтобы в базе-приемнике не было открытых транзакций.
+    """
+    connection = connections[source]
+    connection.ensure_connection()
+    for alias in replicas() if targets is None else targets:
+        connections[alias].close()
+        target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+        try:
+            connection.connection.backup(target)
+        finally:
+            target.close()
@@ -1,4 +1,7 @@
+import atexit
 import os
+import sys
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -35,6 +38,8 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'yatube.instrumentation.RequestTimingMiddleware',
+    'yatube.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,7 +55,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'yatube.instrumentation.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -67,24 +72,59 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+# SQLite в режиме WAL с постоянными соединениями, ожиданием блокировки
+# и повтором запросов (yatube/sqlite/base.py); сравнение со стандартными
+# настройками: python manage.py bench_sqlite
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'yatube.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 5,
+            'RETRIES': 3,
+        },
     }
 }
 
+# Реплики для чтения лент — псевдонимы из DATABASES; локально это копии
+# db.sqlite3, которые обновляет python manage.py sync_replicas
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['yatube.replicas.ReplicaRouter']
+# Сколько секунд после записи клиент читает из основной базы
+REPLICA_STICKY_SECONDS = 5
+
+# Кэш в файле SQLite общий для всех процессов сервера;
+# сравнение с другими бэкендами: python manage.py bench_cache
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # Обертка считает попадания для yatube.instrumentation
+        'BACKEND': 'yatube.instrumentation.InstrumentedCache',
+        'WRAPPED_BACKEND': 'yatube.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
     }
 }
 
-# TEST_CACHES = {
-#     'default': {
-#         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-#     }
-# }
+# Тесты чистят кэш через cache.clear(), поэтому у них свой файл,
+# отдельный для каждого процесса: кэш dev-сервера они не трогают.
+# Файл удаляется при выходе из процесса
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if TESTING:
+    CACHES['default']['LOCATION'] = os.path.join(
+        tempfile.gettempdir(), f'yatube-test-cache-{os.getpid()}.sqlite3')
+
+    def _remove_test_cache(path=CACHES['default']['LOCATION']):
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+    atexit.register(_remove_test_cache)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -121,5 +161,85 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Картинки постов: не больше POSTS_IMAGE_MAX_BYTES байт и
+# POSTS_IMAGE_MAX_PIXELS пикселей; хранятся без EXIF, уменьшенными до
+# POSTS_IMAGE_MAX_SIZE по большей стороне, в формате 'JPEG'
+# (прогрессивный) или 'WEBP'
+POSTS_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+POSTS_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+POSTS_IMAGE_MAX_SIZE = 2048
+POSTS_IMAGE_FORMAT = 'JPEG'
+POSTS_IMAGE_QUALITY = 85
+
+# Режим пагинации лент: 'offset' (номера страниц), 'estimated' (номера
+# страниц без полного COUNT: оценка по статистике SQLite или подсчет
+# не дальше POSTS_PAGINATION_COUNT_LIMIT записей) или 'cursor'
+# (курсоры ?after=/?before= без COUNT и OFFSET). По умолчанию везде
+# 'offset': контекст лент обязан содержать ровно Paginator и Page (это
+# проверяют тесты в tests/). COUNT общей ленты, групп и профилей при этом
+# кэшируется под версией ленты и выполняется один раз после изменения
+POSTS_PAGINATION = {
+    'index': 'offset',
+    'group_post': 'offset',
+    'profile': 'offset',
+    'follow_index': 'offset',
+}
+POSTS_PAGINATION_COUNT_LIMIT = 10000
+
+# Лента подписок: посты авторов, у которых подписчиков больше
+# POSTS_FANOUT_LIMIT, подмешиваются при чтении, а не раскладываются
+# по лентам; при подписке в ленту добавляется POSTS_TIMELINE_BACKFILL
+# последних постов автора. При чтении подмешиваются авторы, у которых
+# подписчиков больше POSTS_FANOUT_FLOOR (по умолчанию 90% порога),
+# поэтому отписки у порога не раскладывают посты заново
+POSTS_FANOUT_LIMIT = 10000
+POSTS_TIMELINE_BACKFILL = 1000
+
+# Пул фоновых задач (миниатюры картинок); POSTS_BACKGROUND_SYNC = True
+# выполняет задачи сразу после коммита в потоке запроса
+POSTS_BACKGROUND_WORKERS = 2
+POSTS_BACKGROUND_SYNC = False
+
+# Отложенная запись комментариев и постов без картинок: фоновый писатель
+# сохраняет до POSTS_WRITE_BUFFER_BATCH записей одной транзакцией,
+# собирая их не дольше POSTS_WRITE_BUFFER_INTERVAL секунд
+POSTS_WRITE_BUFFER = False
+POSTS_WRITE_BUFFER_BATCH = 100
+POSTS_WRITE_BUFFER_INTERVAL = 0.2
+
+# Массовые действия админки идут в фоне пачками по POSTS_BULK_JOB_CHUNK
+# объектов, каждая пачка — отдельная транзакция
+POSTS_BULK_JOB_CHUNK = 500
+
+# Замеры запросов (yatube.instrumentation): JSON-строка на запрос в лог
+# yatube.requests; заголовок Server-Timing получают только сотрудники,
+# а при REQUEST_TIMING_HEADER = True — все клиенты. Запросы к базе дольше
+# REQUEST_TIMING_SLOW_MS пишутся в yatube.slow_queries с вероятностью
+# REQUEST_TIMING_SLOW_SAMPLE
+REQUEST_TIMING = True
+REQUEST_TIMING_HEADER = False
+REQUEST_TIMING_SLOW_MS = 100
+REQUEST_TIMING_SLOW_SAMPLE = 0.1
+# Файл лога замеров; тесты замеры не пишут
+REQUEST_LOG_FILE = os.path.join(BASE_DIR, 'requests.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'requests': {'class': 'logging.handlers.WatchedFileHandler',
+                     'filename': REQUEST_LOG_FILE},
+    },
+    'loggers': {
+        'yatube.requests': {'handlers': ['requests'], 'level': 'INFO',
+                            'propagate': False},
+        'yatube.slow_queries': {'handlers': ['requests'],
+                                'level': 'WARNING', 'propagate': False},
+    },
+}
+
+if TESTING:
+    LOGGING['handlers']['requests'] = {'class': 'logging.NullHandler'}
+
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
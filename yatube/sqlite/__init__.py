@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    """``transaction.atomic()`` для пишущих транзакций.
+
+    На бэкенде ``yatube.sqlite`` внешний блок начинается с
+    ``BEGIN IMMEDIATE``; вложенные блоки и другие бэкенды работают как
+    обычный ``atomic()``.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    immediate = (not connection.in_atomic_block
+                 and hasattr(connection, 'begin_immediate'))
+    if immediate:
+        connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            connection.begin_immediate = False
+            yield
+    finally:
+        if immediate:
+            connection.begin_immediate = False
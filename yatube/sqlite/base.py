@@ -0,0 +1,101 @@
+"""Бэкенд SQLite с настройками для продакшена.
+
+Отличия от ``django.db.backends.sqlite3``:
+
+* журнал WAL: читатели не блокируют писателя и друг друга;
+* PRAGMA ``synchronous``, ``cache_size``, ``mmap_size`` и ``temp_store``
+  из ``OPTIONS['PRAGMAS']`` поверх ``DEFAULT_PRAGMAS``;
+* блок ``yatube.sqlite.immediate_atomic()`` начинает транзакцию с
+  ``BEGIN IMMEDIATE``: блокировка записи берется сразу и ждет
+  ``busy_timeout``, а не падает при попытке повысить читающую транзакцию
+  до пишущей. Обычный ``atomic()`` остается ``BEGIN`` и не мешает
+  читателям сериализоваться на блокировке записи;
+* запрос, получивший ``database is locked``, повторяется до
+  ``OPTIONS['RETRIES']`` раз с растущей паузой.
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'yatube.sqlite',
+            'NAME': '/var/lib/yatube/db.sqlite3',
+            'CONN_MAX_AGE': 600,
+            'OPTIONS': {'timeout': 5, 'RETRIES': 5},
+        }
+    }
+"""
+import time
+
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # В режиме WAL NORMAL не теряет согласованность, только последние
+    # транзакции при отключении питания
+    'synchronous': 'NORMAL',
+    # Отрицательное значение — размер в КиБ
+    'cache_size': -64000,
+    'mmap_size': 256 * 2 ** 20,
+    'temp_store': 'MEMORY',
+}
+
+RETRY_DELAY = 0.05
+
+
+def is_locked(error):
+    return 'database is locked' in str(error)
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    retries = 0
+
+    def _retry(self, method, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return method(*args)
+            except base.Database.OperationalError as error:
+                if attempt == self.retries or not is_locked(error):
+                    raise
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        # param_list может быть генератором: повтору нужен список
+        return self._retry(super().executemany, query, list(param_list))
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Выставляется immediate_atomic() на время входа в блок
+    begin_immediate = False
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self._pragmas = dict(DEFAULT_PRAGMAS, **kwargs.pop('PRAGMAS', {}))
+        self._retries = int(kwargs.pop('RETRIES', 3))
+        kwargs.setdefault('timeout', 5)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = dict(self._pragmas)
+        # Режим журнала хранится в файле базы, а смена режима требует
+        # монопольной блокировки: переключаем, только если он другой
+        journal_mode = pragmas.pop('journal_mode', None)
+        current = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        if journal_mode and current not in (journal_mode.lower(), 'memory'):
+            conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.retries = self._retries
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        if self.begin_immediate:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
+
@@ -3,7 +3,9 @@ from django.conf.urls import handler404, handler500  # NOQA
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.flatpages import views
-from django.urls import include, path
+from django.urls import include, path, re_path
+
+from posts.views import media
 
 handler404 = "posts.views.page_not_found"  # NOQA
 handler500 = "posts.views.server_error"  # NOQA
@@ -35,7 +37,19 @@ if settings.DEBUG:
                       path('__debug__/', include(debug_toolbar.urls)),
                   ] + urlpatterns
 
-    urlpatterns += static(settings.MEDIA_URL,
-                          document_root=settings.MEDIA_ROOT)
+    # В продакшене /media/ отдает веб-сервер с теми же заголовками
+    # для файлов по хешу, например nginx:
+    #
+    #     location /media/ {
+    #         alias /var/www/yatube/media/;
+    #     }
+    #     location ~ "^/media/posts/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$" {
+    #         root /var/www/yatube;
+    #         add_header Cache-Control "public, max-age=31536000, immutable";
+    #     }
+    urlpatterns += [
+        re_path(r'^{}(?P<path>.*)$'.format(settings.MEDIA_URL.lstrip('/')),
+                media, name='media'),
+    ]
     urlpatterns += static(settings.STATIC_URL,
                           document_root=settings.STATIC_ROOT)